@@ -17,9 +17,15 @@ import time
 import threading
 import queue as queue_module
 import base64
+import shutil
+import hashlib
+import tempfile
 from io import BytesIO
+from concurrent.futures import as_completed
 
-from flask import Flask, request, jsonify, render_template, Response
+from flask import Flask, Request, request, jsonify, render_template, Response
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import anthropic
@@ -39,18 +45,69 @@ from prompts import (
     build_counter_draft_prompt,
     build_timeline_prompt,
 )
+from services import (
+    create_document_store,
+    start_reaper,
+    AnalysisCache,
+    analysis_key,
+    prompt_version,
+    ExtractionCache,
+    extraction_key,
+    file_digest,
+    BlobStore,
+    LLMScheduler,
+    RateLimiterRegistry,
+    call_with_backoff,
+    EventLog,
+    RunRegistry,
+    CallMetrics,
+    input_cost,
+    summarize_run,
+    RuntimeMetrics,
+    PageSettings,
+    PdfPagePool,
+    garbled_lines as _garbled_lines,
+    has_garbled_text as _has_garbled_text,
+    unreverse as _unreverse,
+)
 
 load_dotenv()
 
+# Upload ceiling. werkzeug checks it against Content-Length up front and
+# while reading a chunked body, so an oversized upload is never buffered.
+MAX_UPLOAD_MB = int(os.environ.get('FLIPSIDE_MAX_UPLOAD_MB', 10))
+# Photos of one paper document's pages, sent as a single upload
+MAX_UPLOAD_IMAGES = int(os.environ.get('FLIPSIDE_MAX_UPLOAD_IMAGES', 20))
+UPLOAD_SPOOL_DIR = os.environ.get('FLIPSIDE_UPLOAD_DIR') or tempfile.gettempdir()
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files stream into named temp files.
+
+    werkzeug keeps small files in memory and larger ones in anonymous temp
+    files. A named file on disk lets extraction open the upload by path, and
+    an upload job take it over with a hard link, instead of reading it into
+    memory.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        if content_length is not None and content_length > MAX_UPLOAD_MB * 1024 * 1024:
+            raise RequestEntityTooLarge()
+        return tempfile.NamedTemporaryFile('w+b', dir=UPLOAD_SPOOL_DIR, prefix='flipside-',
+                                           suffix='.upload')
+
+
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
 
 # ── JSON error handlers (prevent Flask from returning HTML) ──
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'error': 'File too large. Maximum size is 10 MB.'}), 413
+    return jsonify({'error': f'File too large. Maximum size is {MAX_UPLOAD_MB} MB.'}), 413
 
 
 @app.errorhandler(500)
@@ -75,110 +132,184 @@ if _manual_prefix:
         return _inner_wsgi(environ, start_response)
     app.wsgi_app = _prefix_wsgi
 
-documents = {}
-_documents_lock = threading.Lock()
+documents = create_document_store()
 DOCUMENT_TTL = 30 * 60  # 30 minutes
-
-def _evict_stale_documents():
-    """Remove documents older than DOCUMENT_TTL."""
-    now = time.time()
-    with _documents_lock:
-        stale = [k for k, v in documents.items() if now - v.get('_ts', 0) > DOCUMENT_TTL]
-        for k in stale:
-            del documents[k]
+# Resident byte budget for documents held in memory
+DOCUMENT_BUDGET_BYTES = int(os.environ.get('FLIPSIDE_DOC_BUDGET_MB', 512)) * 1024 * 1024
+# Background reaper: TTL sweep + budget enforcement, independent of uploads
+start_reaper(documents, DOCUMENT_TTL, DOCUMENT_BUDGET_BYTES,
+             interval=int(os.environ.get('FLIPSIDE_REAPER_INTERVAL', 10)))
+
+def get_document(doc_id):
+    """Fetch a document, attaching runtime state if this process lacks it.
+
+    A document loaded from a persistent store (another worker uploaded it, or
+    the server restarted) has no prescan running here — its events start set
+    so /analyze takes the fast path or the blocking-scan fallback.
+    """
+    doc = documents.get(doc_id)
+    if doc is not None and '_prescan_event' not in doc:
+        for key in ('_prescan_event', '_precards_event'):
+            ev = threading.Event()
+            ev.set()
+            doc.setdefault(key, ev)
+    return doc
 
 def store_document(doc_id, doc):
-    """Store a document with a timestamp, evicting stale entries first."""
-    _evict_stale_documents()
+    """Store a document with a timestamp, then trim memory to the byte budget."""
     doc['_ts'] = time.time()
     # Set events BEFORE storing so /analyze can't see doc without them
     doc['_prescan_event'] = threading.Event()
     doc['_precards_event'] = threading.Event()
-    with _documents_lock:
-        documents[doc_id] = doc
-    # Skip prescan for cached samples — replay doesn't need it
-    if doc.get('_sample_type') and doc['_sample_type'] in _sample_cache:
+    # Content-addressed cache: a previously analyzed upload needs no prescan
+    cached = None
+    if not doc.get('_sample_type'):
+        doc['_analysis_key'] = _document_analysis_key(doc)
+        cached = _analysis_cache.get(doc['_analysis_key'])
+        if cached:
+            doc['_prescan'] = cached.get('prescan')
+            doc['_precards'] = cached.get('precards')
+            doc['_card_total'] = len((cached.get('precards') or {}).get('cards') or [])
+            doc['_verdict_text'] = cached.get('verdict_text', '')
+            doc['_deep_dive_texts'] = cached.get('deep_dive_texts', {})
+    documents.put(doc_id, doc)
+    # A burst of PDF uploads can outrun the reaper — check the budget now
+    documents.enforce_budget(DOCUMENT_BUDGET_BYTES)
+    # Skip prescan for cached samples/analyses — replay doesn't need it
+    if cached or (doc.get('_sample_type') and doc['_sample_type'] in _sample_cache):
         doc['_prescan_event'].set()
         doc['_precards_event'].set()
+        if cached:
+            print(f'[analysis_cache] {doc_id[:8]}: hit {doc["_analysis_key"][:12]}')
         return
     # Pre-scan + pre-generate cards during upload
+    prescan_launcher(doc_id)
+
+
+class _PrescanChannel(EventLog):
+    """A document's prescan events, in order: ('preview', clause),
+    ('chunk', idx, text), ('done', idx) and ('prescan_done',).
+
+    Append-only: each reader keeps its own cursor (see EventLog.read), so a
+    second card pipeline for the document (a run after an abandoned one)
+    replays everything instead of finding a drained queue. qsize() is what
+    no reader has reached yet, for the queue_depth gauge."""
+
+    def __init__(self):
+        super().__init__()
+        self._furthest = 0
+
+    def put(self, event):
+        self.append(event)
+
+    def read(self, start, timeout=None):
+        entries, closed = super().read(start, timeout)
+        with self._cond:
+            self._furthest = max(self._furthest, start + len(entries))
+        return entries, closed
+
+    def qsize(self):
+        with self._cond:
+            return len(self._entries) - self._furthest
+
+
+def _thread_prescan_launcher(doc_id):
+    doc = documents.get(doc_id)
+    if doc is not None:
+        # Created before the thread starts so /analyze can block on it at once
+        doc['_prescan_channel'] = runtime_metrics.watch_queue('prescan', _PrescanChannel())
     threading.Thread(
         target=_prescan_document, args=(doc_id,), daemon=True
     ).start()
 
 
+# How store_document starts a prescan. asgi.py swaps in the asyncio engine.
+prescan_launcher = _thread_prescan_launcher
+
+
 def _prescan_document(doc_id):
     """Background: stream clause identification + start card workers immediately.
     Streams Phase 1 so card workers launch as each CLAUSE: line arrives (~3s each),
-    overlapping identification with card generation."""
+    overlapping identification with card generation.
+
+    Everything the analyze pipeline needs goes through one channel, in order:
+    ('preview', clause), ('chunk', idx, text), ('done', idx) and a single
+    ('prescan_done',) once the scan result is stored."""
     doc = documents.get(doc_id)
     if not doc or not doc.get('text'):
         if doc:
-            doc['_prescan'] = None
+            documents.update(doc_id, _prescan=None)
             doc.get('_prescan_event', threading.Event()).set()
             doc.get('_precards_event', threading.Event()).set()
+            if doc.get('_prescan_channel'):
+                doc['_prescan_channel'].put(('prescan_done',))
         return
+    channel = doc.get('_prescan_channel')
+    if channel is None:
+        channel = doc['_prescan_channel'] = runtime_metrics.watch_queue('prescan', _PrescanChannel())
+    scan_announced = False
     try:
         import anthropic as _anthropic
-        client = _anthropic.Anthropic()
+        # SDK retries off: overloads are paced by the shared rate limiter
+        client = _anthropic.Anthropic(max_retries=0)
         fast_model = os.environ.get('FLIPSIDE_FAST_MODEL', 'claude-haiku-4-5-20251001')
-        user_msg = (
-            "Analyze the following document from the drafter's "
-            "strategic perspective.\n\n"
-            "---BEGIN DOCUMENT---\n\n"
-            f"{doc['text']}\n\n"
-            "---END DOCUMENT---"
-        )
-
-        # Pre-build card system prompt (shared across all parallel workers)
-        card_system = build_single_card_system(doc['text'])
+        # Scan and cards share one cached prefix: the document, then (for the
+        # cards) the card instructions
+        prefix = _document_prefix(doc['text'])
+        card_instructions = build_single_card_system()
         card_results = {}
         card_events = {}
-        card_queue = queue_module.Queue()
-        clause_preview_queue = queue_module.Queue()
-        card_stream_queue = queue_module.Queue()  # streaming chunks
         doc['_card_events'] = card_events
         doc['_card_results'] = card_results
-        doc['_card_queue'] = card_queue
-        doc['_clause_preview_queue'] = clause_preview_queue
-        doc['_card_stream_queue'] = card_stream_queue
+
+        limiter = rate_limiters.get(fast_model)
+        batch = _CardBatch()
+        prescan_calls = doc['_prescan_calls'] = []  # perf records, sent with /analyze
 
         def card_worker(idx, user_content):
             max_retries = 3
+            counts = None
             try:
                 for attempt in range(max_retries):
+                    admission = object()
                     try:
+                        limiter.acquire(admission)
                         full_text = ''
-                        with client.messages.stream(
-                            model=fast_model,
-                            max_tokens=3000,
-                            system=[{
-                                'type': 'text',
-                                'text': card_system,
-                                'cache_control': {'type': 'ephemeral'},
-                            }],
-                            messages=[{'role': 'user', 'content': user_content}],
-                        ) as stream:
+                        with call_metrics.timer(f'card_{idx}', fast_model, prescan_calls) as timer, \
+                                client.messages.stream(
+                                    model=fast_model,
+                                    max_tokens=3000,
+                                    messages=_document_messages(
+                                        prefix, card_instructions, user_content,
+                                        shared_instructions=True),
+                                ) as stream:
                             for chunk in stream.text_stream:
+                                timer.first_token()
+                                if idx == 0:
+                                    batch.prime()  # prefix is cached: release the others
                                 full_text += chunk
-                                card_stream_queue.put(('chunk', idx, chunk))
-                        card_stream_queue.put(('done', idx))
-                        card_results[idx] = full_text
-                        card_queue.put((idx, full_text))
-                        return  # success
+                                channel.put(('chunk', idx, chunk))
+                            timer.set_usage(stream.get_final_message().usage)
+                        counts = timer.cache_counts()
                     except Exception as e:
-                        is_overloaded = 'overload' in str(e).lower() or '529' in str(e) or '429' in str(e)
-                        if is_overloaded and attempt < max_retries - 1:
-                            wait = (attempt + 1) * 5  # 5s, 10s
-                            print(f'[precard] {doc_id[:8]} card {idx}: Overloaded, retry {attempt+1} in {wait}s')
+                        retry, wait = limiter.record_error(e, attempt, admission)
+                        if retry and attempt < max_retries - 1:
+                            limiter.record_retry()
+                            print(f'[precard] {doc_id[:8]} card {idx}: Overloaded, retry {attempt+1} in {wait:.1f}s')
                             time.sleep(wait)
                             continue
                         print(f'[precard] {doc_id[:8]} card {idx}: Error: {e}')
                         card_results[idx] = ''
-                        card_stream_queue.put(('done', idx))
-                        card_queue.put((idx, ''))
+                        channel.put(('done', idx))
                         return
+                    limiter.record_success()
+                    card_results[idx] = full_text
+                    channel.put(('done', idx))
+                    return  # success
             finally:
+                if idx == 0:
+                    batch.prime()
+                batch.finished(counts)
                 card_events[idx].set()
 
         # ── Phase 1: STREAMING identification scan ──
@@ -190,59 +321,54 @@ def _prescan_document(doc_id):
         line_buffer = 'CLAUSE:'  # Prefilled assistant turn
         not_applicable = False
 
-        with client.messages.stream(
-            model=fast_model,
-            max_tokens=2000,
-            system=[{
-                'type': 'text',
-                'text': build_clause_id_prompt(),
-                'cache_control': {'type': 'ephemeral'},
-            }],
-            messages=[
-                {'role': 'user', 'content': user_msg},
-                {'role': 'assistant', 'content': 'CLAUSE:'},
-            ],
-        ) as stream:
-            for chunk in stream.text_stream:
-                scan_text += chunk
-                line_buffer += chunk
-
-                # Process complete lines as they arrive
-                while '\n' in line_buffer:
-                    line, line_buffer = line_buffer.split('\n', 1)
-                    stripped = line.strip()
-
-                    if '**Not Applicable**' in stripped:
-                        not_applicable = True
-
-                    if stripped.startswith('CLAUSE:'):
-                        clause = _parse_clause_line(stripped)
-                        if clause:
-                            clauses.append(clause)
-                            i = clause_idx
-                            card_events[i] = threading.Event()
-                            card_user_msg = (
-                                f"Generate a complete flip card for this specific clause:\n\n"
-                                f"Title: {clause['title']}\n"
-                                f"Section Reference: {clause.get('section', 'Not specified')}\n"
-                                f"Prescan Risk: {clause.get('risk', 'RED')}\n"
-                                f"Prescan Trick: {clause.get('trick', '')}\n\n"
-                                f"Find this clause in the document and output the COMPLETE flip card. "
-                                f"Make your own independent risk assessment — the prescan hints above are guidance only."
-                            )
-                            threading.Thread(
-                                target=card_worker, args=(i, card_user_msg), daemon=True
-                            ).start()
-                            clause_idx += 1
-                            # Push preview for frontend loading screen
-                            clause_preview_queue.put({
-                                'index': i,
-                                'title': clause['title'],
-                                'section': clause.get('section', ''),
-                            })
-                            print(f'[prescan] {doc_id[:8]} clause {i}: '
-                                  f'{clause["title"][:40]} — card worker started at '
-                                  f'{round(time.time() - t0, 1)}s')
+        admission = object()
+        limiter.acquire(admission)
+        try:
+            with llm_scheduler.slot(fast_model), call_metrics.timer('scan', fast_model, prescan_calls) as timer:
+                with client.messages.stream(
+                    model=fast_model,
+                    max_tokens=2000,
+                    messages=_document_messages(prefix, build_clause_id_prompt(), ANALYSIS_ASK) + [
+                        {'role': 'assistant', 'content': 'CLAUSE:'},
+                    ],
+                ) as stream:
+                    for chunk in stream.text_stream:
+                        timer.first_token()
+                        scan_text += chunk
+                        line_buffer += chunk
+
+                        # Process complete lines as they arrive
+                        while '\n' in line_buffer:
+                            line, line_buffer = line_buffer.split('\n', 1)
+                            stripped = line.strip()
+
+                            if '**Not Applicable**' in stripped:
+                                not_applicable = True
+
+                            if stripped.startswith('CLAUSE:'):
+                                clause = _parse_clause_line(stripped)
+                                if clause:
+                                    clauses.append(clause)
+                                    i = clause_idx
+                                    card_events[i] = threading.Event()
+                                    card_user_msg = _card_user_message(clause)
+                                    batch.launched()
+                                    batch.submit(i, fast_model, card_worker, i, card_user_msg)
+                                    clause_idx += 1
+                                    # Push preview for frontend loading screen
+                                    channel.put(('preview', {
+                                        'index': i,
+                                        'title': clause['title'],
+                                        'section': clause.get('section', ''),
+                                    }))
+                                    print(f'[prescan] {doc_id[:8]} clause {i}: '
+                                          f'{clause["title"][:40]} — card worker started at '
+                                          f'{round(time.time() - t0, 1)}s')
+                    timer.set_usage(stream.get_final_message().usage)
+        except Exception as e:
+            limiter.record_error(e, holder=admission)
+            raise
+        limiter.record_success()
 
         # Process final line (if no trailing newline)
         if line_buffer.strip().startswith('CLAUSE:'):
@@ -251,18 +377,9 @@ def _prescan_document(doc_id):
                 clauses.append(clause)
                 i = clause_idx
                 card_events[i] = threading.Event()
-                card_user_msg = (
-                    f"Generate a complete flip card for this specific clause:\n\n"
-                    f"Title: {clause['title']}\n"
-                    f"Section Reference: {clause.get('section', 'Not specified')}\n"
-                    f"Prescan Risk: {clause.get('risk', 'RED')}\n"
-                    f"Prescan Trick: {clause.get('trick', '')}\n\n"
-                    f"Find this clause in the document and output the COMPLETE flip card. "
-                    f"Make your own independent risk assessment — the prescan hints above are guidance only."
-                )
-                threading.Thread(
-                    target=card_worker, args=(i, card_user_msg), daemon=True
-                ).start()
+                card_user_msg = _card_user_message(clause)
+                batch.launched()
+                batch.submit(i, fast_model, card_worker, i, card_user_msg)
                 clause_idx += 1
 
         # Parse profile and green text from full scan
@@ -272,17 +389,18 @@ def _prescan_document(doc_id):
         # Green summary card disabled — frontend skips green cards entirely
         total_cards = len(clauses)
 
-        doc['_card_total'] = total_cards
-        doc['_prescan'] = {
+        documents.update(doc_id, _card_total=total_cards, _prescan={
             'scan_text': scan_text,
             'profile_text': profile_text,
             'clauses': clauses,
             'green_text': green_text,
             'seconds': scan_seconds,
-        }
+        })
         print(f'[prescan] {doc_id[:8]}: {len(clauses)} clauses in {scan_seconds}s '
               f'(streaming, {clause_idx} workers already running)')
         doc.get('_prescan_event', threading.Event()).set()
+        channel.put(('prescan_done',))
+        scan_announced = True
 
         # Wait for all cards (for fast-path / _precards compatibility)
         if clauses and not not_applicable:
@@ -290,23 +408,117 @@ def _prescan_document(doc_id):
                 card_events[idx].wait(timeout=30)
 
             cards_seconds = round(time.time() - t0 - scan_seconds, 1)
-            doc['_precards'] = {
+            documents.update(doc_id, _precards={
                 'cards': [card_results.get(i, '') for i in range(total_cards)],
                 'seconds': cards_seconds,
-            }
+            })
             print(f'[precard] {doc_id[:8]}: {total_cards} cards in {cards_seconds}s '
                   f'(total {round(scan_seconds + cards_seconds, 1)}s)')
+            batch.record(doc_id)
         else:
-            doc['_precards'] = None
+            documents.update(doc_id, _precards=None)
 
     except Exception as e:
         print(f'[prescan] {doc_id[:8]}: Error: {e}')
         # Preserve any partial prescan data; default to None if absent
         if not doc.get('_prescan'):
-            doc['_prescan'] = None
+            documents.update(doc_id, _prescan=None)
     finally:
         doc.get('_prescan_event', threading.Event()).set()
         doc.get('_precards_event', threading.Event()).set()
+        if not scan_announced:
+            channel.put(('prescan_done',))
+
+
+# The request every analysis thread (and the clause scan) ends with
+ANALYSIS_ASK = "Analyze the document above from the drafter's strategic perspective."
+
+
+def _document_prefix(text, page_images=None):
+    """Content blocks every call about a document starts with.
+
+    Document text, then the page images (page_images holds page blob
+    digests aligned with page numbers; None marks a page without one), each
+    part ending in a cache breakpoint. Images are base64-encoded here, at
+    the edge, and the encoding is shared by every call that sends the page.
+
+    Built identically for the verdict, the five deep dives, the scan, the
+    card workers and the follow-up routes, so each model writes the prefix
+    once and every other call reads it from the prompt cache."""
+    prefix = [{
+        'type': 'text',
+        'text': f'---BEGIN DOCUMENT---\n\n{text}\n\n---END DOCUMENT---',
+        'cache_control': {'type': 'ephemeral'},
+    }]
+    for i, ref in enumerate(page_images or []):
+        img_b64 = _page_blobs.encoded(ref) if ref else None
+        if not img_b64:
+            continue
+        prefix.append({'type': 'text', 'text': f'[Page {i + 1} visual layout:]'})
+        prefix.append({
+            'type': 'image',
+            'source': {'type': 'base64', 'media_type': 'image/jpeg', 'data': img_b64},
+        })
+    if len(prefix) > 1:
+        prefix[-1] = {**prefix[-1], 'cache_control': {'type': 'ephemeral'}}
+    return prefix
+
+
+def _document_messages(prefix, instructions, ask, shared_instructions=False):
+    """User turn for one call: the document prefix, then this thread's
+    instructions and request. Pass shared_instructions when many calls repeat
+    the same instructions (card workers) to cache them after the prefix."""
+    instructions_block = {'type': 'text', 'text': instructions}
+    if shared_instructions:
+        instructions_block['cache_control'] = {'type': 'ephemeral'}
+    return [{'role': 'user', 'content': prefix + [
+        instructions_block, {'type': 'text', 'text': ask}]}]
+
+
+def _card_user_message(clause):
+    """User turn for one per-clause card worker."""
+    return (
+        f"Generate a complete flip card for this specific clause:\n\n"
+        f"Title: {clause['title']}\n"
+        f"Section Reference: {clause.get('section', 'Not specified')}\n"
+        f"Prescan Risk: {clause.get('risk', 'RED')}\n"
+        f"Prescan Trick: {clause.get('trick', '')}\n\n"
+        f"Find this clause in the document and output the COMPLETE flip card. "
+        f"Make your own independent risk assessment — the prescan hints above are guidance only."
+    )
+
+
+def _doc_context_prompt(full):
+    """Haiku prompt for loading-screen metadata (type, drafter, jurisdiction...)."""
+    text_preview = full[:3000]
+    if len(full) > 5000:
+        text_preview += '\n\n[...]\n\n' + full[-1500:]
+    return (
+        'Extract factual metadata from this document excerpt. '
+        'Respond ONLY with these fields, one per line. '
+        'If unknown, write "Unknown".\n\n'
+        'TYPE: [document type, e.g. "Residential Lease", "Gym Membership", "Insurance Policy"]\n'
+        'DRAFTER: [organization/company name that drafted this]\n'
+        'OTHER_PARTY: [who signs/receives this, e.g. "Tenant", "Member", "Policyholder"]\n'
+        'JURISDICTION: [country or state from governing law clause, registered address, or company HQ — e.g. "California, USA", "England & Wales"]\n'
+        'DATE: [document date or effective date if stated]\n'
+        'DURATION: [contract duration if stated, e.g. "12 months", "24 months"]\n'
+        'KEY_AMOUNT: [main financial figure, e.g. "$1,450/month", "$350 adoption fee"]\n\n'
+        f'DOCUMENT:\n{text_preview}'
+    )
+
+
+def _parse_doc_context(text):
+    """Parse KEY: value lines from the doc-context reply, dropping unknowns."""
+    result = {}
+    for line in text.strip().split('\n'):
+        if ':' in line:
+            key, val = line.split(':', 1)
+            key = key.strip().upper().replace(' ', '_')
+            val = val.strip()
+            if val and val.lower() != 'unknown' and val != 'N/A':
+                result[key] = val
+    return result
 
 
 def _build_claims_summary(prescan, precards):
@@ -364,12 +576,474 @@ def _build_claims_summary(prescan, precards):
 MODEL = os.environ.get('FLIPSIDE_MODEL', 'claude-opus-4-6')
 FAST_MODEL = os.environ.get('FLIPSIDE_FAST_MODEL', 'claude-haiku-4-5-20251001')
 
+# Shared scheduler: bounded pool + per-model concurrency caps for every LLM call
+llm_scheduler = LLMScheduler(
+    max_workers=int(os.environ.get('FLIPSIDE_LLM_POOL_SIZE', 64)),
+    limits={
+        MODEL: int(os.environ.get('FLIPSIDE_OPUS_CONCURRENCY', 24)),
+        FAST_MODEL: int(os.environ.get('FLIPSIDE_HAIKU_CONCURRENCY', 32)),
+    },
+)
+
+# Shared per-model rate limiter + circuit breaker for Anthropic overloads
+rate_limiters = RateLimiterRegistry(
+    rate=float(os.environ.get('FLIPSIDE_RATE_PER_SEC', 5)),
+    max_rate=float(os.environ.get('FLIPSIDE_RATE_MAX_PER_SEC', 50)),
+)
+
+# ── Upstream cancellation accounting ──
+# Streams stopped early (client disconnect, not-applicable, timeout) and the
+# output they never generated. Tokens are estimated at ~4 chars each; "saved"
+# is the unspent max_tokens budget of each stopped call, so it is an upper bound.
+SSE_KEEPALIVE = ': keepalive\n\n'  # SSE comment, ignored by the frontend
+SSE_KEEPALIVE_SECONDS = 15
+_cancel_lock = threading.Lock()
+_cancel_stats = {
+    'disconnects': {},             # route -> count
+    'streams_cancelled': 0,        # upstream streams closed mid-response
+    'calls_skipped': 0,            # calls cancelled while still queued
+    'output_tokens_streamed': 0,   # generated before the stop
+    'output_tokens_saved_max': 0,  # unspent max_tokens budget
+}
+
+
+def _delta_chars(event):
+    """Characters of text/thinking carried by one raw stream event."""
+    delta = getattr(event, 'delta', None)
+    return len(getattr(delta, 'text', None) or getattr(delta, 'thinking', None) or '')
+
+
+def _record_cancelled_call(max_tokens, chars_streamed=0, started=True):
+    """Account for one upstream call stopped before it finished."""
+    streamed = chars_streamed // 4
+    with _cancel_lock:
+        _cancel_stats['streams_cancelled' if started else 'calls_skipped'] += 1
+        _cancel_stats['output_tokens_streamed'] += streamed
+        _cancel_stats['output_tokens_saved_max'] += max(0, max_tokens - streamed)
+
+
+def _record_disconnect(route):
+    """Count a client that closed its SSE stream before the end."""
+    with _cancel_lock:
+        _cancel_stats['disconnects'][route] = _cancel_stats['disconnects'].get(route, 0) + 1
+    print(f'[disconnect] {route}: client closed the stream')
+
+
+# ── Per-call accounting ──
+# Every upstream call is timed: input, output, cache-read and cache-write
+# tokens, time to first token and duration. Totals per thread (card workers
+# pooled under 'card') are served on /metrics; each analysis also gets its
+# own records as a final `perf` event. The document prefix should be written
+# once per model per document and read by every other thread.
+PROMPT_CACHE_FIELDS = ('cache_read_input_tokens', 'cache_creation_input_tokens', 'input_tokens')
+# Deep dives wait this long for the verdict to write the Opus prefix
+CACHE_PRIME_SECONDS = float(os.environ.get('FLIPSIDE_CACHE_PRIME_SECONDS', 8))
+
+
+class _SubmitGate:
+    """Scheduler submissions held back until open() (or `timeout` seconds
+    after the first one is held; 0 = never held).
+
+    Work that has to wait for another call to prime the prompt cache waits
+    here, not inside its worker, where it would hold a model slot and a pool
+    thread while sending nothing. on_timeout(n) is told how many
+    submissions the timeout released.
+    """
+
+    def __init__(self, timeout, on_timeout=None):
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.opened = threading.Event()
+        self._held = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, model, fn, *args, **kwargs):
+        with self._lock:
+            if self.timeout and not self.opened.is_set():
+                self._held.append((model, fn, args, kwargs))
+                if self._timer is None:
+                    self._timer = threading.Timer(self.timeout, self._expire)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        llm_scheduler.submit(model, fn, *args, **kwargs)
+
+    def open(self):
+        """Submit everything held; later submissions go straight through."""
+        return self._release()
+
+    def _expire(self):
+        self._release(timed_out=True)
+
+    def _release(self, timed_out=False):
+        with self._lock:
+            if self.opened.is_set():
+                return 0
+            self.opened.set()
+            held, self._held = self._held, []
+            if self._timer is not None:
+                self._timer.cancel()
+        if timed_out and held and self.on_timeout:
+            self.on_timeout(len(held))
+        for model, fn, args, kwargs in held:
+            llm_scheduler.submit(model, fn, *args, **kwargs)
+        return len(held)
+
+
+def _log_call(record):
+    ttft = f'{record["ttft"]:.1f}s' if record['ttft'] is not None else '-'
+    print(f'[call] {record["label"]}: {record["seconds"]:.1f}s (ttft {ttft}), '
+          f'{record["cache_read_input_tokens"]} read, '
+          f'{record["cache_creation_input_tokens"]} written, '
+          f'{record["input_tokens"]} uncached, {record["output_tokens"]} out'
+          + (' [error]' if record['error'] else ''))
+
+
+call_metrics = CallMetrics(on_record=_log_call)
+
+
+def _prompt_cache_summary():
+    """Per-thread cache reads/writes and the share of input read from cache."""
+    return {label: {'calls': totals['calls'], 'hit_rate': totals['hit_rate'],
+                    **{field: totals[field] for field in PROMPT_CACHE_FIELDS}}
+            for label, totals in call_metrics.stats().items()}
+
+
+def _perf_event(records):
+    """JSON for the `perf` SSE event sent just before a stream's `done`."""
+    return json.dumps(summarize_run(records))
+
+
+# ── Card priming ──
+# Card workers repeat the same cached prefix (document + card instructions),
+# but a cache entry is only readable once the call writing it has started
+# responding. Card 0 goes first; the others are held back (before taking a
+# Haiku slot) until its first token, at most CARD_PRIME_SECONDS (0 = launch
+# them all at once, as before). Each prescan's
+# batch is recorded so the two modes can be compared on /cache-status.
+CARD_PRIME_SECONDS = float(os.environ.get('FLIPSIDE_CARD_PRIME_SECONDS', 3))
+# The card pipeline gives up on a prescan silent for this long after its scan
+CARD_STALL_SECONDS = float(os.environ.get('FLIPSIDE_CARD_STALL_SECONDS', 60))
+_card_priming_lock = threading.Lock()
+_card_priming_stats = {
+    'batches': 0, 'cards': 0, 'prime_timeouts': 0,
+    'first_card_seconds': 0.0, 'all_cards_seconds': 0.0,
+    **{field: 0 for field in PROMPT_CACHE_FIELDS},
+}
+
+
+def _record_card_batch(cards, first_card_seconds, all_cards_seconds, counts, prime_timeouts=0):
+    """Account for one prescan's card workers (times from the first launch)."""
+    with _card_priming_lock:
+        stats = _card_priming_stats
+        stats['batches'] += 1
+        stats['cards'] += cards
+        stats['prime_timeouts'] += prime_timeouts
+        stats['first_card_seconds'] += first_card_seconds
+        stats['all_cards_seconds'] += all_cards_seconds
+        for field in PROMPT_CACHE_FIELDS:
+            stats[field] += counts.get(field, 0)
+
+
+def _card_priming_summary():
+    """Average card latency and input cost per batch under the current mode."""
+    with _card_priming_lock:
+        stats = dict(_card_priming_stats)
+    batches = stats['batches'] or 1
+    return {
+        'prime_seconds': CARD_PRIME_SECONDS,
+        'batches': stats['batches'],
+        'cards': stats['cards'],
+        'prime_timeouts': stats['prime_timeouts'],
+        'avg_first_card_seconds': round(stats['first_card_seconds'] / batches, 2),
+        'avg_all_cards_seconds': round(stats['all_cards_seconds'] / batches, 2),
+        **{field: stats[field] for field in PROMPT_CACHE_FIELDS},
+        'input_cost_tokens': round(input_cost(stats)),
+    }
+
+
+class _CardBatch:
+    """Priming gate and measurements for one prescan's card workers."""
+
+    def __init__(self):
+        self.gate = _SubmitGate(CARD_PRIME_SECONDS, self.prime_timed_out)
+        self.lock = threading.Lock()
+        self.launched_at = None
+        self.first_done = None
+        self.last_done = None
+        self.cards = 0
+        self.prime_timeouts = 0
+        self.counts = {field: 0 for field in PROMPT_CACHE_FIELDS}
+
+    def launched(self):
+        with self.lock:
+            if self.launched_at is None:
+                self.launched_at = time.time()
+
+    def submit(self, idx, model, fn, *args, **kwargs):
+        """Submit card `idx`'s worker: card 0 at once, the others once it has
+        primed the cache (capped). Held cards take no slot or pool thread."""
+        if idx == 0:
+            llm_scheduler.submit(model, fn, *args, **kwargs)
+        else:
+            self.gate.submit(model, fn, *args, **kwargs)
+
+    def prime(self):
+        """Card 0 is responding (or gave up): release the other cards."""
+        self.gate.open()
+
+    def prime_timed_out(self, cards=1):
+        with self.lock:
+            self.prime_timeouts += cards
+
+    def finished(self, counts):
+        now = time.time()
+        with self.lock:
+            self.cards += 1
+            self.first_done = self.first_done or now
+            self.last_done = now
+            for field in PROMPT_CACHE_FIELDS:
+                self.counts[field] += (counts or {}).get(field, 0)
+
+    def record(self, doc_id):
+        """Log and aggregate the batch once every card has finished."""
+        if not self.cards or self.launched_at is None:
+            return
+        first = round(self.first_done - self.launched_at, 2)
+        total = round(self.last_done - self.launched_at, 2)
+        _record_card_batch(self.cards, first, total, self.counts, self.prime_timeouts)
+        print(f'[precard] {doc_id[:8]}: first card {first}s, all {self.cards} in {total}s, '
+              f'input cost {round(input_cost(self.counts))} tokens '
+              f'(priming {CARD_PRIME_SECONDS:g}s, {self.prime_timeouts} timeouts)')
+
+
+# ── Runtime metrics ──
+# Live load for sizing and regression checks, served in the Prometheus text
+# format on /metrics/prometheus (/metrics stays the JSON per-call view).
+# Request paths record counters and histograms; gauges are read from the
+# other services at scrape time by _runtime_samples().
+runtime_metrics = RuntimeMetrics()
+for _name, _kind, _help in (
+    ('documents', 'gauge', 'Documents in the store'),
+    ('documents_resident', 'gauge', 'Documents held in this process'),
+    ('document_resident_bytes', 'gauge', 'Resident document bytes by field'),
+    ('upstream_calls_in_flight', 'gauge', 'Open upstream LLM calls by model'),
+    ('upstream_slot_waiting', 'gauge', 'Calls waiting for a model concurrency slot'),
+    ('llm_pool_active', 'gauge', 'Busy LLM scheduler pool threads'),
+    ('llm_pool_queued', 'gauge', 'Calls queued for the LLM scheduler pool'),
+    ('queues', 'gauge', 'Live event queues by kind'),
+    ('queue_depth', 'gauge', 'Items waiting across live queues of a kind'),
+    ('queue_depth_max', 'gauge', 'Deepest live queue of a kind'),
+    ('sample_cache_requests_total', 'counter', 'Sample analyses by cache result'),
+    ('analysis_cache_requests_total', 'counter', 'Upload analysis cache lookups by result'),
+    ('extraction_cache_requests_total', 'counter', 'Uploaded file extraction cache lookups by result'),
+    ('pdf_pages_rendered_total', 'counter', 'PDF page images drawn, by why the page needed one'),
+    ('page_images_lost_total', 'counter', 'Evicted page images with no PDF to render them from'),
+    ('upstream_calls_total', 'counter', 'Finished upstream LLM calls by thread'),
+    ('upstream_call_errors_total', 'counter', 'Failed upstream LLM call attempts by thread'),
+    ('upstream_retries_total', 'counter', 'Upstream calls retried after an error'),
+    ('upstream_overloads_total', 'counter', 'Upstream 429/529 overload responses'),
+    ('upstream_server_errors_total', 'counter', 'Upstream 5xx and connection errors'),
+    ('upstream_rejected_total', 'counter', 'Calls refused by an open circuit breaker'),
+    ('sse_connections', 'gauge', 'Open SSE connections by route'),
+    ('sse_connections_opened_total', 'counter', 'SSE connections served by route'),
+    ('analysis_runs_live', 'gauge', 'Live analysis and on-demand stream runs'),
+    ('card_pipeline_runs_total', 'counter', 'Card pipelines that followed a prescan channel'),
+    ('card_pipeline_wakeups_total', 'counter', 'Card pipeline wakeups on its prescan channel'),
+    ('card_pipeline_events_total', 'counter', 'Prescan channel events read by card pipelines'),
+):
+    runtime_metrics.describe(_name, _kind, _help)
+runtime_metrics.describe('time_to_first_card_seconds', 'histogram',
+                         'Live /analyze start to the first complete card')
+runtime_metrics.describe('time_to_verdict_seconds', 'histogram',
+                         'Live /analyze start to the end of the Opus verdict')
+runtime_metrics.describe('extraction_seconds', 'histogram',
+                         'Upload text extraction time by file type',
+                         buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 60))
+
+
+def _runtime_samples():
+    """Point-in-time gauges and counters owned by the other services."""
+    store = documents.stats()
+    samples = [
+        ('documents', {}, store['documents']),
+        ('documents_resident', {}, store['resident_documents']),
+    ]
+    samples += [('document_resident_bytes', {'field': field}, n)
+                for field, n in store['resident_bytes_by_field'].items()]
+    samples += [('upstream_calls_in_flight', {'model': model}, n)
+                for model, n in call_metrics.in_flight().items()]
+    sched = llm_scheduler.stats()
+    samples += [('llm_pool_active', {}, sched['pool_active']),
+                ('llm_pool_queued', {}, sched['pool_queued'])]
+    samples += [('upstream_slot_waiting', {'model': model}, gate['waiting'])
+                for model, gate in sched['models'].items()]
+    for kind, (count, depth, deepest) in runtime_metrics.queue_depths().items():
+        samples += [('queues', {'queue': kind}, count),
+                    ('queue_depth', {'queue': kind}, depth),
+                    ('queue_depth_max', {'queue': kind}, deepest)]
+    cache = _analysis_cache.stats()
+    samples += [('analysis_cache_requests_total', {'result': 'hit'}, cache['hits']),
+                ('analysis_cache_requests_total', {'result': 'miss'}, cache['misses'])]
+    cache = _extraction_cache.stats()
+    samples += [('extraction_cache_requests_total', {'result': 'hit'}, cache['hits']),
+                ('extraction_cache_requests_total', {'result': 'miss'}, cache['misses'])]
+    for thread, totals in call_metrics.stats().items():
+        samples += [('upstream_calls_total', {'thread': thread}, totals['calls']),
+                    ('upstream_call_errors_total', {'thread': thread}, totals['errors'])]
+    for model, limiter in rate_limiters.stats().items():
+        samples += [('upstream_retries_total', {'model': model}, limiter['retries']),
+                    ('upstream_overloads_total', {'model': model}, limiter['overloads']),
+                    ('upstream_server_errors_total', {'model': model}, limiter['server_errors']),
+                    ('upstream_rejected_total', {'model': model}, limiter['rejected'])]
+    samples.append(('analysis_runs_live', {}, len(stream_runs.stats()['live'])))
+    return samples
+
+
+runtime_metrics.add_collector(_runtime_samples)
+
+
+def _counted_stream(route, chunks):
+    """Serve an SSE generator while counting it as an open connection."""
+    runtime_metrics.inc('sse_connections_opened_total', route=route)
+    with runtime_metrics.track('sse_connections', route=route):
+        yield from chunks
+
+
+class _RunMilestones:
+    """Time to first card and to verdict for one live analysis run, read
+    off the SSE chunks it publishes. Cards arrive as `text` events split by
+    --- separators, after the document profile — the same rule the frontend
+    uses to build a card."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.started = time.time()
+        self.card_text = ''
+        self.first_card = None
+        self.verdict = None
+
+    def see(self, chunk, etype):
+        if etype == 'text' and self.first_card is None:
+            try:
+                self.card_text += json.loads(chunk.split('data: ', 1)[1])['content']
+            except Exception:
+                return
+            if len(re.findall(r'\n+---\n+', self.card_text)) >= 2:
+                self.first_card = time.time() - self.started
+                self.card_text = ''
+                runtime_metrics.observe('time_to_first_card_seconds', self.first_card,
+                                        engine=self.engine)
+        elif etype == 'overall_done' and self.verdict is None:
+            self.verdict = time.time() - self.started
+            runtime_metrics.observe('time_to_verdict_seconds', self.verdict,
+                                    engine=self.engine)
+
+
+# Live SSE streams (/analyze and the on-demand routes): one producer per key,
+# any number of subscribers, resumable by event id after a dropped connection
+stream_runs = RunRegistry(
+    grace=float(os.environ.get('FLIPSIDE_RECONNECT_GRACE', 10)),
+    retain=float(os.environ.get('FLIPSIDE_STREAM_RETAIN', 120)),
+    max_retained_bytes=int(os.environ.get('FLIPSIDE_STREAM_RETAIN_MB', 64)) * 1024 * 1024,
+)
+
+
+def _document_in_use(doc_id):
+    """A run keyed on the document (its analysis, an on-demand stream or its
+    upload job) is live, so the byte budget must not drop its dict."""
+    prefix = f'{doc_id}/'
+    return any(key == doc_id or key.startswith(prefix) for key in stream_runs.live_keys())
+
+
+documents.in_use = _document_in_use
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+    'Connection': 'keep-alive',
+}
+
+
+def _resume_offset():
+    """Index of the first event this client still needs (Last-Event-ID + 1).
+    EventSource sends the header when it reconnects; fetch-based clients can
+    pass ?last_event_id= instead. 0 means a fresh stream."""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return max(0, int(raw) + 1)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _follow_run(key, route, start_run, resume_from=0, replay_finished=False):
+    """Subscriber side of a run: join it (starting it via `start_run` if
+    needed), replay from `resume_from`, then tail. Every event carries its
+    index as the SSE id; idle gaps get a keepalive comment. With
+    replay_finished a finished run is replayed even on a fresh connection
+    (a background job's log, which start_run can't reproduce)."""
+    log, started = stream_runs.join(key, start_run, resume=resume_from > 0 or replay_finished)
+    pos = 0 if started else resume_from
+    try:
+        while True:
+            entries, closed = log.read(pos, timeout=SSE_KEEPALIVE_SECONDS)
+            if entries:
+                for chunk in entries:
+                    yield f'id: {pos}\n{chunk}'
+                    pos += 1
+            elif closed:
+                return
+            else:
+                # Nothing new — writing a comment still surfaces a closed socket
+                yield SSE_KEEPALIVE
+    except GeneratorExit:
+        if not log.closed:
+            _record_disconnect(route)
+        raise
+    finally:
+        # Last viewer gone: the run is cancelled unless someone reconnects
+        stream_runs.leave(key, log)
+
+
+def _resumable_response(key, route, generate):
+    """SSE Response whose producer, `generate()`, runs once per key in a
+    background thread, so a dropped client can resume with Last-Event-ID
+    and a second viewer joins instead of re-running the model."""
+    resume_from = _resume_offset()
+
+    def start_run(log):
+        cancel = threading.Event()
+
+        def produce():
+            gen = generate()
+            try:
+                for chunk in gen:
+                    if cancel.is_set():
+                        break
+                    log.append(chunk)
+            finally:
+                # If abandoned, GeneratorExit inside generate() closes its upstream stream
+                gen.close()
+                stream_runs.finish(key, log)
+
+        threading.Thread(target=produce, daemon=True).start()
+        return cancel.set
+
+    return Response(
+        _counted_stream(route, _follow_run(key, route, start_run, resume_from)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+
+
 # Module-level client for utility functions (text cleaning etc.)
 _client = None
 def get_client():
     global _client
     if _client is None:
-        _client = anthropic.Anthropic()
+        _client = anthropic.Anthropic(max_retries=0)  # retries via rate_limiters
     return _client
 
 PHASE_MARKERS = [
@@ -402,7 +1076,8 @@ for _key in SAMPLE_DOCUMENTS:
 # Sample cache — pre-recorded SSE streams for offline demos
 # ---------------------------------------------------------------------------
 
-_SAMPLE_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'sample_cache.json')
+_SAMPLE_CACHE_PATH = os.environ.get('FLIPSIDE_SAMPLE_CACHE') or os.path.join(
+    os.path.dirname(__file__), 'data', 'sample_cache.json')
 _sample_cache = {}
 if os.path.exists(_SAMPLE_CACHE_PATH):
     try:
@@ -420,6 +1095,160 @@ def _save_sample_cache():
     print(f'  Sample cache saved: {len(_sample_cache)} samples')
 
 
+def _event_type(chunk):
+    """The `type` of one SSE chunk ('' if it isn't a data event)."""
+    try:
+        return json.loads(chunk.split('data: ', 1)[1]).get('type', '')
+    except Exception:
+        return ''
+
+
+def _replay_events(events, start=0):
+    """Yield recorded SSE chunks with compressed timing (~10s for a full run).
+    Each chunk is tagged with its index as SSE id; `start` skips what a
+    resuming client (Last-Event-ID) already has."""
+    batch = 0
+    for i, chunk in enumerate(events[start:], start):
+        yield f'id: {i}\n{chunk}'
+        etype = _event_type(chunk)
+        if etype == 'quick_done':
+            time.sleep(0.2)
+        elif etype == 'phase':
+            time.sleep(0.05)
+        elif etype in ('overall_thinking', 'clause_preview'):
+            batch += 1
+            if batch % 5 == 0:  # Only sleep every 5th thinking token
+                time.sleep(0.002)
+        elif etype == 'done':
+            pass
+        else:
+            time.sleep(0.001)
+
+
+def _stream_has_event(events, event_type):
+    """True if any recorded SSE chunk carries the given event type."""
+    return any(f'"type": "{event_type}"' in e or f'"type":"{event_type}"' in e
+               for e in events)
+
+
+# ---------------------------------------------------------------------------
+# Analysis cache — finished analyses of real uploads, keyed by content hash
+# ---------------------------------------------------------------------------
+
+_ANALYSIS_CACHE_DIR = os.environ.get('FLIPSIDE_ANALYSIS_CACHE_DIR') or os.path.join(
+    os.path.dirname(__file__), 'data', 'analysis_cache')
+_analysis_cache = AnalysisCache(
+    _ANALYSIS_CACHE_DIR,
+    max_entries=int(os.environ.get('FLIPSIDE_ANALYSIS_CACHE_ENTRIES', 500)),
+)
+
+# Any prompt edit changes this hash, so stale analyses are never replayed
+PROMPT_VERSION = prompt_version(
+    ANALYSIS_ASK,
+    build_clause_id_prompt(),
+    build_single_card_system(),
+    build_verdict_prompt(has_images=False),
+    build_verdict_prompt(has_images=True),
+    build_archaeology_prompt(has_images=False),
+    build_archaeology_prompt(has_images=True),
+    build_scenario_prompt(),
+    build_walkaway_prompt(),
+    build_combinations_prompt(),
+    build_playbook_prompt(),
+)
+
+
+def _document_analysis_key(doc):
+    """Analysis cache key: normalized text + model IDs + prompt version.
+    An async upload's page images may still be rendering (vision_pages)."""
+    vision = doc.get('_vision_requested')
+    return analysis_key(
+        doc.get('text', ''), (MODEL, FAST_MODEL),
+        f'{PROMPT_VERSION}:all-pages' if vision else PROMPT_VERSION,
+        has_images=bool(vision or any(doc.get('page_images') or []) or doc.get('vision_pages')),
+    )
+
+
+def _request_vision(doc_id, doc):
+    """/analyze?vision=1: show Opus the first MAX_VISION_PAGES pages of a
+    PDF even where extraction saw no need to render them. The analysis
+    differs from a text-only one, so it gets its own cache key. Both are
+    written through the store, so the next get() doesn't restore the
+    text-only key and other workers see the request."""
+    if doc.get('_vision_requested') or doc.get('_sample_type'):
+        return
+    if not (doc.get('filename') or '').lower().endswith('.pdf'):
+        return
+    key = _document_analysis_key({**doc, '_vision_requested': True})
+    documents.update(doc_id, _vision_requested=True, _analysis_key=key)
+
+
+def _vision_pages(doc_id, doc):
+    """The document's page images for vision calls: page blob digests
+    aligned with page numbers (None for pages without one).
+
+    Waits (bounded) for an async upload that stored its text before the
+    images were rendered. Pages that should have an image but don't — every
+    page up to MAX_VISION_PAGES once vision was requested, or an image
+    evicted from the page blob store — are rendered from the retained PDF
+    and stored on the document for later runs and other workers. Without
+    that PDF (photo uploads, or a PDF evicted itself) they are logged,
+    counted in page_images_lost_total and sent as None.
+    """
+    ready = doc.get('_images_ready')
+    if ready is not None and not ready.wait(IMAGES_WAIT_SECONDS):
+        print(f'[upload] page images not ready after {IMAGES_WAIT_SECONDS:g}s, analyzing text only')
+        return []
+    images = list(doc.get('page_images') or [])
+    wanted = range(MAX_VISION_PAGES) if doc.get('_vision_requested') else doc.get('vision_pages') or []
+    missing = [i for i in wanted
+               if i >= len(images) or not images[i] or _page_blobs.path(images[i]) is None]
+    if not missing:
+        return images
+    path = _pdf_sources.path(doc['pdf_digest']) if doc.get('pdf_digest') else None
+    if path is None:
+        lost = [i for i in missing if i < len(images) and images[i]]
+        if lost:
+            print(f'[vision] {doc.get("filename")}: images of pages '
+                  f'{", ".join(str(i + 1) for i in lost)} were evicted and there is '
+                  f'no PDF to render them from, those pages stay text-only')
+            runtime_metrics.inc('page_images_lost_total', len(lost))
+            for i in lost:
+                images[i] = None
+        elif doc.get('pdf_digest'):
+            print(f'[vision] source PDF of {doc.get("filename")} is gone, '
+                  f'{len(missing)} pages stay text-only')
+        return images
+    t0 = time.time()
+    rendered = pdf_page_pool.render(path, missing, PDF_PAGE_SETTINGS)
+    for i, image in rendered.items():
+        images.extend([None] * (i + 1 - len(images)))
+        images[i] = _page_blobs.put(image) if image else None
+    runtime_metrics.inc('pdf_pages_rendered_total', sum(1 for img in rendered.values() if img),
+                        reason='demand')
+    print(f'[vision] rendered {len(rendered)} pages of {doc.get("filename")} '
+          f'on demand in {time.time() - t0:.2f}s')
+    documents.update(doc_id, page_images=images)
+    return images
+
+
+def _save_analysis(doc, recording):
+    """Cache a finished live analysis. Runs with errors are never cached."""
+    key = doc.get('_analysis_key')
+    if not key or not recording:
+        return
+    if _stream_has_event(recording, 'error') or not _stream_has_event(recording, 'done'):
+        return
+    _analysis_cache.put(key, {
+        'prescan': doc.get('_prescan'),
+        'precards': doc.get('_precards'),
+        'verdict_text': doc.get('_verdict_text', ''),
+        'deep_dive_texts': doc.get('_deep_dive_texts', {}),
+        'events': recording,
+    })
+    print(f'[analysis_cache] Saved {len(recording)} events for {key[:12]}')
+
+
 # ---------------------------------------------------------------------------
 # Message wall — visitor guestbook
 # ---------------------------------------------------------------------------
@@ -487,169 +1316,239 @@ MAX_VISION_PAGES = 10
 VISION_DPI = 150
 MAX_IMAGE_DIMENSION = 4000   # px – well under Anthropic's 8000px hard limit
 MAX_IMAGE_BYTES = 4 * 1024 * 1024  # 4 MB – under the 5 MB API limit
+PDF_PAGE_SETTINGS = PageSettings(
+    dpi=VISION_DPI,
+    max_vision_pages=MAX_VISION_PAGES,
+    max_dimension=MAX_IMAGE_DIMENSION,
+    max_image_bytes=MAX_IMAGE_BYTES,
+    # Draw every vision page, not only those with poor text or a visual layout
+    eager=os.environ.get('FLIPSIDE_EAGER_RENDER') == '1',
+)
+# Page text, rendering and OCR run in worker processes (0 = one per core)
+pdf_page_pool = PdfPagePool(workers=int(os.environ.get('FLIPSIDE_PDF_WORKERS', 0)) or None)
+# How long /analyze waits for an async upload's page images before going text-only
+IMAGES_WAIT_SECONDS = float(os.environ.get('FLIPSIDE_IMAGES_WAIT', 60))
+
+# Extraction cache — a re-uploaded file skips rendering, OCR and cleanup
+_EXTRACTION_CACHE_DIR = os.environ.get('FLIPSIDE_EXTRACTION_CACHE_DIR') or os.path.join(
+    os.path.dirname(__file__), 'data', 'extraction_cache')
+_extraction_cache = ExtractionCache(
+    _EXTRACTION_CACHE_DIR,
+    max_bytes=int(os.environ.get('FLIPSIDE_EXTRACTION_CACHE_MB', 512)) * 1024 * 1024,
+)
+# Uploaded PDFs are kept so pages skipped at upload can be rendered later
+_PDF_SOURCE_DIR = os.environ.get('FLIPSIDE_PDF_SOURCE_DIR') or os.path.join(
+    os.path.dirname(__file__), 'data', 'pdf_sources')
+_pdf_sources = BlobStore(
+    _PDF_SOURCE_DIR,
+    max_bytes=int(os.environ.get('FLIPSIDE_PDF_SOURCE_MB', 1024)) * 1024 * 1024,
+    suffix='.pdf',
+)
+# Page images: raw JPEGs stored once by digest; documents hold the digests
+_PAGE_BLOB_DIR = os.environ.get('FLIPSIDE_PAGE_BLOB_DIR') or os.path.join(
+    os.path.dirname(__file__), 'data', 'page_blobs')
+_page_blobs = BlobStore(
+    _PAGE_BLOB_DIR,
+    max_bytes=int(os.environ.get('FLIPSIDE_PAGE_BLOB_MB', 1024)) * 1024 * 1024,
+    suffix='.jpg',
+    encoded_max_bytes=int(os.environ.get('FLIPSIDE_PAGE_BASE64_MB', 64)) * 1024 * 1024,
+)
+# Render/OCR settings and the cleanup model: changing either re-extracts
+EXTRACTION_VERSION = prompt_version(repr(sorted(vars(PDF_PAGE_SETTINGS).items())), FAST_MODEL)
 
 
-def _has_garbled_text(text):
-    """Fast local check: does this text likely contain reversed segments?
+GARBLE_CONTEXT_LINES = 2  # clean lines sent around each garbled run
+REPAIR_CHUNK_CHARS = 6000  # longest excerpt per Haiku repair call
 
-    Counts common function words in original vs reversed version of each line.
-    If any line scores better reversed, the text needs cleaning.
-    """
-    COMMON = {
-        'de', 'het', 'van', 'en', 'een', 'voor', 'in', 'te', 'op', 'aan',
-        'met', 'bij', 'uit', 'naar', 'dat', 'die', 'niet', 'ook', 'maar',
-        'per', 'door', 'tot', 'je', 'zijn', 'kan', 'was',
-        'the', 'and', 'for', 'of', 'to', 'is', 'with', 'on', 'at', 'by',
-        'not', 'but', 'or', 'this', 'that', 'you', 'your', 'all', 'can',
-        'le', 'la', 'les', 'des', 'du', 'un', 'une', 'et', 'est', 'dans',
-        'pour', 'par', 'sur', 'avec', 'que', 'qui', 'ce',
-        'der', 'die', 'das', 'und', 'ist', 'ein', 'von', 'auf', 'mit',
-    }
-    def hits(words):
-        return sum(1 for w in words
-                   if re.sub(r'[^a-zA-Z]', '', w).lower() in COMMON)
 
-    for line in text.split('\n'):
-        words = line.split()
-        if len(words) < 4:
-            continue
-        rev_words = line[::-1].split()
-        if hits(rev_words) > hits(words) + 1:
-            return True
-    return False
+def _repair_spans(indexes, lines):
+    """Garbled line indexes -> [(start, end)] excerpts with context, merged
+    when they touch and split to stay under REPAIR_CHUNK_CHARS."""
+    spans = []
+    for i in indexes:
+        start = max(0, i - GARBLE_CONTEXT_LINES)
+        end = min(len(lines), i + GARBLE_CONTEXT_LINES + 1)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    chunks = []
+    for start, end in spans:
+        chunk_start, size = start, 0
+        for i in range(start, end):
+            if size and size + len(lines[i]) > REPAIR_CHUNK_CHARS:
+                chunks.append((chunk_start, i))
+                chunk_start, size = i, 0
+            size += len(lines[i]) + 1
+        chunks.append((chunk_start, end))
+    return chunks
+
+
+def _repair_excerpt(excerpt):
+    """One Haiku call for one garbled excerpt; returns the cleaned excerpt,
+    or the original if the call fails or the result looks wrong."""
+    try:
+        with call_metrics.timer('clean', FAST_MODEL) as timer:
+            result = call_with_backoff(rate_limiters.get(FAST_MODEL), lambda: get_client().messages.create(
+                model=FAST_MODEL,
+                max_tokens=min(len(excerpt) // 3 + 500, 8192),
+                messages=[{'role': 'user', 'content': excerpt}],
+                system=(
+                    'You are a text cleaning tool. The input is an excerpt of text extracted from a PDF '
+                    'and may contain garbled, reversed, or duplicated text segments from complex layouts. '
+                    'Fix any reversed text (characters in wrong order), remove obvious duplicates, '
+                    'and clean up extraction artifacts. Keep the line breaks. '
+                    'Return ONLY the cleaned excerpt — no commentary, no explanations. '
+                    'If the text looks fine, return it unchanged.'
+                ),
+            ))
+            timer.set_usage(result.usage)
+        cleaned = result.content[0].text.strip('\n')
+        # Sanity check: cleaned text shouldn't be drastically different in length
+        if cleaned and 0.3 < len(cleaned) / len(excerpt) < 2.0:
+            return cleaned
+    except Exception as e:
+        print(f'[clean_extracted_text] Haiku repair failed, keeping raw excerpt: {e}')
+    return excerpt
 
 
 def clean_extracted_text(text):
-    """Use Haiku 4.5 to fix garbled/reversed text from PDF extraction.
+    """Fix garbled/reversed lines from PDF extraction.
 
-    Only calls Haiku when the fast local check detects garbled segments.
-    Clean text passes through with zero delay.
+    Only the lines the local check flags are touched. A line that is simply
+    reversed is turned around locally; the rest are repaired by Haiku 4.5 in
+    parallel excerpts (with a little context) and spliced back. Clean text
+    passes through with zero delay.
     """
     if not text or len(text) < 50:
         return text
 
-    if not _has_garbled_text(text):
+    lines = text.split('\n')
+    garbled = _garbled_lines(text)
+    if not garbled:
         return text  # Clean text — no API call needed
 
-    try:
-        result = get_client().messages.create(
-            model=FAST_MODEL,
-            max_tokens=min(len(text) // 3 + 500, 8192),
-            messages=[{'role': 'user', 'content': text}],
-            system=(
-                'You are a text cleaning tool. The input is extracted from a PDF and may contain '
-                'garbled, reversed, or duplicated text segments from complex layouts. '
-                'Fix any reversed text (characters in wrong order), remove obvious duplicates, '
-                'and clean up extraction artifacts. '
-                'Return ONLY the cleaned text — no commentary, no explanations. '
-                'If the text looks fine, return it unchanged.'
-            ),
-        )
-        cleaned = result.content[0].text.strip()
-        # Sanity check: cleaned text shouldn't be drastically different in length
-        if cleaned and 0.3 < len(cleaned) / len(text) < 2.0:
-            return cleaned
-    except Exception as e:
-        print(f'[clean_extracted_text] Haiku cleanup failed, using raw text: {e}')
-    return text
+    unresolved = []
+    for i in garbled:
+        fixed = _unreverse(lines[i])
+        if fixed is None:
+            unresolved.append(i)
+        else:
+            lines[i] = fixed
+    if unresolved:
+        spans = _repair_spans(unresolved, lines)
+        futures = [llm_scheduler.submit(FAST_MODEL, _repair_excerpt, '\n'.join(lines[start:end]))
+                   for start, end in spans]
+        # Splice from the end so earlier indexes stay valid
+        for (start, end), future in reversed(list(zip(spans, futures))):
+            lines[start:end] = future.result().split('\n')
+        print(f'[clean_extracted_text] {len(garbled) - len(unresolved)} reversed lines fixed locally, '
+              f'{len(unresolved)} repaired in {len(spans)} Haiku excerpts')
+    else:
+        print(f'[clean_extracted_text] {len(garbled)} reversed lines fixed locally')
+    return '\n'.join(lines)
 
 
-def extract_pdf(file_storage):
-    import pdfplumber
-    from PIL import Image
-    pdf_bytes = file_storage.read()
-    text_parts = []
-    page_images = []
-    ocr_used = False
-    use_ocr_for_all = None  # None = undecided, True/False after first page test
-
-    def text_quality(t):
-        """Score text: fraction of tokens that look like real words."""
-        words = t.split()
-        if not words:
-            return 0
-        good = sum(1 for w in words if 2 <= len(w) <= 20 and sum(c.isalpha() for c in w) / max(len(w), 1) > 0.7)
-        return good / len(words)
-
-    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-        for i, page in enumerate(pdf.pages):
-            page_text = page.extract_text()
-            pil_img = None
-            if i < MAX_VISION_PAGES:
-                try:
-                    img = page.to_image(resolution=VISION_DPI)
-                    pil_img = img.original
-                    # Constrain dimensions to stay under API limit
-                    if max(pil_img.size) > MAX_IMAGE_DIMENSION:
-                        pil_img.thumbnail(
-                            (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION),
-                            Image.LANCZOS,
-                        )
-                    # Encode as JPEG to keep file size bounded
-                    buf = BytesIO()
-                    pil_img.convert('RGB').save(buf, format='JPEG', quality=80)
-                    # If still too large, reduce quality
-                    if buf.tell() > MAX_IMAGE_BYTES:
-                        buf = BytesIO()
-                        pil_img.convert('RGB').save(buf, format='JPEG', quality=50)
-                    page_images.append(base64.b64encode(buf.getvalue()).decode())
-                except Exception as e:
-                    print(f'[extract_pdf] Page image rendering failed: {e}')
-                    page_images.append(None)  # Placeholder to keep indices aligned
-            # OCR: test on first page, then apply decision to all pages
-            if use_ocr_for_all is None and pil_img:
-                # First page with an image — test OCR vs embedded text
-                try:
-                    import pytesseract
-                    ocr_text = pytesseract.image_to_string(pil_img)
-                    ocr_score = text_quality(ocr_text) if ocr_text else 0
-                    orig_score = text_quality(page_text) if page_text else 0
-                    use_ocr_for_all = ocr_score > orig_score + 0.05
-                    print(f'[extract_pdf] Page 1 quality test: embedded={orig_score:.2f}, OCR={ocr_score:.2f} → {"OCR" if use_ocr_for_all else "embedded"} for all pages')
-                    if use_ocr_for_all:
-                        page_text = ocr_text
-                        ocr_used = True
-                except Exception as e:
-                    print(f'[extract_pdf] OCR test failed: {e}')
-                    use_ocr_for_all = False
-            elif use_ocr_for_all:
-                # OCR won on first page — OCR this page too
-                try:
-                    import pytesseract
-                    ocr_img = pil_img or page.to_image(resolution=VISION_DPI).original
-                    ocr_text = pytesseract.image_to_string(ocr_img)
-                    if ocr_text and len(ocr_text.strip()) > len((page_text or '').strip()):
-                        page_text = ocr_text
-                except Exception as e:
-                    print(f'[extract_pdf] OCR failed for page {i+1}: {e}')
-            if page_text:
-                text_parts.append(page_text)
-    if ocr_used:
-        print('[extract_pdf] OCR was used for scanned pages')
-    # Tag each page so the sidebar can render page dividers
-    # and later clauses from page 3+ are matchable
-    tagged = []
-    for i, part in enumerate(text_parts):
-        tagged.append(f'\n\n— Page {i + 1} —\n\n{part}')
-    raw_text = ''.join(tagged).strip()
-    return clean_extracted_text(raw_text), page_images, ocr_used
+def extract_pdf(source, progress=None, on_text=None):
+    """Extract text (and the vision pages' images) from the PDF at `source`
+    (a path, or bytes).
+
+    Returns (text, page_images, ocr_used, timings). page_images covers the
+    first MAX_VISION_PAGES pages with page blob digests, None for a page
+    that wasn't rendered: only pages with poor text or a visual layout are
+    (see services/pdf_extract).
+    Page work runs on the PDF page pool; `timings` breaks the time down per
+    page and per stage. Text cleanup starts as soon as every page's text is
+    in, while the vision pages are still rendering; on_text(text, ocr_used,
+    vision_pages) then gets the final text and the indexes of the pages
+    being rendered before the images are done. progress(type, content)
+    receives 'pages', 'ocr' (per OCR'd page) and 'stage' events for an
+    upload job's stream.
+    """
+    t0 = time.time()
+    cleaned = {}
+
+    def page_done(page, done, total):
+        if not progress:
+            return
+        if page['ocr']:
+            progress('ocr', {'used': True, 'page': page['index'] + 1})
+        progress('pages', {'done': done, 'total': total})
+
+    def clean(raw_text, ocr_used, vision_pages):
+        t1 = time.time()
+        if progress:
+            progress('stage', 'cleaning')
+        cleaned['text'] = clean_extracted_text(raw_text)
+        cleaned['seconds'] = time.time() - t1
+        # Still garbled: a repair call failed or was rejected
+        cleaned['failed'] = _has_garbled_text(cleaned['text'])
+        if on_text and cleaned['text'].strip():
+            try:
+                on_text(cleaned['text'], ocr_used, vision_pages)
+            except Exception as e:
+                print(f'[extract_pdf] on_text failed: {e}')
+
+    def text_done(pages):
+        # Tag each page so the sidebar can render page dividers
+        # and later clauses from page 3+ are matchable
+        text_parts = [page['text'] for page in pages if page['text']]
+        tagged = []
+        for i, part in enumerate(text_parts):
+            tagged.append(f'\n\n— Page {i + 1} —\n\n{part}')
+        raw_text = ''.join(tagged).strip()
+        ocr_used = any(page['ocr'] for page in pages)
+        vision_pages = [page['index'] for page in pages if page['rendered']]
+        cleaned['thread'] = threading.Thread(target=clean, args=(raw_text, ocr_used, vision_pages),
+                                             daemon=True)
+        cleaned['thread'].start()
+        if progress and any(page['rendered'] and not page['image'] for page in pages):
+            progress('stage', 'rendering')
+
+    pages = pdf_page_pool.extract(source, PDF_PAGE_SETTINGS,
+                                  on_page=page_done, on_text=text_done)
+    pages_seconds = time.time() - t0
+    cleaned['thread'].join()
+    # Placeholders (None) keep page_images aligned with page numbers
+    page_images = [_page_blobs.put(page['image']) if page['image'] else None
+                   for page in pages[:PDF_PAGE_SETTINGS.max_vision_pages]]
+    ocr_pages = sum(1 for page in pages if page['ocr'])
+    ocr_used = ocr_pages > 0
+    ocr_engine = next((page['ocr_engine'] for page in pages if page['ocr_engine']), None)
+    if ocr_engine:
+        print(f'[extract_pdf] OCR was used for {ocr_pages} of {len(pages)} pages ({ocr_engine}'
+              + (', one tesseract process per page; install tesserocr to keep one engine per worker)'
+                 if ocr_engine == 'pytesseract' else ')'))
+    reasons = [f'{page["index"] + 1}: {page["vision"] or "eager"}' for page in pages if page['image']]
+    for page in pages:
+        if page['image']:
+            runtime_metrics.inc('pdf_pages_rendered_total', reason=page['vision'] or 'eager')
+    print(f'[extract_pdf] Rendered {len(reasons)} of {len(page_images)} vision pages'
+          + (f' ({", ".join(reasons)})' if reasons else ''))
+    timings = {
+        'pages': [{'page': page['index'] + 1, 'vision': page['vision'], **page['timings']}
+                  for page in pages],
+        'pages_seconds': round(pages_seconds, 3),
+        'clean_seconds': round(cleaned['seconds'], 3),
+        'clean_failed': cleaned['failed'],
+        'workers': pdf_page_pool.workers,
+        'ocr_engine': ocr_engine,
+    }
+    return cleaned['text'], page_images, ocr_used, timings
 
 
 def extract_docx(file_storage):
     from docx import Document
-    doc = Document(BytesIO(file_storage.read()))
+    doc = Document(file_storage.stream)
     return '\n\n'.join(p.text for p in doc.paragraphs if p.text.strip())
 
 
-def extract_image(file_storage):
-    """Extract text from a photo/image using Haiku Vision.
-
-    Returns (text, [image_base64]) — text for the pipeline, image for Opus vision.
-    """
+def _encode_image(file_storage):
+    """Resize a photo/image to the page image limits and store it as JPEG
+    in the page blob store; returns its digest."""
     from PIL import Image
 
-    img_bytes = file_storage.read()
-    img = Image.open(BytesIO(img_bytes))
+    img = Image.open(file_storage.stream)
 
     # Convert to RGB (handles RGBA PNGs, palette images, etc.)
     if img.mode != 'RGB':
@@ -666,41 +1565,80 @@ def extract_image(file_storage):
         buf = BytesIO()
         img.save(buf, format='JPEG', quality=50)
 
-    image_b64 = base64.b64encode(buf.getvalue()).decode()
+    return _page_blobs.put(buf.getvalue())
+
 
-    # Use Haiku Vision to transcribe the text
+def _transcribe_image(digest):
+    """Text of a stored image, transcribed by Haiku Vision (None on failure)."""
+    # Encoded once: the Opus calls send the same string
+    image_b64 = _page_blobs.encoded(digest)
     try:
-        result = get_client().messages.create(
-            model=FAST_MODEL,
-            max_tokens=4096,
-            messages=[{
-                'role': 'user',
-                'content': [
-                    {
-                        'type': 'image',
-                        'source': {
-                            'type': 'base64',
-                            'media_type': 'image/jpeg',
-                            'data': image_b64,
+        with call_metrics.timer('vision', FAST_MODEL) as timer:
+            result = call_with_backoff(rate_limiters.get(FAST_MODEL), lambda: get_client().messages.create(
+                model=FAST_MODEL,
+                max_tokens=4096,
+                messages=[{
+                    'role': 'user',
+                    'content': [
+                        {
+                            'type': 'image',
+                            'source': {
+                                'type': 'base64',
+                                'media_type': 'image/jpeg',
+                                'data': image_b64,
+                            },
                         },
-                    },
-                    {
-                        'type': 'text',
-                        'text': (
-                            'Transcribe ALL text from this image exactly as written. '
-                            'Preserve layout, headings, numbering, bullet points, and paragraph breaks. '
-                            'Output only the transcribed text, no commentary or descriptions.'
-                        ),
-                    },
-                ],
-            }],
-        )
-        text = result.content[0].text.strip()
+                        {
+                            'type': 'text',
+                            'text': (
+                                'Transcribe ALL text from this image exactly as written. '
+                                'Preserve layout, headings, numbering, bullet points, and paragraph breaks. '
+                                'Output only the transcribed text, no commentary or descriptions.'
+                            ),
+                        },
+                    ],
+                }],
+            ))
+            timer.set_usage(result.usage)
+        return result.content[0].text.strip()
     except Exception as e:
         print(f'[extract_image] Haiku Vision extraction failed: {e}')
-        text = ''
+        return None
+
+
+def extract_images(files, progress=None):
+    """Extract text from photos/images (one per page, in order) using Haiku
+    Vision.
 
-    return text, [image_b64]
+    Returns (text, image_digests): text for the pipeline, the images (in
+    the page blob store) for Opus vision. Each image's transcription is
+    submitted to the LLM scheduler as soon as it is encoded, so the pages
+    are transcribed concurrently under the shared Haiku rate limit.
+    Several pages are stitched in order, each under a 'Page N' marker line;
+    raises ValueError naming the pages that could not be transcribed, rather
+    than returning a document with pages missing.
+    progress(type, content) receives 'pages' {done, total} events.
+    """
+    digests = []
+    futures = []
+    for file in files:
+        digest = _encode_image(file)
+        digests.append(digest)
+        futures.append(llm_scheduler.submit(FAST_MODEL, _transcribe_image, digest))
+
+    for done, _ in enumerate(as_completed(futures), 1):
+        if progress:
+            progress('pages', {'done': done, 'total': len(futures)})
+    texts = [future.result() for future in futures]
+    if len(texts) == 1:
+        return texts[0] or '', digests
+    failed = [str(i + 1) for i, t in enumerate(texts) if t is None]
+    if failed:
+        raise ValueError(f'Could not read page{"s" if len(failed) > 1 else ""} '
+                         f'{", ".join(failed)} of {len(texts)}. Please try those photos again.')
+    text = ''.join(f'\n\n\u2014 Page {i + 1} \u2014\n\n{t}'
+                   for i, t in enumerate(texts) if t).strip()
+    return text, digests
 
 
 # ---------------------------------------------------------------------------
@@ -741,31 +1679,289 @@ def jury():
     return render_template('jury.html')
 
 
+def _file_type(file):
+    """'pdf', 'docx', 'text' or 'image', by extension (or an image content
+    type); raises ValueError for anything else."""
+    filename = file.filename or ''
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext == 'pdf':
+        return 'pdf'
+    if ext == 'docx':
+        return 'docx'
+    if ext in ('txt', 'text', 'md'):
+        return 'text'
+    if ext in ('jpg', 'jpeg', 'png', 'webp') or (
+        getattr(file, 'content_type', None) and file.content_type.startswith('image/')
+    ):
+        return 'image'
+    raise ValueError(f'Unsupported file type: .{ext}')
+
+
+def _check_upload(files):
+    """Raise ValueError unless `files` are one supported file, or up to
+    MAX_UPLOAD_IMAGES photos."""
+    types = {_file_type(f) for f in files}
+    if len(files) > 1:
+        if types != {'image'}:
+            raise ValueError('Several files can only be photos of one document\'s pages.')
+        if len(files) > MAX_UPLOAD_IMAGES:
+            raise ValueError(f'Too many photos: at most {MAX_UPLOAD_IMAGES} pages per document.')
+
+
+def _upload_name(files):
+    if len(files) == 1:
+        return files[0].filename
+    return f'{files[0].filename} (+{len(files) - 1} pages)'
+
+
+def _extract_upload(files, progress=None, **pdf_options):
+    """Text and page images of an upload: one file, by extension, or
+    several photos of one paper document's pages, in order.
+
+    Returns {'text', 'page_images', 'ocr_used', 'timings', 'thumbnail',
+    'pdf_digest'}; raises ValueError for an unsupported upload. Results are
+    cached by the files' hash, so a re-upload skips extraction. A PDF is
+    kept in _pdf_sources under `pdf_digest` for rendering pages later.
+    `progress` (and for a PDF, `pdf_options`) are an upload job's callbacks.
+    """
+    filename = _upload_name(files)
+    page_images = []
+    ocr_used = False
+    timings = None
+    t0 = time.time()
+
+    _check_upload(files)
+    if len(files) == 1:
+        file = files[0]
+        file_type = _file_type(file)
+        digest = file_digest(file.stream)
+    else:
+        file_type = 'photos'
+        digest = hashlib.sha256(' '.join(file_digest(f.stream) for f in files).encode()).hexdigest()
+    pdf_source = pdf_digest = None
+    if file_type == 'pdf':
+        try:
+            pdf_source = _pdf_sources.put_stream(file.stream, digest)
+            pdf_digest = digest
+        except OSError as e:
+            print(f'[upload] could not keep {filename} for later rendering: {e}')
+            pdf_source = _stream_path(file.stream) or file.read()
+
+    cache_key = extraction_key(digest, f'{file_type}:{EXTRACTION_VERSION}')
+    cached = _extraction_cache.get(cache_key)
+    # Photos can't be redrawn like PDF pages: their blobs must still be there
+    if cached and file_type in ('image', 'photos') and not all(
+            _page_blobs.path(ref) for ref in cached['page_images'] if ref):
+        cached = None
+    if cached:
+        print(f'[extraction_cache] hit {cache_key[:12]} ({filename})')
+        if progress:
+            progress('stage', 'cached')
+        runtime_metrics.observe('extraction_seconds', time.time() - t0,
+                                type=file_type, ocr='cached')
+        return dict(cached, pdf_digest=pdf_digest,
+                    timings={'cached': True, 'seconds': round(time.time() - t0, 3)})
+
+    if file_type == 'pdf':
+        text, page_images, ocr_used, timings = extract_pdf(pdf_source, progress=progress, **pdf_options)
+    elif file_type == 'docx':
+        text = extract_docx(file)
+    elif file_type == 'text':
+        text = file.read().decode('utf-8', errors='replace')
+    else:
+        text, page_images = extract_images(files, progress=progress)
+    runtime_metrics.observe('extraction_seconds', time.time() - t0,
+                            type=file_type, ocr=str(ocr_used).lower())
+    thumbnail = _thumbnail(page_images)
+    # A failed cleanup is worth retrying on the next upload
+    if text.strip() and not (timings or {}).get('clean_failed'):
+        try:
+            _extraction_cache.put(cache_key, text, page_images, ocr_used, thumbnail)
+        except OSError as e:
+            print(f'[extraction_cache] write failed: {e}')
+    return {'text': text, 'page_images': page_images, 'ocr_used': ocr_used,
+            'timings': timings, 'thumbnail': thumbnail, 'pdf_digest': pdf_digest}
+
+
+def _thumbnail(page_images):
+    """Small JPEG (base64) of the first page that has an image, or None."""
+    first = next((ref for ref in page_images or [] if ref), None)
+    path = _page_blobs.path(first) if first else None
+    if not path:
+        return None
+    try:
+        from PIL import Image
+        img = Image.open(path)
+        img.thumbnail((200, 280))
+        buf = BytesIO()
+        img.save(buf, format='JPEG', quality=50)
+        return base64.b64encode(buf.getvalue()).decode()
+    except Exception:
+        return None
+
+
+def _image_fields(extracted):
+    """Document fields for an extraction's page images: the images, which
+    pages have one, and the retained PDF the others can be rendered from."""
+    page_images = extracted['page_images']
+    return {
+        'page_images': page_images,
+        'vision_pages': [i for i, img in enumerate(page_images) if img],
+        'pdf_digest': extracted.get('pdf_digest'),
+    }
+
+
+def _upload_text_event(doc_id, filename, text, ocr_used):
+    resp = {
+        'doc_id': doc_id,
+        'filename': filename,
+        'text_length': len(text),
+        'preview': text[:300],
+        'full_text': text,
+    }
+    if ocr_used:
+        resp['ocr_used'] = True
+    return resp
+
+
+def _stream_path(stream):
+    """Path of the file behind an upload stream (see UploadRequest), or None."""
+    name = getattr(stream, 'name', None)
+    return name if isinstance(name, str) and os.path.isfile(name) else None
+
+
+def _detach_upload(file, path):
+    """Give the upload its own file at `path`, outliving the request (which
+    deletes its spool file): a hard link to the spool file, or a streamed
+    copy when there is none or it is on another filesystem."""
+    source = _stream_path(file.stream)
+    if source:
+        try:
+            os.link(source, path)
+            return
+        except OSError:
+            pass
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(file.stream, f, 1 << 20)
+
+
+def _run_upload_job(doc_id, uploads, log):
+    """Background extraction for an async upload, reported on `log`.
+    `uploads` are the (path, filename, content_type) of its files, spooled
+    by _start_upload_job; the job deletes them.
+
+    Events: 'stage' (extracting, cleaning, rendering), 'pages' {done, total},
+    'ocr' {used, page}, then 'text' — the document is stored and its prescan
+    running, though PDF page images may still be rendering — and finally
+    'ready' {thumbnail, timings}, or 'error'.
+    """
+    key = f'{doc_id}/upload'
+
+    def emit(event_type, content=''):
+        log.append(f"data: {json.dumps({'type': event_type, 'content': content})}\n\n")
+
+    stored = {}
+
+    def text_ready(text, ocr_used, vision_pages):
+        # Identification starts on the text; /analyze waits for the images
+        doc = {
+            'text': text,
+            'filename': filename,
+            'page_images': [],
+            'vision_pages': vision_pages,
+            '_images_ready': threading.Event(),
+        }
+        store_document(doc_id, doc)
+        stored['doc'] = doc
+        emit('text', _upload_text_event(doc_id, filename, text, ocr_used))
+
+    files = [FileStorage(open(path, 'rb'), filename=name, content_type=content_type)
+             for path, name, content_type in uploads]
+    filename = _upload_name(files)
+    try:
+        emit('stage', 'extracting')
+        extracted = _extract_upload(files, progress=emit, on_text=text_ready)
+        text = extracted['text']
+        doc = stored.get('doc')
+        if doc is None:
+            if not text.strip():
+                emit('error', 'Could not extract text from document.')
+                return
+            store_document(doc_id, {
+                'text': text,
+                'filename': filename,
+                **_image_fields(extracted),
+            })
+            emit('text', _upload_text_event(doc_id, filename, text, extracted['ocr_used']))
+        else:
+            doc.update(_image_fields(extracted))
+            documents.put(doc_id, doc)
+        emit('ready', {'thumbnail': extracted['thumbnail'], 'timings': extracted['timings']})
+    except ValueError as e:
+        emit('error', str(e))
+    except Exception as e:
+        print(f'[upload] {doc_id[:8]}: extraction failed: {e}')
+        emit('error', 'An internal error occurred. Please try again.')
+    finally:
+        for file, (path, _, _) in zip(files, uploads):
+            file.stream.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if stored.get('doc'):
+            stored['doc']['_images_ready'].set()
+        stream_runs.finish(key, log)
+
+
+def _start_upload_job(files):
+    """Hand the spooled upload to an extraction job and answer at once (202)."""
+    doc_id = str(uuid.uuid4())
+    uploads = []
+    for i, file in enumerate(files):
+        path = os.path.join(UPLOAD_SPOOL_DIR, f'flipside-{doc_id}-{i}.job')
+        _detach_upload(file, path)
+        uploads.append((path, file.filename, file.content_type))
+    stream_runs.launch(f'{doc_id}/upload', lambda log: threading.Thread(
+        target=_run_upload_job, args=(doc_id, uploads, log),
+        daemon=True,
+    ).start())
+    return jsonify({
+        'doc_id': doc_id,
+        'filename': _upload_name(files),
+        'progress_url': f'/upload/{doc_id}/progress',
+    }), 202
+
+
 @app.route('/upload', methods=['POST'])
 def upload():
+    """Create a document from a file or pasted text.
+
+    Several `file` parts must all be photos of one document's pages, in
+    order (see extract_images). With form field async=1 a file upload
+    returns 202 and a progress_url right away; extraction runs in the
+    background (see _run_upload_job). Otherwise the response waits for the
+    extracted text.
+    """
     try:
         text = ''
         filename = ''
-        page_images = []
-        ocr_used = False
-
-        if 'file' in request.files and request.files['file'].filename:
-            file = request.files['file']
-            filename = file.filename
-            ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
-
-            if ext == 'pdf':
-                text, page_images, ocr_used = extract_pdf(file)
-            elif ext == 'docx':
-                text = extract_docx(file)
-            elif ext in ('txt', 'text', 'md'):
-                text = file.read().decode('utf-8', errors='replace')
-            elif ext in ('jpg', 'jpeg', 'png', 'webp') or (
-                file.content_type and file.content_type.startswith('image/')
-            ):
-                text, page_images = extract_image(file)
-            else:
-                return jsonify({'error': f'Unsupported file type: .{ext}'}), 400
+        extracted = {'page_images': [], 'ocr_used': False, 'timings': None, 'thumbnail': None}
+
+        files = [f for f in request.files.getlist('file') if f.filename]
+        if files:
+            filename = _upload_name(files)
+            try:
+                _check_upload(files)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if request.form.get('async') in ('1', 'true'):
+                return _start_upload_job(files)
+            try:
+                extracted = _extract_upload(files)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            text = extracted['text']
 
         elif request.form.get('text', '').strip():
             text = request.form['text']
@@ -781,40 +1977,39 @@ def upload():
         store_document(doc_id, {
             'text': text,
             'filename': filename,
-            'page_images': page_images,
+            **_image_fields(extracted),
         })
 
-        # Generate a small thumbnail from the first page image
-        thumbnail = None
-        if page_images:
-            try:
-                from PIL import Image
-                img_bytes = base64.b64decode(page_images[0])
-                img = Image.open(BytesIO(img_bytes))
-                img.thumbnail((200, 280))
-                buf = BytesIO()
-                img.save(buf, format='JPEG', quality=50)
-                thumbnail = base64.b64encode(buf.getvalue()).decode()
-            except Exception:
-                pass
-
-        resp = {
-            'doc_id': doc_id,
-            'filename': filename,
-            'text_length': len(text),
-            'preview': text[:300],
-            'full_text': text,
-            'thumbnail': thumbnail,
-        }
-        if ocr_used:
-            resp['ocr_used'] = True
+        resp = _upload_text_event(doc_id, filename, text, extracted['ocr_used'])
+        resp['thumbnail'] = extracted['thumbnail']
+        if extracted['timings']:
+            resp['timings'] = extracted['timings']
         return jsonify(resp)
 
+    except RequestEntityTooLarge:
+        raise  # Over the ceiling: the 413 handler answers
     except Exception as e:
         print(f'[upload] Error: {e}')
         return jsonify({'error': 'An internal error occurred. Please try again.'}), 500
 
 
+@app.route('/upload/<doc_id>/progress')
+def upload_progress(doc_id):
+    """SSE progress of an async upload; resumable with Last-Event-ID."""
+    key = f'{doc_id}/upload'
+
+    def unknown(log):
+        log.append(f"data: {json.dumps({'type': 'error', 'content': 'Upload not found.'})}\n\n")
+        stream_runs.finish(key, log)
+
+    return Response(
+        _counted_stream('upload', _follow_run(key, 'upload', unknown, _resume_offset(),
+                                              replay_finished=True)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+
+
 @app.route('/sample', methods=['POST'])
 def sample():
     data = request.get_json(silent=True) or {}
@@ -935,10 +2130,12 @@ def _parse_clause_line(line):
 
 @app.route('/analyze/<doc_id>')
 def analyze(doc_id):
-    if doc_id not in documents:
+    doc = get_document(doc_id)
+    if not doc:
         return jsonify({'error': 'Document not found.'}), 404
-
-    doc = documents[doc_id]
+    if request.args.get('vision') in ('1', 'true'):
+        _request_vision(doc_id, doc)
+    resume_from = _resume_offset()
 
     def sse(event_type, content=''):
         payload = json.dumps({'type': event_type, 'content': content})
@@ -988,25 +2185,52 @@ def analyze(doc_id):
             state['current_block'] = None
         return chunks
 
-    def run_parallel(client, user_msg):
-        """7-thread parallel analysis: 1 Opus verdict + 5 Opus deep-dive threads + 1 Haiku card pipeline."""
-        q = queue_module.Queue()
-        timings = {}
-        cancel = threading.Event()  # Signal to cancel Opus threads (e.g. doc not applicable)
+    def run_parallel(client, cancel, run_calls):
+        """7-thread parallel analysis: 1 Opus verdict + 5 Opus deep-dive threads + 1 Haiku card pipeline.
+        `cancel` stops every worker (doc not applicable, timeout, client disconnect).
+        Every upstream call's perf record is appended to `run_calls`.
 
-        def worker(label, system_prompt, max_out,
-                   model=MODEL, use_thinking=True, user_content=None, tools=None):
+        Every call starts with the same document prefix. The verdict goes
+        first; the deep dives are held back (up to CACHE_PRIME_SECONDS) until
+        its message_start, by which point the prefix is in the prompt cache.
+        They wait before submission, so they hold no Opus slot meanwhile."""
+        q = runtime_metrics.watch_queue('analysis', queue_module.Queue())
+        timings = {}
+        # Build vision content for deep analysis if page images exist
+        page_images = _vision_pages(doc_id, doc)
+        has_images = any(page_images)
+        text_prefix = _document_prefix(doc['text'])
+        deep_prefix = _document_prefix(doc['text'], page_images)
+        after_prefix = _SubmitGate(
+            CACHE_PRIME_SECONDS,
+            lambda n: print(f'[cache] verdict not started after {CACHE_PRIME_SECONDS:g}s, '
+                            f'sending {n} deep dives without a cached prefix'))
+        card_batch = _CardBatch()  # fallback card workers prime like the prescan's
+
+        def worker(label, instructions, max_out, model=MODEL, use_thinking=True,
+                   ask=ANALYSIS_ASK, prefix=None, tools=None, shared_instructions=False):
+            if cancel.is_set():
+                # Cancelled while queued in the scheduler — never call upstream
+                _record_cancelled_call(max_out, started=False)
+                q.put((f'{label}_done', None))
+                return
             t0 = time.time()
             max_retries = 3
+            limiter = rate_limiters.get(model)
+            usage = None
             for attempt in range(max_retries):
                 stream = None
+                streamed = 0
+                timer = call_metrics.timer(label, model, run_calls)
+                error = None
+                admission = object()
                 try:
-                    msg_content = user_content if user_content is not None else user_msg
+                    limiter.acquire(admission)
                     create_kwargs = {
                         'model': model,
                         'max_tokens': max_out,
-                        'system': [{'type': 'text', 'text': system_prompt, 'cache_control': {'type': 'ephemeral'}}],
-                        'messages': [{'role': 'user', 'content': msg_content}],
+                        'messages': _document_messages(
+                            prefix or text_prefix, instructions, ask, shared_instructions),
                         'stream': True,
                     }
                     if use_thinking and 'opus' in model.lower():
@@ -1016,46 +2240,44 @@ def analyze(doc_id):
                     stream = client.messages.create(**create_kwargs)
                     for event in stream:
                         if cancel.is_set():
+                            _record_cancelled_call(max_out, streamed)
                             break
+                        timer.on_event(event)
+                        if event.type == 'message_start':
+                            usage = timer.cache_counts()
+                            if label == 'overall':
+                                after_prefix.open()
+                        elif label == 'card_0' and event.type == 'content_block_delta':
+                            card_batch.prime()
+                        streamed += _delta_chars(event)
                         q.put((label, event))
-                    break  # success
-                except anthropic.APIError as e:
-                    is_overloaded = e.status_code in (429, 529) or 'overload' in str(e).lower()
-                    if is_overloaded and attempt < max_retries - 1:
-                        wait = (attempt + 1) * 5
-                        print(f'[worker] {label}: Overloaded, retry {attempt+1} in {wait}s')
-                        time.sleep(wait)
-                        continue
-                    q.put(('error', f'{label}: {e.message}'))
+                    else:
+                        limiter.record_success()
+                        break  # success
+                    # Cancelled mid-stream: no outcome, but free a half-open probe
+                    limiter.release_probe(admission)
                     break
                 except Exception as e:
-                    is_overloaded = 'overload' in str(e).lower() or '529' in str(e)
-                    if is_overloaded and attempt < max_retries - 1:
-                        wait = (attempt + 1) * 5
-                        print(f'[worker] {label}: Overloaded, retry {attempt+1} in {wait}s')
+                    error = e
+                    retry, wait = limiter.record_error(e, attempt, admission)
+                    if retry and attempt < max_retries - 1 and not cancel.is_set():
+                        limiter.record_retry()
+                        print(f'[worker] {label}: Overloaded, retry {attempt+1} in {wait:.1f}s')
                         time.sleep(wait)
                         continue
-                    q.put(('error', f'{label}: {str(e)}'))
+                    message = e.message if isinstance(e, anthropic.APIError) else str(e)
+                    q.put(('error', f'{label}: {message}'))
                     break
                 finally:
                     if stream:
                         stream.close()
+                    timer.finish(error)
+            if label == 'overall':
+                after_prefix.open()  # failed or cancelled: don't hold the deep dives
+            elif label == 'card_0':
+                card_batch.prime()
             timings[label] = round(time.time() - t0, 1)
-            q.put((f'{label}_done', None))
-
-        # Build vision content for deep analysis if page images exist
-        page_images = [img for img in doc.get('page_images', []) if img]
-        deep_user_content = None
-        if page_images:
-            deep_user_content = [{'type': 'text', 'text': user_msg}]
-            for i, img_b64 in enumerate(page_images):
-                deep_user_content.append({'type': 'text', 'text': f'[Page {i + 1} visual layout:]'})
-                deep_user_content.append({
-                    'type': 'image',
-                    'source': {'type': 'base64', 'media_type': 'image/jpeg', 'data': img_b64},
-                })
-
-        has_images = bool(page_images)
+            q.put((f'{label}_done', usage))
 
         yield sse('phase', 'thinking')
 
@@ -1089,24 +2311,19 @@ def analyze(doc_id):
 
         # ── Start Opus verdict at t=0 — enriched with card data if available ──
         verdict_max = 32000  # Enough for adaptive thinking + all 11 tags (FLAGGED_CLAIMS can be long)
-        opus_user = deep_user_content
+        verdict_ask = ANALYSIS_ASK
         if claims_summary:
-            if isinstance(opus_user, list):
-                # Image mode: replace first text block with enriched version
-                opus_user = [{'type': 'text', 'text': user_msg + '\n\n' + claims_summary}] + opus_user[1:]
-            else:
-                opus_user = (opus_user or user_msg) + '\n\n' + claims_summary
+            # After the shared prefix, so the enrichment doesn't cost a cache miss
+            verdict_ask += '\n\n' + claims_summary
             print(f'[verdict] Opus enriched with {len(claims_summary)} chars of card context')
-        t_opus = threading.Thread(
-            target=worker,
-            args=('overall', build_verdict_prompt(has_images=has_images),
-                  verdict_max, MODEL, True),
-            kwargs={'user_content': opus_user},
-            daemon=True,
+        llm_scheduler.submit(
+            MODEL, worker,
+            'overall', build_verdict_prompt(has_images=has_images),
+            verdict_max, MODEL, True,
+            ask=verdict_ask, prefix=deep_prefix,
         )
-        t_opus.start()
 
-        # ── 5 parallel Opus deep-dive threads — all fire at t=0 ──
+        # ── 5 parallel Opus deep-dive threads — sent once the verdict primes the prefix ──
         deep_dive_threads = {
             'archaeology': (build_archaeology_prompt(has_images=has_images), 32000),
             'scenario':    (build_scenario_prompt(), 32000),
@@ -1115,12 +2332,11 @@ def analyze(doc_id):
             'playbook':    (build_playbook_prompt(), 32000),
         }
         for dd_label, (dd_prompt, dd_max) in deep_dive_threads.items():
-            threading.Thread(
-                target=worker,
-                args=(dd_label, dd_prompt, dd_max, MODEL, True),
-                kwargs={'user_content': deep_user_content or user_msg},
-                daemon=True,
-            ).start()
+            after_prefix.submit(
+                MODEL, worker,
+                dd_label, dd_prompt, dd_max, MODEL, True,
+                prefix=deep_prefix,
+            )
 
         # ── Document context: metadata for loading screen ──
         pre_ctx = doc.get('_doc_context')
@@ -1134,44 +2350,20 @@ def analyze(doc_id):
             # Real uploads — lightweight Haiku extraction
             def _doc_context_worker():
                 try:
-                    full = doc['text']
-                    text_preview = full[:3000]
-                    if len(full) > 5000:
-                        text_preview += '\n\n[...]\n\n' + full[-1500:]
-                    resp = client.messages.create(
-                        model=FAST_MODEL,
-                        max_tokens=300,
-                        messages=[{
-                            'role': 'user',
-                            'content': (
-                                'Extract factual metadata from this document excerpt. '
-                                'Respond ONLY with these fields, one per line. '
-                                'If unknown, write "Unknown".\n\n'
-                                'TYPE: [document type, e.g. "Residential Lease", "Gym Membership", "Insurance Policy"]\n'
-                                'DRAFTER: [organization/company name that drafted this]\n'
-                                'OTHER_PARTY: [who signs/receives this, e.g. "Tenant", "Member", "Policyholder"]\n'
-                                'JURISDICTION: [country or state from governing law clause, registered address, or company HQ — e.g. "California, USA", "England & Wales"]\n'
-                                'DATE: [document date or effective date if stated]\n'
-                                'DURATION: [contract duration if stated, e.g. "12 months", "24 months"]\n'
-                                'KEY_AMOUNT: [main financial figure, e.g. "$1,450/month", "$350 adoption fee"]\n\n'
-                                f'DOCUMENT:\n{text_preview}'
-                            ),
-                        }],
-                    )
-                    result = {}
-                    for line in resp.content[0].text.strip().split('\n'):
-                        if ':' in line:
-                            key, val = line.split(':', 1)
-                            key = key.strip().upper().replace(' ', '_')
-                            val = val.strip()
-                            if val and val.lower() != 'unknown' and val != 'N/A':
-                                result[key] = val
+                    with call_metrics.timer('doc_context', FAST_MODEL, run_calls) as timer:
+                        resp = client.messages.create(
+                            model=FAST_MODEL,
+                            max_tokens=300,
+                            messages=[{'role': 'user', 'content': _doc_context_prompt(doc['text'])}],
+                        )
+                        timer.set_usage(resp.usage)
+                    result = _parse_doc_context(resp.content[0].text)
                     if result:
                         q.put(('doc_context', result))
                 except Exception as e:
                     print(f'[doc_context] Error: {e}')
 
-            threading.Thread(target=_doc_context_worker, daemon=True).start()
+            llm_scheduler.submit(FAST_MODEL, _doc_context_worker)
 
         # ── FAST PATH: pre-generated cards already available (non-blocking) ──
         if precards_event and precards_event.is_set():
@@ -1208,13 +2400,23 @@ def analyze(doc_id):
         # Opus events flow to the browser from t=0 while cards build.
         def _card_pipeline():
             """Background thread: streams card chunks to SSE as they generate.
-            First card streams token-by-token (~4-5s), others flush when done."""
+            First card streams token-by-token (~4-5s), others flush when done.
+            Blocks on the doc's prescan channel, so it only wakes when the
+            prescan has published a preview, a card chunk or its completion;
+            each wakeup takes everything published since the last one.
+            Gives up after 60s without a scan, or CARD_STALL_SECONDS without
+            news once the scan is in."""
+            t_pipeline_start = time.time()
+            wakeups = 0
+            pos = 0  # this pipeline's cursor on the channel
+            _channel = None
             try:
-                t_pipeline_start = time.time()
                 _prescan_ev = doc.get('_prescan_event')
-                _stream_q = doc.get('_card_stream_queue')
-                _card_queue = doc.get('_card_queue')
-                _preview_queue = doc.get('_clause_preview_queue')
+                _channel = doc.get('_prescan_channel')
+                prescan_done = _channel is None
+                if prescan_done and _prescan_ev:
+                    # Prescan ran elsewhere (another worker, a restart) — no channel
+                    _prescan_ev.wait(timeout=60)
 
                 _profile_sent = False
                 _started_sent = False
@@ -1271,35 +2473,6 @@ def analyze(doc_id):
                     _streaming_idx = None
 
                 while True:
-                    prescan_done = _prescan_ev and _prescan_ev.is_set()
-
-                    # Forward clause previews
-                    if _preview_queue:
-                        while not _preview_queue.empty():
-                            try:
-                                q.put(('clause_preview', _preview_queue.get_nowait()))
-                            except queue_module.Empty:
-                                break
-
-                    # Read streaming chunks from card workers
-                    if _stream_q:
-                        try:
-                            msg = _stream_q.get(timeout=0.05)
-
-                            # Hold card messages until profile is sent
-                            # (frontend expects profile as first text segment)
-                            if not _profile_sent:
-                                _held_msgs.append(msg)
-                            else:
-                                # Process this message (and any held ones)
-                                msgs_to_process = _held_msgs + [msg] if _held_msgs else [msg]
-                                _held_msgs = []
-                                for m in msgs_to_process:
-                                    _process_card_msg(m)
-
-                        except queue_module.Empty:
-                            pass
-
                     # Once prescan is done, handle profile + check completion
                     if prescan_done:
                         _prescan = doc.get('_prescan')
@@ -1333,19 +2506,17 @@ def analyze(doc_id):
                                 return
                             t0_scan = time.time()
                             try:
-                                scan_response = client.messages.create(
-                                    model=FAST_MODEL,
-                                    max_tokens=2000,
-                                    system=[{
-                                        'type': 'text',
-                                        'text': build_clause_id_prompt(),
-                                        'cache_control': {'type': 'ephemeral'},
-                                    }],
-                                    messages=[
-                                        {'role': 'user', 'content': user_msg},
-                                        {'role': 'assistant', 'content': 'CLAUSE:'},
-                                    ],
-                                )
+                                with llm_scheduler.slot(FAST_MODEL), \
+                                        call_metrics.timer('scan', FAST_MODEL, run_calls) as timer:
+                                    scan_response = client.messages.create(
+                                        model=FAST_MODEL,
+                                        max_tokens=2000,
+                                        messages=_document_messages(
+                                            text_prefix, build_clause_id_prompt(), ANALYSIS_ASK) + [
+                                            {'role': 'assistant', 'content': 'CLAUSE:'},
+                                        ],
+                                    )
+                                    timer.set_usage(scan_response.usage)
                                 _scan_text = 'CLAUSE:' + scan_response.content[0].text
                                 timings['scan'] = round(time.time() - t0_scan, 1)
                                 _profile_fb, _clauses, _green = parse_identification_output(_scan_text)
@@ -1361,36 +2532,26 @@ def analyze(doc_id):
                                 # Start Phase 2 card workers (uses streaming worker())
                                 if _profile_fb:
                                     q.put(('cards_profile', _profile_fb))
-                                _card_sys = build_single_card_system(doc['text'])
+                                _card_sys = build_single_card_system()
                                 _total = len(_clauses)
                                 print(f'[pipeline] Starting {_total} card workers (blocking scan path)')
                                 for i, ci in enumerate(_clauses):
-                                    cu = (
-                                        f"Generate a complete flip card for this specific clause:\n\n"
-                                        f"Title: {ci['title']}\n"
-                                        f"Section Reference: {ci.get('section', 'Not specified')}\n"
-                                        f"Prescan Risk: {ci.get('risk', 'RED')}\n"
-                                        f"Prescan Trick: {ci.get('trick', '')}\n\n"
-                                        f"Find this clause in the document and output the COMPLETE flip card. "
-                                        f"Make your own independent risk assessment — the prescan hints above are guidance only."
+                                    cu = _card_user_message(ci)
+                                    card_batch.submit(
+                                        i, FAST_MODEL, worker,
+                                        f'card_{i}', _card_sys, 3000, FAST_MODEL, False,
+                                        ask=cu, shared_instructions=True,
                                     )
-                                    threading.Thread(
-                                        target=worker,
-                                        args=(f'card_{i}', _card_sys, 3000, FAST_MODEL, False),
-                                        kwargs={'user_content': cu},
-                                        daemon=True,
-                                    ).start()
                                 q.put(('cards_started', _total))
                                 return
                             except Exception as e:
                                 print(f'[pipeline] Phase 1 failed: {e}, falling back to single-pass')
                                 quick_max = max(16000, min(32000, len(doc['text']) // 2))
-                                threading.Thread(
-                                    target=worker,
-                                    args=('quick', build_card_scan_prompt(), quick_max,
-                                          FAST_MODEL, False),
-                                    daemon=True,
-                                ).start()
+                                llm_scheduler.submit(
+                                    FAST_MODEL, worker,
+                                    'quick', build_card_scan_prompt(), quick_max,
+                                    FAST_MODEL, False,
+                                )
                                 q.put(('cards_fallback', None))
                                 return
 
@@ -1407,53 +2568,66 @@ def analyze(doc_id):
                             print(f'[pipeline] All {_card_total} cards streamed')
                             return
 
-                        # Cards still pending — if no stream queue, start fresh workers
-                        if not _stream_q and not _card_queue:
+                        # Cards still pending — if no prescan channel, start fresh workers
+                        if _channel is None:
                             _clauses = _prescan['clauses']
                             _green = _prescan['green_text']
-                            _card_sys = build_single_card_system(doc['text'])
+                            _card_sys = build_single_card_system()
                             _total = len(_clauses)
                             print(f'[pipeline] Starting {_total} card workers (prescan path)')
                             for i, ci in enumerate(_clauses):
-                                cu = (
-                                    f"Generate a complete flip card for this specific clause:\n\n"
-                                    f"Title: {ci['title']}\n"
-                                    f"Section Reference: {ci.get('section', 'Not specified')}\n"
-                                    f"Prescan Risk: {ci.get('risk', 'RED')}\n"
-                                    f"Prescan Trick: {ci.get('trick', '')}\n\n"
-                                    f"Find this clause in the document and output the COMPLETE flip card. "
-                                    f"Make your own independent risk assessment — the prescan hints above are guidance only."
+                                cu = _card_user_message(ci)
+                                card_batch.submit(
+                                    i, FAST_MODEL, worker,
+                                    f'card_{i}', _card_sys, 3000, FAST_MODEL, False,
+                                    ask=cu, shared_instructions=True,
                                 )
-                                threading.Thread(
-                                    target=worker,
-                                    args=(f'card_{i}', _card_sys, 3000, FAST_MODEL, False),
-                                    kwargs={'user_content': cu},
-                                    daemon=True,
-                                ).start()
                             q.put(('cards_started', _total))
                             return
 
-                        # Keep polling
-                        continue
-
-                    # Prescan not done yet — keep polling
-                    if not _stream_q and not _card_queue:
-                        time.sleep(0.05)
-                        _stream_q = doc.get('_card_stream_queue')
-                        _card_queue = doc.get('_card_queue')
-                        continue
-
-                    # Safety: 60s total timeout
-                    if time.time() - t_pipeline_start > 60:
-                        print(f'[pipeline] Timed out after 60s, {len(_emitted_cards)} cards streamed')
+                    # Sleep until the prescan publishes something
+                    if prescan_done:
+                        timeout = CARD_STALL_SECONDS
+                    else:
+                        timeout = max(0, 60 - (time.time() - t_pipeline_start))
+                    msgs, _ = _channel.read(pos, timeout=timeout)
+                    if not msgs:
+                        print(f'[pipeline] Prescan silent for {timeout:.0f}s, '
+                              f'{len(_emitted_cards)} cards streamed')
                         if len(_emitted_cards) > 0 or len(_done_cards) > 0:
                             _flush_buffered()
                             q.put(('cards_all_done', len(_emitted_cards)))
+                        else:
+                            q.put(('error', 'card_pipeline: timed out waiting for cards'))
+                        return
+                    pos += len(msgs)
+                    wakeups += 1
+                    if cancel.is_set():
+                        q.put(('cards_all_done', len(_emitted_cards)))
                         return
 
+                    for msg in msgs:
+                        if msg[0] == 'prescan_done':
+                            prescan_done = True
+                        elif msg[0] == 'preview':
+                            q.put(('clause_preview', msg[1]))
+                        elif not _profile_sent:
+                            # Hold card messages until profile is sent
+                            # (frontend expects profile as first text segment)
+                            _held_msgs.append(msg)
+                        else:
+                            _process_card_msg(msg)
+
             except Exception as e:
                 print(f'[card_pipeline] Error: {e}')
                 q.put(('error', f'card_pipeline: {str(e)}'))
+            finally:
+                if _channel is not None:
+                    runtime_metrics.inc('card_pipeline_runs_total')
+                    runtime_metrics.inc('card_pipeline_wakeups_total', wakeups)
+                    runtime_metrics.inc('card_pipeline_events_total', pos)
+                print(f'[pipeline] {wakeups} wakeups for {pos} events in '
+                      f'{round(time.time() - t_pipeline_start, 1)}s')
 
         threading.Thread(target=_card_pipeline, daemon=True).start()
 
@@ -1580,7 +2754,7 @@ def analyze(doc_id):
                 opus_label = source[:-5]
                 done_flags[opus_label] = True
                 yield sse(f'{opus_label}_done', json.dumps({
-                    'seconds': timings.get(opus_label, 0)}))
+                    'seconds': timings.get(opus_label, 0), 'cache': event}))
                 continue
 
             # ── Opus stream events ──
@@ -1596,8 +2770,13 @@ def analyze(doc_id):
                         yield sse(f'{source}_thinking', delta.thinking)
 
         # ── Save verdict + deep dives for follow-up agent ──
-        doc['_verdict_text'] = thread_texts.get('overall', '')
-        doc['_deep_dive_texts'] = {k: v for k, v in thread_texts.items() if k != 'overall'}
+        # (not a cancelled run's: its threads stopped part-way)
+        if not cancel.is_set():
+            documents.update(
+                doc_id,
+                _verdict_text=thread_texts.get('overall', ''),
+                _deep_dive_texts={k: v for k, v in thread_texts.items() if k != 'overall'},
+            )
 
         # ── Final done event ──
         yield sse('done', json.dumps({
@@ -1632,6 +2811,10 @@ def analyze(doc_id):
             return cards_all_done and all(done_flags.values())
 
         while not all_done():
+            if cancel.is_set():
+                # Abandoned (every viewer left): the card pipeline has stopped
+                # and nothing will be cached, so don't wait for the cards
+                return
             if time.time() - start_time > 300:
                 cancel.set()
                 yield sse('error', 'Analysis timed out after 5 minutes')
@@ -1868,7 +3051,7 @@ def analyze(doc_id):
                 opus_label = source[:-5]
                 done_flags[opus_label] = True
                 yield sse(f'{opus_label}_done', json.dumps({
-                    'seconds': timings.get(opus_label, 0)}))
+                    'seconds': timings.get(opus_label, 0), 'cache': event}))
                 continue
 
             # ── Opus stream events ──
@@ -1884,8 +3067,13 @@ def analyze(doc_id):
                         yield sse(f'{source}_thinking', delta.thinking)
 
         # ── Save verdict + deep dives for follow-up agent ──
-        doc['_verdict_text'] = thread_texts.get('overall', '')
-        doc['_deep_dive_texts'] = {k: v for k, v in thread_texts.items() if k != 'overall'}
+        # (not a cancelled run's: its threads stopped part-way)
+        if not cancel.is_set():
+            documents.update(
+                doc_id,
+                _verdict_text=thread_texts.get('overall', ''),
+                _deep_dive_texts={k: v for k, v in thread_texts.items() if k != 'overall'},
+            )
 
         # ── Final done event ──
         yield sse('done', json.dumps({
@@ -1908,83 +3096,84 @@ def analyze(doc_id):
         sample_type = doc.get('_sample_type')
 
         # ── Cache hit: replay pre-recorded SSE stream ──
+        if sample_type:
+            runtime_metrics.inc('sample_cache_requests_total',
+                                result='hit' if sample_type in _sample_cache else 'miss')
         if sample_type and sample_type in _sample_cache:
             print(f'[cache] Replaying cached stream for sample: {sample_type}')
             events = _sample_cache[sample_type]
-            batch = 0
-            for chunk in events:
-                yield chunk
-                # Compressed timing: ~10s total for full replay
-                try:
-                    payload = json.loads(chunk.split('data: ', 1)[1])
-                    etype = payload.get('type', '')
-                except Exception:
-                    etype = ''
-                if etype == 'quick_done':
-                    time.sleep(0.2)
-                elif etype == 'phase':
-                    time.sleep(0.05)
-                elif etype in ('overall_thinking', 'clause_preview'):
-                    batch += 1
-                    if batch % 5 == 0:  # Only sleep every 5th thinking token
-                        time.sleep(0.002)
-                elif etype == 'done':
-                    pass
-                else:
-                    time.sleep(0.001)
+            yield from _replay_events(events, resume_from)
             # Ensure stream ends with done event (incomplete caches lack it)
-            has_done = any('"type": "done"' in e or '"type":"done"' in e for e in events)
-            if not has_done:
-                yield sse('done', json.dumps({'cached': True}))
-            if doc_id in documents:
-                documents[doc_id]['analyzed'] = True
+            if not _stream_has_event(events, 'done'):
+                yield f'id: {len(events)}\n' + sse('done', json.dumps({'cached': True}))
+            documents.update(doc_id, analyzed=True)
+            return
+
+        # ── Analysis cache hit: same content was analyzed before ──
+        cache_key = doc.get('_analysis_key')
+        cached = _analysis_cache.get(cache_key) if cache_key else None
+        if cached and cached.get('events'):
+            print(f'[analysis_cache] Replaying {cache_key[:12]} for {doc_id[:8]}')
+            yield from _replay_events(cached['events'], resume_from)
+            documents.update(doc_id, analyzed=True)
             return
 
-        # ── Normal flow: run live analysis ──
-        recording = [] if sample_type else None
+        # ── Live analysis: one run per document, shared by every connection ──
+        yield from _follow_run(doc_id, 'analyze', _start_run, resume_from)
+
+    def _start_run(log):
+        """Launch the producer thread for a new run; returns its cancel function."""
+        cancel = threading.Event()
+        threading.Thread(target=_produce, args=(log, cancel), daemon=True).start()
+        return cancel.set
+
+    def _produce(log, cancel):
+        """Run the live analysis once, publishing every SSE chunk to `log`."""
+        sample_type = doc.get('_sample_type')
         try:
             client = anthropic.Anthropic(
-                timeout=180.0  # 3 min per call
+                timeout=180.0,  # 3 min per call
+                max_retries=0,  # overloads are paced by the shared rate limiter
             )
-            user_msg = (
-                "Analyze the following document from the drafter's "
-                "strategic perspective.\n\n"
-                "---BEGIN DOCUMENT---\n\n"
-                f"{doc['text']}\n\n"
-                "---END DOCUMENT---"
-            )
-            for chunk in run_parallel(client, user_msg):
-                if recording is not None:
-                    recording.append(chunk)
-                yield chunk
+            run_calls = []
+            milestones = _RunMilestones('thread')
+            for chunk in run_parallel(client, cancel, run_calls):
+                etype = _event_type(chunk)
+                milestones.see(chunk, etype)
+                if etype == 'done':
+                    # Upload-time prescan calls count toward this analysis too
+                    log.append(sse('perf', _perf_event(
+                        (doc.get('_prescan_calls') or []) + run_calls)))
+                log.append(chunk)
 
         except anthropic.AuthenticationError:
-            yield sse('error',
-                      'Invalid API key. Check your ANTHROPIC_API_KEY.')
+            log.append(sse('error',
+                           'Invalid API key. Check your ANTHROPIC_API_KEY.'))
         except anthropic.APIError as e:
-            yield sse('error', f'Anthropic API error: {e.message}')
+            log.append(sse('error', f'Anthropic API error: {e.message}'))
         except Exception as e:
             print(f'[stream] Error: {e}')
-            yield sse('error', 'An internal error occurred. Please try again.')
+            log.append(sse('error', 'An internal error occurred. Please try again.'))
         finally:
             # Keep document + analysis results for follow-up & deep dives
-            if doc_id in documents:
-                documents[doc_id]['analyzed'] = True
-            # Save to cache if this was a sample run
-            if recording and sample_type:
+            documents.update(doc_id, analyzed=True)
+            # The log is the recording — save it unless the run was
+            # cancelled (every viewer left): its workers stopped part-way
+            # but still signed off, so it would end in a normal 'done'.
+            # perf describes this run only, so replays don't repeat it.
+            recording = [c for c in log.entries() if _event_type(c) != 'perf']
+            if cancel.is_set():
+                print(f'[cache] {doc_id[:8]}: run cancelled, not cached')
+            elif recording and sample_type:
                 _sample_cache[sample_type] = recording
                 _save_sample_cache()
                 print(f'[cache] Saved {len(recording)} events for sample: {sample_type}')
+            elif recording and doc.get('_analysis_key'):
+                _save_analysis(doc, recording)
+            stream_runs.finish(doc_id, log)
 
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
-        },
-    )
+    return Response(_counted_stream('analyze', generate()),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
 
 
 # ── Warmup: pre-cache all sample SSE streams ─────────────────────
@@ -2046,15 +3235,69 @@ def cache_status():
         'total_samples': len(SAMPLE_DOCUMENTS),
         'missing': [k for k in SAMPLE_DOCUMENTS if k not in _sample_cache],
         'total_events': sum(len(v) for v in _sample_cache.values()),
+        'analysis_cache': _analysis_cache.stats(),
+        'extraction_cache': _extraction_cache.stats(),
+        'prompt_cache': _prompt_cache_summary(),
+        'card_priming': _card_priming_summary(),
     })
 
 
+@app.route('/store-status')
+def store_status():
+    """Resident document bytes (per field), eviction counts, page image
+    blobs (and their shared base64 encodings) and the PDFs kept for
+    rendering on demand."""
+    return jsonify(dict(documents.stats(), page_blobs=_page_blobs.stats(),
+                        pdf_sources=_pdf_sources.stats()))
+
+
+@app.route('/scheduler-status')
+def scheduler_status():
+    """LLM pool occupancy, per-model in-flight calls and queue wait times."""
+    return jsonify(llm_scheduler.stats())
+
+
+@app.route('/ratelimit-status')
+def ratelimit_status():
+    """Per-model limiter state: AIMD rate, pause, error rate, circuit state."""
+    return jsonify(rate_limiters.stats())
+
+
+@app.route('/runs-status')
+def runs_status():
+    """Live analysis runs: events logged and subscribers attached per document."""
+    return jsonify(stream_runs.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """Upstream calls per thread: tokens, cache hit rate, input cost, latency."""
+    return jsonify(call_metrics.stats())
+
+
+@app.route('/metrics/prometheus')
+def metrics_prometheus():
+    """Runtime load metrics (queues, streams, caches, latency histograms)
+    in the Prometheus text format."""
+    return Response(runtime_metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/cancel-status')
+def cancel_status():
+    """Client disconnects per route and upstream output they stopped."""
+    with _cancel_lock:
+        return jsonify(json.loads(json.dumps(_cancel_stats)))
+
+
 @app.route('/clear-cache')
 def clear_cache():
-    """Clear all cached samples."""
+    """Clear all cached samples, cached upload analyses and extractions."""
     _sample_cache.clear()
     if os.path.exists(_SAMPLE_CACHE_PATH):
         os.remove(_SAMPLE_CACHE_PATH)
+    _analysis_cache.clear()
+    _extraction_cache.clear()
     return jsonify({'status': 'cleared'})
 
 
@@ -2127,12 +3370,12 @@ DEEP_DIVE_PROMPTS = {
 
 @app.route('/deepdive/<doc_id>/<dive_type>')
 def deepdive(doc_id, dive_type):
-    if doc_id not in documents:
+    doc = get_document(doc_id)
+    if not doc:
         return jsonify({'error': 'Document not found.'}), 404
     if dive_type not in DEEP_DIVE_PROMPTS:
         return jsonify({'error': f'Unknown dive type: {dive_type}'}), 400
 
-    doc = documents[doc_id]
     prompt_fn, max_tokens = DEEP_DIVE_PROMPTS[dive_type]
 
     def sse(event_type, content=''):
@@ -2140,56 +3383,50 @@ def deepdive(doc_id, dive_type):
         return f"data: {payload}\n\n"
 
     def generate():
+        stream, streamed = None, 0
         try:
             client = anthropic.Anthropic()
-            user_msg = (
-                "---BEGIN DOCUMENT---\n\n"
-                f"{doc['text']}\n\n"
-                "---END DOCUMENT---"
-            )
             yield sse('phase', 'thinking')
             t0 = time.time()
+            # Same document prefix as /analyze — reads the Opus prompt cache
             dd_kwargs = dict(
                 model=MODEL,
                 max_tokens=max_tokens,
-                system=[{
-                    'type': 'text',
-                    'text': prompt_fn(),
-                    'cache_control': {'type': 'ephemeral'},
-                }],
-                messages=[{'role': 'user', 'content': user_msg}],
+                messages=_document_messages(
+                    _document_prefix(doc['text']), prompt_fn(), ANALYSIS_ASK),
                 stream=True,
             )
             if 'opus' in MODEL.lower():
                 dd_kwargs['thinking'] = {'type': 'adaptive'}
-            stream = client.messages.create(**dd_kwargs)
-            try:
-                for event in stream:
-                    if event.type == 'content_block_delta':
-                        if event.delta.type == 'thinking_delta':
-                            yield sse('thinking', event.delta.thinking)
-                        elif event.delta.type == 'text_delta':
-                            yield sse('text', event.delta.text)
-                    elif event.type == 'message_stop':
-                        elapsed = round(time.time() - t0, 1)
-                        yield sse('done', json.dumps({'seconds': elapsed}))
-            finally:
-                stream.close()
+            with llm_scheduler.slot(MODEL), call_metrics.timer(f'deepdive_{dive_type}', MODEL) as timer:
+                stream = client.messages.create(**dd_kwargs)
+                try:
+                    for event in stream:
+                        streamed += _delta_chars(event)
+                        timer.on_event(event)
+                        if event.type == 'content_block_delta':
+                            if event.delta.type == 'thinking_delta':
+                                yield sse('thinking', event.delta.thinking)
+                            elif event.delta.type == 'text_delta':
+                                yield sse('text', event.delta.text)
+                        elif event.type == 'message_stop':
+                            elapsed = round(time.time() - t0, 1)
+                            yield sse('perf', _perf_event([timer.finish()]))
+                            yield sse('done', json.dumps({'seconds': elapsed}))
+                finally:
+                    stream.close()
+        except GeneratorExit:
+            # Every viewer left — the upstream stream was closed above
+            if stream:
+                _record_cancelled_call(dd_kwargs['max_tokens'], streamed)
+            raise
         except anthropic.APIError as e:
             yield sse('error', f'API error: {e.message}')
         except Exception as e:
             print(f'[deepdive] {dive_type} error: {e}')
             yield sse('error', 'An internal error occurred.')
 
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
-        },
-    )
+    return _resumable_response(f'{doc_id}/deepdive/{dive_type}', 'deepdive', generate)
 
 
 # ── Tool definitions for follow-up agent ──────────────────────────
@@ -2283,10 +3520,9 @@ def _execute_tool(tool_name, tool_input, doc):
 
 @app.route('/ask/<doc_id>', methods=['POST'])
 def ask(doc_id):
-    if doc_id not in documents:
+    doc = get_document(doc_id)
+    if not doc:
         return jsonify({'error': 'Document not found. Please re-upload.'}), 404
-
-    doc = documents[doc_id]
     data = request.get_json(silent=True) or {}
     question = data.get('question', '').strip()
 
@@ -2303,6 +3539,7 @@ def ask(doc_id):
             system_prompt = build_followup_prompt()
             messages = [{'role': 'user', 'content': question}]
             max_rounds = 6  # Safety limit on tool-use loops
+            ask_calls = []  # one perf record per round
 
             yield sse('phase', 'thinking')
 
@@ -2321,7 +3558,10 @@ def ask(doc_id):
                 )
                 if 'opus' in MODEL.lower():
                     ask_kwargs['thinking'] = {'type': 'adaptive'}
-                response = client.messages.create(**ask_kwargs)
+                with llm_scheduler.slot(MODEL), \
+                        call_metrics.timer(f'ask_{_round}', MODEL, ask_calls) as timer:
+                    response = client.messages.create(**ask_kwargs)
+                    timer.set_usage(response.usage)
 
                 # ── Process response blocks ──
                 tool_calls = []
@@ -2339,6 +3579,7 @@ def ask(doc_id):
 
                 # ── If no tool calls, we're done ──
                 if response.stop_reason == 'end_turn' or not tool_calls:
+                    yield sse('perf', _perf_event(ask_calls))
                     yield sse('done')
                     return
 
@@ -2363,6 +3604,7 @@ def ask(doc_id):
                 messages.append({'role': 'user', 'content': tool_results})
 
             # Exhausted rounds
+            yield sse('perf', _perf_event(ask_calls))
             yield sse('done')
 
         except anthropic.APIError as e:
@@ -2371,21 +3613,15 @@ def ask(doc_id):
             print(f'[ask] Error: {e}')
             yield sse('error', 'An internal error occurred. Please try again.')
 
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
-        },
-    )
+    # Same question on the same document = same stream (resumable, deduplicated)
+    ask_key = hashlib.sha256(question.encode()).hexdigest()[:16]
+    return _resumable_response(f'{doc_id}/ask/{ask_key}', 'ask', generate)
 
 
 @app.route('/timeline/<doc_id>', methods=['GET', 'POST'])
 def timeline(doc_id):
     """Generate worst-case timeline — on-demand after analysis."""
-    doc = documents.get(doc_id)
+    doc = get_document(doc_id)
     if not doc:
         return jsonify({'error': 'Document not found. Please re-upload.'}), 404
 
@@ -2394,62 +3630,54 @@ def timeline(doc_id):
         return f"data: {payload}\n\n"
 
     def generate():
+        stream, streamed = None, 0
         try:
             client = anthropic.Anthropic()
-            user_msg = (
-                "Here is the document:\n\n"
-                "---BEGIN DOCUMENT---\n\n"
-                f"{doc['text']}\n\n"
-                "---END DOCUMENT---\n\n"
-                "Generate a worst-case timeline showing how one common trigger cascades through this contract."
-            )
             yield sse('phase', 'thinking')
             tl_kwargs = dict(
                 model=MODEL,
                 max_tokens=16000,
-                system=[{
-                    'type': 'text',
-                    'text': build_timeline_prompt(),
-                    'cache_control': {'type': 'ephemeral'},
-                }],
-                messages=[{'role': 'user', 'content': user_msg}],
+                messages=_document_messages(
+                    _document_prefix(doc['text']), build_timeline_prompt(),
+                    "Generate a worst-case timeline showing how one common trigger cascades through this contract."),
                 stream=True,
             )
             if 'opus' in MODEL.lower():
                 tl_kwargs['thinking'] = {'type': 'adaptive'}
-            stream = client.messages.create(**tl_kwargs)
-            try:
-                for event in stream:
-                    if event.type == 'content_block_delta':
-                        if event.delta.type == 'thinking_delta':
-                            yield sse('thinking', event.delta.thinking)
-                        elif event.delta.type == 'text_delta':
-                            yield sse('text', event.delta.text)
-                    elif event.type == 'message_stop':
-                        yield sse('done')
-            finally:
-                stream.close()
+            with llm_scheduler.slot(MODEL), call_metrics.timer('timeline', MODEL) as timer:
+                stream = client.messages.create(**tl_kwargs)
+                try:
+                    for event in stream:
+                        streamed += _delta_chars(event)
+                        timer.on_event(event)
+                        if event.type == 'content_block_delta':
+                            if event.delta.type == 'thinking_delta':
+                                yield sse('thinking', event.delta.thinking)
+                            elif event.delta.type == 'text_delta':
+                                yield sse('text', event.delta.text)
+                        elif event.type == 'message_stop':
+                            yield sse('perf', _perf_event([timer.finish()]))
+                            yield sse('done')
+                finally:
+                    stream.close()
+        except GeneratorExit:
+            # Every viewer left — the upstream stream was closed above
+            if stream:
+                _record_cancelled_call(tl_kwargs['max_tokens'], streamed)
+            raise
         except anthropic.APIError as e:
             yield sse('error', f'API error: {e.message}')
         except Exception as e:
             print(f'[stream] Error: {e}')
             yield sse('error', 'An internal error occurred. Please try again.')
 
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
-        },
-    )
+    return _resumable_response(f'{doc_id}/timeline', 'timeline', generate)
 
 
 @app.route('/counter-draft/<doc_id>', methods=['GET', 'POST'])
 def counter_draft(doc_id):
     """Generate fair rewrites of problematic clauses — on-demand after analysis."""
-    doc = documents.get(doc_id)
+    doc = get_document(doc_id)
     if not doc:
         return jsonify({'error': 'Document not found. Please re-upload.'}), 404
 
@@ -2458,56 +3686,48 @@ def counter_draft(doc_id):
         return f"data: {payload}\n\n"
 
     def generate():
+        stream, streamed = None, 0
         try:
             client = anthropic.Anthropic()
-            user_msg = (
-                "Here is the document:\n\n"
-                "---BEGIN DOCUMENT---\n\n"
-                f"{doc['text']}\n\n"
-                "---END DOCUMENT---\n\n"
-                "Generate a counter-draft with fair rewrites for all problematic clauses."
-            )
             yield sse('phase', 'thinking')
             cd_kwargs = dict(
                 model=MODEL,
                 max_tokens=32000,
-                system=[{
-                    'type': 'text',
-                    'text': build_counter_draft_prompt(),
-                    'cache_control': {'type': 'ephemeral'},
-                }],
-                messages=[{'role': 'user', 'content': user_msg}],
+                messages=_document_messages(
+                    _document_prefix(doc['text']), build_counter_draft_prompt(),
+                    "Generate a counter-draft with fair rewrites for all problematic clauses."),
                 stream=True,
             )
             if 'opus' in MODEL.lower():
                 cd_kwargs['thinking'] = {'type': 'adaptive'}
-            stream = client.messages.create(**cd_kwargs)
-            try:
-                for event in stream:
-                    if event.type == 'content_block_delta':
-                        if event.delta.type == 'thinking_delta':
-                            yield sse('thinking', event.delta.thinking)
-                        elif event.delta.type == 'text_delta':
-                            yield sse('text', event.delta.text)
-                    elif event.type == 'message_stop':
-                        yield sse('done')
-            finally:
-                stream.close()
+            with llm_scheduler.slot(MODEL), call_metrics.timer('counter_draft', MODEL) as timer:
+                stream = client.messages.create(**cd_kwargs)
+                try:
+                    for event in stream:
+                        streamed += _delta_chars(event)
+                        timer.on_event(event)
+                        if event.type == 'content_block_delta':
+                            if event.delta.type == 'thinking_delta':
+                                yield sse('thinking', event.delta.thinking)
+                            elif event.delta.type == 'text_delta':
+                                yield sse('text', event.delta.text)
+                        elif event.type == 'message_stop':
+                            yield sse('perf', _perf_event([timer.finish()]))
+                            yield sse('done')
+                finally:
+                    stream.close()
+        except GeneratorExit:
+            # Every viewer left — the upstream stream was closed above
+            if stream:
+                _record_cancelled_call(cd_kwargs['max_tokens'], streamed)
+            raise
         except anthropic.APIError as e:
             yield sse('error', f'API error: {e.message}')
         except Exception as e:
             print(f'[stream] Error: {e}')
             yield sse('error', 'An internal error occurred. Please try again.')
 
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
-        },
-    )
+    return _resumable_response(f'{doc_id}/counter-draft', 'counter-draft', generate)
 
 
 @app.route('/fetch-url', methods=['POST'])
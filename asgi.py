@@ -0,0 +1,121 @@
+"""
+ASGI entry point — live /analyze streams run on the asyncio engine,
+every other route (and cache replays) is served by the Flask app.
+
+    uvicorn asgi:application --port 5001
+
+One process holds many concurrent analyses on one event loop instead of
+pinning a WSGI thread (plus ~8 worker threads) per open SSE stream.
+Both halves take their model slots from the one LLMScheduler, so the
+per-model stream caps cover the whole process.
+"""
+
+import re
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flipside
+import async_engine
+
+_wsgi = WsgiToAsgi(flipside.app)
+_ANALYZE_PATH = re.compile(r'^/analyze/([^/]+)$')
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            async_engine.install(asyncio.get_running_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _query(scope, name):
+    return parse_qs(scope.get('query_string', b'').decode('latin-1')).get(name, [''])[0]
+
+
+def _resume_offset(scope):
+    """Last-Event-ID + 1 from the header or ?last_event_id= (0 if absent)."""
+    headers = dict(scope.get('headers') or [])
+    raw = headers.get(b'last-event-id', b'').decode('latin-1')
+    if not raw:
+        raw = _query(scope, 'last_event_id')
+    try:
+        return max(0, int(raw) + 1)
+    except ValueError:
+        return 0
+
+
+async def _pump(doc_id, send, resume_from):
+    async for chunk in async_engine.analyze_stream(doc_id, resume_from):
+        await send({'type': 'http.response.body',
+                    'body': chunk.encode('utf-8'), 'more_body': True})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _analyze(doc_id, scope, receive, send):
+    flipside.runtime_metrics.inc('sse_connections_opened_total', route='analyze')
+    with flipside.runtime_metrics.track('sse_connections', route='analyze'):
+        await _serve_analyze(doc_id, scope, receive, send)
+
+
+async def _serve_analyze(doc_id, scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+    pump = asyncio.create_task(_pump(doc_id, send, _resume_offset(scope)))
+    watcher = asyncio.create_task(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({pump, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        pump.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not pump.done():
+        # Client went away — cancelling the pump only leaves the run
+        # (stream_runs.leave); the analysis is cancelled, closing every
+        # upstream stream, if nobody re-joins within the grace period
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        flipside._record_disconnect('analyze')
+        return
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    pump.result()
+
+
+def _route_path(scope):
+    path = scope.get('path', '')
+    prefix = flipside._manual_prefix
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):] or '/'
+    return path
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope.get('method') == 'GET':
+        match = _ANALYZE_PATH.match(_route_path(scope))
+        if match:
+            doc = flipside.get_document(match.group(1))
+            if doc and _query(scope, 'vision') in ('1', 'true'):
+                flipside._request_vision(match.group(1), doc)
+            # Unknown docs (404) and cache replays stay on the Flask route
+            if doc and not async_engine.is_replay(doc):
+                await _analyze(match.group(1), scope, receive, send)
+                return
+    await _wsgi(scope, receive, send)
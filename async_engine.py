@@ -0,0 +1,690 @@
+"""
+Asyncio analysis engine — AsyncAnthropic + TaskGroup instead of OS threads.
+
+Alternative to the threaded run_parallel / _prescan_document / _card_pipeline
+in app.py, served by asgi.py. One event loop holds every open analysis:
+the six Opus streams, the doc-context call, the prescan and all card calls
+are tasks, and SSE subscribers await the run's event log instead of polling.
+
+The SSE event protocol is the same as app.py's, so the frontend can't tell
+which engine produced a stream. Its upstream calls take their model slots
+from the same LLMScheduler as the thread engine's (which still serves the
+follow-up routes under asgi.py), so the per-model cap holds across both, and
+they share the same rate limiters.
+"""
+
+import json
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+import anthropic
+
+import app as flipside
+from app import (
+    MODEL,
+    FAST_MODEL,
+    documents,
+    get_document,
+    llm_scheduler,
+    rate_limiters,
+    parse_identification_output,
+    _parse_clause_line,
+    _build_claims_summary,
+    ANALYSIS_ASK,
+    CACHE_PRIME_SECONDS,
+    CARD_PRIME_SECONDS,
+    _CardBatch,
+    _RunMilestones,
+    _card_user_message,
+    _document_prefix,
+    _document_messages,
+    _event_type,
+    _perf_event,
+    call_metrics,
+    _doc_context_prompt,
+    _parse_doc_context,
+    _sample_cache,
+    _save_sample_cache,
+    _save_analysis,
+    _delta_chars,
+    _record_cancelled_call,
+    stream_runs,
+)
+from prompts import (
+    build_clause_id_prompt,
+    build_single_card_system,
+    build_verdict_prompt,
+    build_archaeology_prompt,
+    build_scenario_prompt,
+    build_walkaway_prompt,
+    build_combinations_prompt,
+    build_playbook_prompt,
+)
+
+ANALYSIS_TIMEOUT = 300  # seconds, same wall-clock cap as the thread engine
+
+_client = None
+_background = set()  # strong refs to fire-and-forget prescan / run tasks
+
+
+def sse(event_type, content=''):
+    payload = json.dumps({'type': event_type, 'content': content})
+    return f"data: {payload}\n\n"
+
+
+def get_async_client():
+    global _client
+    if _client is None:
+        # SDK retries off: overloads are paced by the shared rate limiter
+        _client = anthropic.AsyncAnthropic(timeout=180.0, max_retries=0)
+    return _client
+
+
+@asynccontextmanager
+async def _slot(model):
+    """Hold one of the LLMScheduler's `model` slots, awaited on the loop."""
+    claim = llm_scheduler.claim(model)
+    try:
+        await asyncio.wrap_future(claim)
+    except asyncio.CancelledError:
+        if not claim.cancel():  # granted as we were cancelled
+            llm_scheduler.release(model)
+        raise
+    try:
+        yield
+    finally:
+        llm_scheduler.release(model)
+
+
+async def _acquire(limiter, holder=None):
+    """Async counterpart of AdaptiveLimiter.acquire()."""
+    while True:
+        wait = limiter.reserve(holder)
+        if not wait:
+            return
+        await asyncio.sleep(min(wait, 1.0))
+
+
+async def _call_with_backoff(model, call, retry_if=None, max_retries=3):
+    """Async call_with_backoff: `await call()` under a model slot + shared
+    rate limiter, retrying overloads unless `retry_if()` says no. Records
+    one outcome per attempt; a cancelled attempt frees a half-open probe."""
+    limiter = rate_limiters.get(model)
+    async with _slot(model):
+        for attempt in range(max_retries):
+            admission = object()
+            await _acquire(limiter, admission)
+            try:
+                result = await call()
+            except asyncio.CancelledError:
+                limiter.release_probe(admission)
+                raise
+            except Exception as e:
+                retry, wait = limiter.record_error(e, attempt, admission)
+                if retry and attempt < max_retries - 1 and (retry_if is None or retry_if()):
+                    limiter.record_retry()
+                    print(f'[async] {model}: Overloaded, retry {attempt+1} in {wait:.1f}s')
+                    await asyncio.sleep(wait)
+                    continue
+                raise
+            limiter.record_success()
+            return result
+
+
+async def _stream_call(model, create_kwargs, on_event, label, run=None, max_retries=3):
+    """One upstream stream under a model slot + shared rate limiter.
+    Calls on_event(event) for every stream event; retries overloads.
+    Each attempt is timed into call_metrics (and `run`, if given).
+    Returns the call's cache read/write/uncached input counts."""
+    limiter = rate_limiters.get(model)
+    async with _slot(model):
+        for attempt in range(max_retries):
+            stream = None
+            streamed = 0
+            # Outside the try: a caller turned away by the circuit has no
+            # outcome to record (and must not release somebody's probe)
+            admission = object()
+            await _acquire(limiter, admission)
+            timer = call_metrics.timer(label, model, run)
+            error = None
+            try:
+                stream = await get_async_client().messages.create(**create_kwargs, stream=True)
+                async for event in stream:
+                    timer.on_event(event)
+                    streamed += _delta_chars(event)
+                    on_event(event)
+                limiter.record_success()
+                return timer.cache_counts()
+            except asyncio.CancelledError:
+                # Disconnect / not applicable / timeout — no outcome, but a
+                # half-open probe must not stay in flight forever
+                limiter.release_probe(admission)
+                # Count the unspent output
+                if stream is not None:
+                    _record_cancelled_call(create_kwargs.get('max_tokens', 0), streamed)
+                raise
+            except Exception as e:
+                error = e
+                retry, wait = limiter.record_error(e, attempt, admission)
+                if retry and attempt < max_retries - 1:
+                    limiter.record_retry()
+                    print(f'[async] {model}: Overloaded, retry {attempt+1} in {wait:.1f}s')
+                    await asyncio.sleep(wait)
+                    continue
+                raise
+            finally:
+                if stream is not None:
+                    await stream.close()
+                timer.finish(error)
+
+
+# ---------------------------------------------------------------------------
+# Prescan — clause identification streaming into per-clause card tasks
+# ---------------------------------------------------------------------------
+
+class PrescanState:
+    """Live view of an async prescan that analyses can tail.
+
+    `clauses` grows as CLAUSE: lines stream in; `cards[i]` is a future with
+    card i's text ('' on failure). `result` is the doc['_prescan'] dict once
+    the scan finishes (None if it failed).
+    """
+
+    def __init__(self):
+        self.clauses = []
+        self.cards = []
+        self.changed = asyncio.Condition()
+        self.finished = False
+        self.result = None
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+
+async def _card_task(idx, prefix, card_instructions, user_content, future, batch, primed, run):
+    """One card call. Card 0 primes the cache; the rest wait for its first
+    token (at most CARD_PRIME_SECONDS), like the thread prescan's workers."""
+    text = ''
+    counts = None
+    if idx and CARD_PRIME_SECONDS:
+        try:
+            await asyncio.wait_for(primed.wait(), CARD_PRIME_SECONDS)
+        except TimeoutError:
+            batch.prime_timed_out()
+    try:
+        def on_event(event):
+            nonlocal text
+            if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+                if idx == 0:
+                    primed.set()
+                text += event.delta.text
+
+        counts = await _stream_call(FAST_MODEL, {
+            'model': FAST_MODEL,
+            'max_tokens': 3000,
+            'messages': _document_messages(
+                prefix, card_instructions, user_content, shared_instructions=True),
+        }, on_event, f'card_{idx}', run)
+    except Exception as e:
+        print(f'[async precard] card error: {e}')
+        text = ''
+    finally:
+        if idx == 0:
+            primed.set()
+        batch.finished(counts)
+        # Always resolve — analyses await these futures in order
+        if not future.done():
+            future.set_result(text)
+
+
+async def prescan_document(doc_id, state):
+    """Async _prescan_document: card tasks start as each CLAUSE: line arrives."""
+    doc = documents.get(doc_id)
+    t0 = time.time()
+    try:
+        if not doc or not doc.get('text'):
+            if doc:
+                documents.update(doc_id, _prescan=None)
+            return
+        # Scan and cards share one cached prefix: the document, then (for the
+        # cards) the card instructions
+        prefix = _document_prefix(doc['text'])
+        card_instructions = build_single_card_system()
+        batch, primed = _CardBatch(), asyncio.Event()
+        prescan_calls = doc['_prescan_calls'] = []  # perf records, sent with /analyze
+
+        async with asyncio.TaskGroup() as tg:
+            def add_clause(line):
+                clause = _parse_clause_line(line)
+                if not clause:
+                    return
+                future = asyncio.get_running_loop().create_future()
+                state.clauses.append(clause)
+                state.cards.append(future)
+                batch.launched()
+                tg.create_task(_card_task(
+                    len(state.cards) - 1, prefix, card_instructions,
+                    _card_user_message(clause), future, batch, primed, prescan_calls))
+
+            scan_text = line_buffer = ''
+
+            async def scan():
+                nonlocal scan_text, line_buffer
+                scan_text = line_buffer = 'CLAUSE:'  # Prefilled assistant turn
+                with call_metrics.timer('scan', FAST_MODEL, prescan_calls) as timer:
+                    async with get_async_client().messages.stream(
+                        model=FAST_MODEL,
+                        max_tokens=2000,
+                        messages=_document_messages(prefix, build_clause_id_prompt(), ANALYSIS_ASK) + [
+                            {'role': 'assistant', 'content': 'CLAUSE:'},
+                        ],
+                    ) as stream:
+                        async for chunk in stream.text_stream:
+                            timer.first_token()
+                            scan_text += chunk
+                            line_buffer += chunk
+                            new_clause = False
+                            while '\n' in line_buffer:
+                                line, line_buffer = line_buffer.split('\n', 1)
+                                if line.strip().startswith('CLAUSE:'):
+                                    add_clause(line.strip())
+                                    new_clause = True
+                            if new_clause:
+                                await state.notify()
+                        timer.set_usage((await stream.get_final_message()).usage)
+
+            # Retried like a card unless a clause's card is already running
+            # (a second scan would launch it again)
+            await _call_with_backoff(FAST_MODEL, scan, retry_if=lambda: not state.clauses)
+            if line_buffer.strip().startswith('CLAUSE:'):
+                add_clause(line_buffer.strip())
+
+            profile_text, _, green_text = parse_identification_output(scan_text)
+            state.result = {
+                'scan_text': scan_text,
+                'profile_text': profile_text,
+                'clauses': state.clauses,
+                'green_text': green_text,
+                'seconds': round(time.time() - t0, 1),
+            }
+            documents.update(doc_id, _card_total=len(state.clauses), _prescan=state.result)
+            state.finished = True
+            await state.notify()
+            doc['_prescan_event'].set()
+            print(f'[async prescan] {doc_id[:8]}: {len(state.clauses)} clauses '
+                  f'in {state.result["seconds"]}s')
+
+        if state.clauses and '**Not Applicable**' not in scan_text:
+            documents.update(doc_id, _precards={
+                'cards': [f.result() for f in state.cards],
+                'seconds': round(time.time() - t0 - state.result['seconds'], 1),
+            })
+            batch.record(doc_id)
+        else:
+            documents.update(doc_id, _precards=None)
+    except Exception as e:
+        print(f'[async prescan] {doc_id[:8]}: Error: {e}')
+        if doc is not None and not doc.get('_prescan'):
+            documents.update(doc_id, _prescan=None)
+    finally:
+        for future in state.cards:
+            if not future.done():
+                future.set_result('')
+        state.finished = True
+        await state.notify()
+        if doc is not None:
+            doc.get('_prescan_event', _set_event()).set()
+            doc.get('_precards_event', _set_event()).set()
+
+
+def _set_event():
+    ev = threading.Event()
+    ev.set()
+    return ev
+
+
+def start_prescan(doc_id, doc, loop=None):
+    """Attach a PrescanState to the doc and schedule the prescan coroutine.
+
+    Safe to call from a WSGI worker thread (pass the server loop) or from a
+    coroutine already running on the loop.
+    """
+    state = PrescanState()
+    doc['_async_prescan'] = state
+    coro = prescan_document(doc_id, state)
+    if loop is not None:
+        asyncio.run_coroutine_threadsafe(coro, loop)
+    else:
+        task = asyncio.get_running_loop().create_task(coro)
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    return state
+
+
+def install(loop):
+    """Route store_document's prescans onto `loop` (called at ASGI startup)."""
+    def launcher(doc_id):
+        doc = documents.get(doc_id)
+        if doc is not None:
+            start_prescan(doc_id, doc, loop=loop)
+    flipside.prescan_launcher = launcher
+
+
+# ---------------------------------------------------------------------------
+# Analysis — Opus verdict + 5 deep dives + card pipeline in one TaskGroup
+# ---------------------------------------------------------------------------
+
+class _NotApplicable(Exception):
+    """Raised by the card pipeline to cancel the Opus tasks."""
+
+
+DEEP_DIVES = {
+    'archaeology': lambda has_images: build_archaeology_prompt(has_images=has_images),
+    'scenario': lambda has_images: build_scenario_prompt(),
+    'walkaway': lambda has_images: build_walkaway_prompt(),
+    'combinations': lambda has_images: build_combinations_prompt(),
+    'playbook': lambda has_images: build_playbook_prompt(),
+}
+OPUS_SOURCES = ('overall',) + tuple(DEEP_DIVES)
+
+
+async def _opus_task(label, instructions, prefix, ask, emit, texts, timings, prefix_cached, run):
+    """One Opus thread. Deep dives first wait (up to CACHE_PRIME_SECONDS) for
+    the verdict's message_start, which means the shared prefix is cached."""
+    if label != 'overall':
+        try:
+            await asyncio.wait_for(prefix_cached.wait(), CACHE_PRIME_SECONDS)
+        except TimeoutError:
+            print(f'[async cache] {label}: verdict not started after {CACHE_PRIME_SECONDS:g}s, '
+                  f'sending without a cached prefix')
+    t0 = time.time()
+
+    def on_event(event):
+        if event.type == 'message_start' and label == 'overall':
+            prefix_cached.set()
+        if event.type != 'content_block_delta':
+            return
+        if event.delta.type == 'text_delta':
+            texts[label] += event.delta.text
+            emit(f'{label}_text', event.delta.text)
+        elif event.delta.type == 'thinking_delta':
+            emit(f'{label}_thinking', event.delta.thinking)
+
+    kwargs = {
+        'model': MODEL,
+        'max_tokens': 32000,
+        'messages': _document_messages(prefix, instructions, ask),
+    }
+    if 'opus' in MODEL.lower():
+        kwargs['thinking'] = {'type': 'adaptive'}
+    usage = None
+    try:
+        usage = await _stream_call(MODEL, kwargs, on_event, label, run)
+    except Exception as e:
+        message = e.message if isinstance(e, anthropic.APIError) else str(e)
+        emit('error', f'{label}: {message}')
+    finally:
+        if label == 'overall':
+            prefix_cached.set()  # failed or cancelled: don't hold the deep dives
+    timings[label] = round(time.time() - t0, 1)
+    emit(f'{label}_done', json.dumps({'seconds': timings[label], 'cache': usage}))
+
+
+async def _doc_context_task(doc, emit, run):
+    pre_ctx = doc.get('_doc_context')
+    if pre_ctx:
+        filtered = {k: v for k, v in pre_ctx.items()
+                    if v and v.lower() not in ('not specified', 'unknown', 'n/a')}
+        if filtered:
+            emit('doc_context', json.dumps(filtered))
+        return
+
+    async def call():
+        with call_metrics.timer('doc_context', FAST_MODEL, run) as timer:
+            resp = await get_async_client().messages.create(
+                model=FAST_MODEL,
+                max_tokens=300,
+                messages=[{'role': 'user', 'content': _doc_context_prompt(doc['text'])}],
+            )
+            timer.set_usage(resp.usage)
+        return resp
+
+    try:
+        resp = await _call_with_backoff(FAST_MODEL, call)
+        result = _parse_doc_context(resp.content[0].text)
+        if result:
+            emit('doc_context', json.dumps(result))
+    except Exception as e:
+        print(f'[async doc_context] Error: {e}')
+
+
+def _emit_cards_done(emit, seconds, clause_count):
+    emit('quick_done', json.dumps({'seconds': seconds, 'model': FAST_MODEL}))
+    emit('handoff', json.dumps({
+        'tricks_found': 0, 'summary': '',
+        'clause_count': clause_count, 'not_applicable': False}))
+
+
+async def _card_pipeline(doc_id, doc, emit, timings):
+    """Clause previews while the scan runs, then profile + cards in order."""
+    t0 = time.time()
+    prescan, precards = doc.get('_prescan'), doc.get('_precards')
+    if (prescan and prescan.get('clauses') and precards and precards.get('cards')
+            and '**Not Applicable**' not in prescan.get('scan_text', '')):
+        # Cards pre-generated during upload — emit instantly
+        if prescan.get('profile_text'):
+            emit('text', prescan['profile_text'] + '\n\n---\n\n')
+        for card_text in precards['cards']:
+            ct = card_text.strip().strip('-').strip()
+            if ct:
+                emit('text', ct + '\n\n---\n\n')
+        _emit_cards_done(emit, 0.1, sum(
+            1 for c in precards['cards'] if c and 'Fair Clauses Summary' not in c))
+        return
+
+    state = doc.get('_async_prescan')
+    if state is None:
+        state = start_prescan(doc_id, doc)
+
+    sent = 0
+    while True:
+        async with state.changed:
+            await state.changed.wait_for(
+                lambda: len(state.clauses) > sent or state.finished)
+        while sent < len(state.clauses):
+            clause = state.clauses[sent]
+            emit('clause_preview', json.dumps({
+                'index': sent, 'title': clause['title'],
+                'section': clause.get('section', '')}))
+            sent += 1
+        if state.finished:
+            break
+
+    result = state.result
+    if result and '**Not Applicable**' in result.get('scan_text', ''):
+        if result.get('profile_text'):
+            emit('text', result['profile_text'] + '\n')
+        emit('quick_done', json.dumps({'seconds': result.get('seconds', 0), 'model': FAST_MODEL}))
+        emit('handoff', json.dumps({
+            'tricks_found': 0, 'summary': '', 'clause_count': 0, 'not_applicable': True}))
+        timings['scan'] = result.get('seconds', 0)
+        raise _NotApplicable()
+    if not result or not result.get('clauses'):
+        emit('error', 'card_pipeline: clause identification failed')
+        _emit_cards_done(emit, round(time.time() - t0, 1), 0)
+        return
+
+    timings['scan'] = result.get('seconds', 0)
+    if result.get('profile_text'):
+        emit('text', result['profile_text'] + '\n\n---\n\n')
+    clause_count = 0
+    for future in state.cards:
+        card_text = await future
+        ct = card_text.strip().strip('-').strip()
+        if ct:
+            emit('text', ct + '\n\n---\n\n')
+            if 'Fair Clauses Summary' not in ct:
+                clause_count += 1
+    _emit_cards_done(emit, round(time.time() - t0, 1), clause_count)
+
+
+async def run_analysis(doc_id, doc, emit):
+    """Producer for one /analyze stream; emit(type, content) queues an SSE event."""
+    timings = {}
+    texts = {label: '' for label in OPUS_SOURCES}
+    page_images = await asyncio.to_thread(flipside._vision_pages, doc_id, doc)
+    deep_prefix = _document_prefix(doc['text'], page_images)
+    has_images = any(page_images)
+    prefix_cached = asyncio.Event()
+    run_calls = []
+
+    emit('phase', 'thinking')
+
+    prescan, precards = doc.get('_prescan'), doc.get('_precards')
+    claims_summary = ''
+    if prescan and '**Not Applicable**' in prescan.get('scan_text', ''):
+        scan_sec = prescan.get('seconds', 0)
+        if prescan.get('profile_text'):
+            emit('text', prescan['profile_text'] + '\n')
+        emit('quick_done', json.dumps({'seconds': scan_sec, 'model': FAST_MODEL}))
+        emit('handoff', json.dumps({
+            'tricks_found': 0, 'summary': '', 'clause_count': 0, 'not_applicable': True}))
+        emit('perf', _perf_event(doc.get('_prescan_calls') or []))
+        emit('done', json.dumps({'quick_seconds': scan_sec, 'deep_seconds': 0, 'model': MODEL}))
+        return
+    if prescan and prescan.get('clauses') and precards and precards.get('cards'):
+        claims_summary = _build_claims_summary(prescan, precards)
+
+    verdict_ask = ANALYSIS_ASK
+    if claims_summary:
+        verdict_ask += '\n\n' + claims_summary
+
+    outcome = 'complete'
+    try:
+        async with asyncio.timeout(ANALYSIS_TIMEOUT):
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(_opus_task(
+                    'overall', build_verdict_prompt(has_images=has_images),
+                    deep_prefix, verdict_ask, emit, texts, timings, prefix_cached, run_calls))
+                for label, prompt_fn in DEEP_DIVES.items():
+                    tg.create_task(_opus_task(
+                        label, prompt_fn(has_images), deep_prefix, ANALYSIS_ASK,
+                        emit, texts, timings, prefix_cached, run_calls))
+                tg.create_task(_doc_context_task(doc, emit, run_calls))
+                tg.create_task(_card_pipeline(doc_id, doc, emit, timings))
+    except* _NotApplicable:
+        outcome = 'not_applicable'  # pipeline emitted profile + handoff; Opus tasks cancelled
+    except* TimeoutError:
+        outcome = 'timeout'
+
+    # Upload-time prescan calls count toward this analysis too
+    emit('perf', _perf_event((doc.get('_prescan_calls') or []) + run_calls))
+    if outcome == 'not_applicable':
+        # Only now: an Opus event already in flight can't land after 'done'
+        emit('done', json.dumps({
+            'quick_seconds': timings.get('scan', 0), 'deep_seconds': 0, 'model': MODEL}))
+        return
+    if outcome == 'timeout':
+        emit('error', 'Analysis timed out after 5 minutes')
+    else:
+        documents.update(
+            doc_id,
+            _verdict_text=texts['overall'],
+            _deep_dive_texts={k: v for k, v in texts.items() if k != 'overall'},
+        )
+    emit('done', json.dumps({
+        'quick_seconds': timings.get('scan', 0),
+        'deep_seconds': max((timings.get(s, 0) for s in OPUS_SOURCES), default=0),
+        'model': MODEL}))
+
+
+def is_replay(doc):
+    """True when /analyze would replay a cache — left to the Flask route."""
+    sample_type = doc.get('_sample_type')
+    if sample_type and sample_type in _sample_cache:
+        return True
+    key = doc.get('_analysis_key')
+    return bool(key) and key in flipside._analysis_cache
+
+
+def _start_run(doc_id, doc, log, loop):
+    """RunRegistry start hook: the producer is a task on `loop`. Runs on the
+    loop, from join() or from the finish() of a cancelled run it follows."""
+    task = loop.create_task(_produce(doc_id, doc, log))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    # Called from the registry's grace timer thread
+    return lambda: loop.call_soon_threadsafe(task.cancel)
+
+
+async def _produce(doc_id, doc, log):
+    """Run the live analysis once, publishing every SSE chunk to `log`."""
+    milestones = _RunMilestones('async')
+
+    def emit(event_type, content=''):
+        chunk = sse(event_type, content)
+        milestones.see(chunk, event_type)
+        log.append(chunk)
+
+    abandoned = False
+    try:
+        await run_analysis(doc_id, doc, emit)
+    except asyncio.CancelledError:
+        abandoned = True  # every subscriber left
+        raise
+    except anthropic.AuthenticationError:
+        emit('error', 'Invalid API key. Check your ANTHROPIC_API_KEY.')
+    except Exception as e:
+        print(f'[async stream] Error: {e}')
+        emit('error', 'An internal error occurred. Please try again.')
+    finally:
+        documents.update(doc_id, analyzed=True)
+        recording = [c for c in log.entries() if _event_type(c) != 'perf']  # this run only
+        sample_type = doc.get('_sample_type')
+        if abandoned:
+            pass  # cut short: never cached
+        elif recording and sample_type:
+            _sample_cache[sample_type] = recording
+            _save_sample_cache()
+        elif recording and doc.get('_analysis_key'):
+            _save_analysis(doc, recording)
+        stream_runs.finish(doc_id, log)
+
+
+async def analyze_stream(doc_id, resume_from=0):
+    """Async generator of SSE chunks for /analyze/<doc_id> (live runs only).
+
+    Joins the document's run — the same registry the thread engine uses —
+    starting it if nobody is watching yet, replays its log from
+    `resume_from` (Last-Event-ID + 1), then tails it. Chunks carry their
+    log index as SSE id.
+    """
+    doc = get_document(doc_id)
+    loop = asyncio.get_running_loop()
+    log, started = stream_runs.join(
+        doc_id, lambda log: _start_run(doc_id, doc, log, loop), resume=resume_from > 0)
+    wake = asyncio.Event()
+
+    def _wake():
+        loop.call_soon_threadsafe(wake.set)
+
+    log.add_listener(_wake)
+    pos = 0 if started else resume_from
+    try:
+        while True:
+            wake.clear()
+            entries, closed = log.read(pos, timeout=0)
+            if entries:
+                for chunk in entries:
+                    yield f'id: {pos}\n{chunk}'
+                    pos += 1
+            elif closed:
+                return
+            else:
+                await wake.wait()
+    finally:
+        log.remove_listener(_wake)
+        stream_runs.leave(doc_id, log)
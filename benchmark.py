@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+FlipSide end-to-end benchmark — N concurrent sessions of upload + /analyze.
+
+Each session creates a document (/sample, /upload of a file, or /upload of
+pasted text made unique so it never hits the analysis cache), streams
+/analyze/<id> and times what the user sees:
+- first card: the second --- separator in the `text` stream (the first
+  segment is the document profile — the frontend's own rule)
+- verdict: the `overall_done` event
+- total: the final `done` event
+All times count from the start of the session, upload included.
+
+By default the harness runs fully offline: it starts fake_anthropic.py and
+a FlipSide server pointed at it, with caches in a temp directory, then
+samples the server's CPU and RSS from /proc while the sessions run.
+
+Usage:
+    python benchmark.py --sessions 20 --concurrency 5 --flow text
+    python benchmark.py --engine async --flow sample --error-rate 0.05
+    python benchmark.py --flow upload --async-upload --file big.pdf
+    python benchmark.py --base http://127.0.0.1:5001 --server-pid 1234   # existing server
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import fake_anthropic
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SEPARATOR_COUNT_FOR_FIRST_CARD = 2  # profile --- card 1 ---
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# ── Server under test ──
+
+def start_server(engine, port, api_url, workdir):
+    """Launch FlipSide on `port` against the fake API; returns the Popen."""
+    env = dict(os.environ,
+               ANTHROPIC_BASE_URL=api_url,
+               ANTHROPIC_API_KEY='fake-key',
+               FLIPSIDE_SAMPLE_CACHE=os.path.join(workdir, 'sample_cache.json'),
+               FLIPSIDE_ANALYSIS_CACHE_DIR=os.path.join(workdir, 'analysis_cache'),
+               FLIPSIDE_EXTRACTION_CACHE_DIR=os.path.join(workdir, 'extraction_cache'),
+               FLIPSIDE_PDF_SOURCE_DIR=os.path.join(workdir, 'pdf_sources'),
+               FLIPSIDE_PAGE_BLOB_DIR=os.path.join(workdir, 'page_blobs'),
+               PYTHONUNBUFFERED='1')
+    if engine == 'async':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:application',
+               '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c',
+               f'from app import app; app.run(port={port}, threaded=True)']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited, see {log.name}')
+        try:
+            requests.get(f'{base}/cache-status', timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'server did not start, see {log.name}')
+
+
+class ResourceSampler:
+    """CPU % and RSS of one process, read from /proc every `interval` seconds."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (cpu_percent, rss_bytes)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.available = pid is not None and os.path.exists(f'/proc/{pid}/stat')
+
+    def _cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def _rss(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _run(self):
+        last_cpu, last_t = self._cpu_seconds(), time.time()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, now = self._cpu_seconds(), time.time()
+                self.samples.append((100 * (cpu - last_cpu) / (now - last_t), self._rss()))
+                last_cpu, last_t = cpu, now
+            except (OSError, ValueError):
+                return
+
+    def start(self):
+        if self.available:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.available:
+            self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [c for c, _ in self.samples]
+        rss = [r for _, r in self.samples]
+        return {
+            'cpu_avg_percent': round(sum(cpu) / len(cpu), 1),
+            'cpu_max_percent': round(max(cpu), 1),
+            'rss_avg_mb': round(sum(rss) / len(rss) / 2 ** 20, 1),
+            'rss_max_mb': round(max(rss) / 2 ** 20, 1),
+        }
+
+
+# ── Sessions ──
+
+def create_document(base, flow, index, args, sample_texts):
+    """Create the session's document; returns doc_id."""
+    if flow == 'sample':
+        sample = args.samples[index % len(args.samples)]
+        r = requests.post(f'{base}/sample', json={'type': sample}, timeout=60)
+    elif flow == 'upload':
+        with open(args.file, 'rb') as f:
+            r = requests.post(f'{base}/upload', files={'file': (os.path.basename(args.file), f)},
+                              data={'async': '1'} if args.async_upload else None, timeout=300)
+        if args.async_upload:
+            r.raise_for_status()
+            return wait_for_text(base, r.json())
+    else:
+        # A nonce keeps every session off the content-addressed analysis cache
+        text = sample_texts[index % len(sample_texts)] + f'\n\nReference: {uuid.uuid4()}\n'
+        r = requests.post(f'{base}/upload', data={'text': text}, timeout=60)
+    r.raise_for_status()
+    return r.json()['doc_id']
+
+
+def wait_for_text(base, job):
+    """Follow an async upload's progress until its text is stored."""
+    with requests.get(base + job['progress_url'], stream=True, timeout=(10, 300)) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data: '):
+                continue
+            event = json.loads(line[6:])
+            if event['type'] == 'text':
+                return job['doc_id']
+            if event['type'] == 'error':
+                raise RuntimeError(event['content'])
+    raise RuntimeError('upload progress ended without text')
+
+
+def run_session(base, flow, index, args, sample_texts):
+    """One user: create a document, stream its analysis, time the milestones."""
+    result = {'session': index, 'flow': flow, 'live': False, 'error': None,
+              'upload': None, 'first_card': None, 'verdict': None, 'total': None, 'events': 0}
+    t0 = time.time()
+    try:
+        doc_id = create_document(base, flow, index, args, sample_texts)
+        result['upload'] = time.time() - t0
+        card_text = ''
+        with requests.get(f'{base}/analyze/{doc_id}', stream=True, timeout=(10, 600)) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data: '):
+                    continue
+                event = json.loads(line[6:])
+                etype = event.get('type')
+                result['events'] += 1
+                now = time.time() - t0
+                if etype == 'text' and result['first_card'] is None:
+                    card_text += event.get('content', '')
+                    if card_text.count('\n---\n') >= SEPARATOR_COUNT_FOR_FIRST_CARD:
+                        result['first_card'] = now
+                elif etype == 'overall_done' and result['verdict'] is None:
+                    result['verdict'] = now
+                elif etype == 'perf':
+                    result['live'] = True  # replays of cached recordings carry no perf event
+                elif etype == 'error':
+                    result['error'] = event.get('content')
+                elif etype == 'done':
+                    result['total'] = now
+                    break
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def summarize(results, elapsed):
+    """p50/p95/p99 per milestone, split by live runs and cache replays."""
+    out = {'sessions': len(results), 'seconds': round(elapsed, 2),
+           'errors': sum(1 for r in results if r['error'])}
+    for kind, group in (('live', [r for r in results if r['live']]),
+                        ('replay', [r for r in results if not r['live'] and r['total']])):
+        if not group:
+            continue
+        stats = {'sessions': len(group)}
+        for metric in ('upload', 'first_card', 'verdict', 'total'):
+            values = [r[metric] for r in group if r[metric] is not None]
+            if values:
+                stats[metric] = {f'p{int(q * 100)}': round(_percentile(values, q), 2)
+                                 for q in (0.5, 0.95, 0.99)}
+        out[kind] = stats
+    return out
+
+
+def print_report(summary, resources, fake_stats):
+    print(f'\n{summary["sessions"]} sessions in {summary["seconds"]}s, '
+          f'{summary["errors"]} with errors')
+    for kind in ('live', 'replay'):
+        stats = summary.get(kind)
+        if not stats:
+            continue
+        print(f'\n  {kind} ({stats["sessions"]} sessions)      p50      p95      p99')
+        for metric in ('upload', 'first_card', 'verdict', 'total'):
+            if metric in stats:
+                p = stats[metric]
+                print(f'    {metric:<18} {p["p50"]:>7.2f}s {p["p95"]:>7.2f}s {p["p99"]:>7.2f}s')
+    if resources:
+        print(f'\n  server CPU avg {resources["cpu_avg_percent"]}% (max {resources["cpu_max_percent"]}%), '
+              f'RSS avg {resources["rss_avg_mb"]} MB (max {resources["rss_max_mb"]} MB)')
+    else:
+        print('\n  server CPU/RSS: unavailable (pass --server-pid on Linux)')
+    if fake_stats:
+        print(f'  fake API: {fake_stats["calls"]} calls, {fake_stats["streams"]} streams, '
+              f'{fake_stats["errors"]} injected errors')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FlipSide end-to-end benchmark')
+    parser.add_argument('--base', help='benchmark an existing server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid of --base server for CPU/RSS')
+    parser.add_argument('--engine', choices=('thread', 'async'), default='thread',
+                        help='engine of the server this harness starts')
+    parser.add_argument('--flow', choices=('sample', 'upload', 'text'), default='text')
+    parser.add_argument('--samples', default='lease', help='comma-separated sample types')
+    parser.add_argument('--file', default=os.path.join(ROOT, 'test_lease_4clause.pdf'),
+                        help='file for --flow upload')
+    parser.add_argument('--async-upload', action='store_true',
+                        help='upload with async=1; "upload" then times until the text is ready')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--json', help='also write the summary and every session here')
+    parser.add_argument('--keep', action='store_true', help='keep the temp dir (server.log)')
+    fake_anthropic.add_arguments(parser)
+    args = parser.parse_args()
+    args.samples = [s.strip() for s in args.samples.split(',') if s.strip()]
+
+    with open(os.path.join(ROOT, 'data', 'samples.json')) as f:
+        samples = json.load(f)
+    sample_texts = [samples[s]['text'] for s in args.samples if s in samples] or \
+        [samples['lease']['text']]
+
+    fake = proc = None
+    workdir = tempfile.mkdtemp(prefix='flipside-bench-')
+    try:
+        if args.base:
+            base, pid = args.base.rstrip('/'), args.server_pid
+        else:
+            fake_port = _free_port()
+            fake = fake_anthropic.serve(fake_anthropic.config_from_args(args), port=fake_port)
+            proc, base = start_server(args.engine, _free_port(),
+                                      f'http://127.0.0.1:{fake_port}', workdir)
+            pid = proc.pid
+            print(f'FlipSide ({args.engine} engine) on {base}, fake API on :{fake_port}, '
+                  f'logs in {workdir}')
+
+        sampler = ResourceSampler(pid)
+        sampler.start()
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run_session, base, args.flow, i, args, sample_texts)
+                       for i in range(args.sessions)]
+            results = []
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                status = result['error'] or ('live' if result['live'] else 'replay')
+                total = f'{result["total"]:.1f}s' if result['total'] else '-'
+                print(f'  session {result["session"]:>3}: {total:>7} {status}')
+        elapsed = time.time() - t0
+        sampler.stop()
+
+        summary = summarize(results, elapsed)
+        resources = sampler.summary()
+        fake_stats = dict(fake.RequestHandlerClass.stats) if fake else None
+        print_report(summary, resources, fake_stats)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'args': vars(args), 'summary': summary, 'resources': resources,
+                           'fake_api': fake_stats, 'sessions': results}, f, indent=2)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if fake:
+            fake.shutdown()
+        if args.keep:
+            print(f'Kept {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the reversed-text detector (services/garbled_text.py).
+
+Times the one-pass detector against the per-line implementation it replaced
+(kept below as `legacy_garbled_lines`) on the data/samples.json texts and on
+synthetic large inputs, and checks that both flag the same lines:
+- samples: every sample text on its own
+- large: the samples repeated to about --pages pages (3,000 chars each)
+- reversed: the large text with every 7th line reversed
+- ocr: the large text with OCR-style noise (NBSP, ligatures, stray marks)
+
+Usage:
+    python benchmark_garble.py
+    python benchmark_garble.py --pages 500 --repeat 10
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+
+from services.garbled_text import garbled_lines, line_scores, COMMON_WORDS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGE_CHARS = 3000
+
+
+def legacy_garbled_lines(text):
+    """The detector as it was: reverse, split and re.sub every word of every line."""
+    def hits(words):
+        return sum(1 for w in words
+                   if re.sub(r'[^a-zA-Z]', '', w).lower() in COMMON_WORDS)
+
+    out = []
+    for i, line in enumerate(text.split('\n')):
+        words = line.split()
+        if len(words) < 4:
+            continue
+        if hits(line[::-1].split()) > hits(words) + 1:
+            out.append(i)
+    return out
+
+
+def build_inputs(pages):
+    with open(os.path.join(ROOT, 'data', 'samples.json')) as f:
+        samples = json.load(f)
+    texts = [s['text'] for s in samples.values()]
+    corpus = '\n'.join(texts)
+    large = (corpus * (pages * PAGE_CHARS // len(corpus) + 1))[:pages * PAGE_CHARS]
+    lines = large.split('\n')
+    reversed_ = '\n'.join(line[::-1] if i % 7 == 0 else line for i, line in enumerate(lines))
+    ocr = large.replace(' the ', '\xa0the\xa0').replace('fi', '\ufb01').replace('. ', '.\u00b7 ')
+    return [('samples', texts), ('large', [large]), ('reversed', [reversed_]), ('ocr', [ocr])]
+
+
+def best_of(fn, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for text in texts:
+            fn(text)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reversed-text detector micro-benchmark')
+    parser.add_argument('--pages', type=int, default=200, help='size of the synthetic inputs')
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs')
+    args = parser.parse_args()
+
+    print(f'{"input":<10} {"chars":>10} {"flagged":>8} {"legacy":>10} {"one-pass":>10} '
+          f'{"scores":>10} {"speedup":>8}')
+    for name, texts in build_inputs(args.pages):
+        for text in texts:
+            expected = legacy_garbled_lines(text)
+            if garbled_lines(text) != expected:
+                raise SystemExit(f'{name}: detectors disagree')
+        flagged = sum(len(legacy_garbled_lines(t)) for t in texts)
+        legacy = best_of(legacy_garbled_lines, texts, args.repeat)
+        new = best_of(garbled_lines, texts, args.repeat)
+        scores = best_of(line_scores, texts, args.repeat)
+        chars = sum(len(t) for t in texts)
+        print(f'{name:<10} {chars:>10,} {flagged:>8} {legacy * 1000:>8.1f}ms {new * 1000:>8.1f}ms '
+              f'{scores * 1000:>8.1f}ms {legacy / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the Anthropic Messages API — for benchmarks and demos
+without network or API spend.
+
+Speaks POST /v1/messages, streaming (SSE) and non-streaming, closely enough
+for the anthropic SDK: message_start with usage (prompt-cache reads and
+writes included), thinking and text content blocks, message_delta and
+message_stop. Replies are shaped after what FlipSide asks for, so the full
+pipeline runs: the clause scan returns CLAUSE lines and a profile, card
+workers return a card for their clause, doc context returns KEY: value
+lines, and everything else (verdict, deep dives, /ask...) streams filler.
+
+Usage:
+    python fake_anthropic.py --port 8765 --tps 80 --opus-tps 40 --error-rate 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=fake python app.py
+
+Latency: each call waits --ttft (Haiku) / --opus-ttft seconds before the
+first token, then emits tokens at --tps / --opus-tps. A "token" is one word.
+Errors: --error-rate of calls fail with --error-status (429 or 529).
+"""
+
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_TTL = 300  # seconds, like the API's default ephemeral cache
+WORDS = ('the clause lets the drafter change terms shift risk and keep the deposit '
+         'while the signer waives notice remedies and any claim to a refund').split()
+
+
+class FakeConfig:
+    """Latency, throughput, output sizes and error injection for the fake API."""
+
+    def __init__(self, ttft=0.4, tps=80.0, opus_ttft=1.5, opus_tps=40.0,
+                 thinking_tokens=200, output_tokens=400, card_tokens=120, clauses=6,
+                 error_rate=0.0, error_status=529, retry_after=1.0, chunk_tokens=3, seed=None):
+        self.ttft = ttft
+        self.tps = tps
+        self.opus_ttft = opus_ttft
+        self.opus_tps = opus_tps
+        self.thinking_tokens = thinking_tokens
+        self.output_tokens = output_tokens
+        self.card_tokens = card_tokens
+        self.clauses = clauses
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.chunk_tokens = chunk_tokens
+        self.random = random.Random(seed)
+
+    def pace(self, model):
+        """(seconds to first token, tokens per second) for `model`."""
+        if 'haiku' in model:
+            return self.ttft, self.tps
+        return self.opus_ttft, self.opus_tps
+
+
+class PromptCache:
+    """Which cached prefixes were written recently, per model."""
+
+    def __init__(self):
+        self._written = {}  # (model, prefix hash) -> last use
+        self._lock = threading.Lock()
+
+    def lookup(self, model, prefix_hash):
+        """True if the prefix is readable; records it as written otherwise."""
+        now = time.time()
+        with self._lock:
+            last = self._written.get((model, prefix_hash))
+            self._written[(model, prefix_hash)] = now
+            return last is not None and now - last < CACHE_TTL
+
+
+def _blocks(body):
+    """Every content block of the request in order, system first."""
+    system = body.get('system') or []
+    if isinstance(system, str):
+        system = [{'type': 'text', 'text': system}]
+    blocks = list(system)
+    for message in body.get('messages') or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        blocks.extend(content or [])
+    return blocks
+
+
+def _block_tokens(block):
+    if block.get('type') == 'image':
+        return 1500  # roughly what a page image costs
+    return len(json.dumps(block)) // 4
+
+
+def _usage(body, cache):
+    """Input usage: blocks up to the last cache_control are the cacheable
+    prefix — read if this model saw it recently, written otherwise."""
+    blocks = _blocks(body)
+    cut = max((i + 1 for i, b in enumerate(blocks) if b.get('cache_control')), default=0)
+    prefix_tokens = sum(_block_tokens(b) for b in blocks[:cut])
+    rest_tokens = sum(_block_tokens(b) for b in blocks[cut:])
+    usage = {'input_tokens': rest_tokens, 'cache_read_input_tokens': 0,
+             'cache_creation_input_tokens': 0, 'output_tokens': 1}
+    if cut:
+        digest = hashlib.sha256(json.dumps(blocks[:cut], sort_keys=True).encode()).hexdigest()
+        field = 'cache_read_input_tokens' if cache.lookup(body.get('model', ''), digest) \
+            else 'cache_creation_input_tokens'
+        usage[field] = prefix_tokens
+    return usage
+
+
+def _filler(n, rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def _reply(body, config):
+    """Response text shaped after the request's prompt."""
+    prompt = '\n'.join(b.get('text', '') for b in _blocks(body) if b.get('type') == 'text')
+    rng = config.random
+    if 'Speed-scan this contract' in prompt:
+        lines = [f'CLAUSE: Clause {i + 1} (§{i + 1}) | RISK: {rng.choice(("RED", "YELLOW"))} '
+                 f'| TRICK: {rng.choice(("Silent Waiver", "Moving Target", "Penalty Disguise"))}'
+                 for i in range(config.clauses)]
+        lines += ['GREEN_CLAUSES: Payment schedule, Notices',
+                  '## Document Profile', '- **Document Type**: Agreement',
+                  '- **Drafted by**: The Company', '- **Your role**: Signer']
+        return '\n'.join(lines) + '\n'
+    match = re.search(r'Title: (.+)', prompt)
+    if 'Generate a complete flip card' in prompt and match:
+        return (f'### {match.group(1).strip()}\n'
+                f'[RED] · Score: {rng.randint(40, 95)}/100 · Trick: Silent Waiver\n'
+                f'**Bottom line:** {_filler(config.card_tokens, rng)}\n')
+    if 'Extract factual metadata' in prompt:
+        return ('TYPE: Agreement\nDRAFTER: The Company\nOTHER_PARTY: Signer\n'
+                'JURISDICTION: Unknown\nDATE: Unknown\nDURATION: 12 months\nKEY_AMOUNT: $1,000\n')
+    return _filler(config.output_tokens, rng)
+
+
+def _chunks(text, size):
+    """Split text into pieces of `size` words, keeping the whitespace."""
+    words = re.findall(r'\S+\s*|\s+', text)
+    return [''.join(words[i:i + size]) for i in range(0, len(words), size)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = FakeConfig()
+    cache = PromptCache()
+    stats = {'calls': 0, 'errors': 0, 'streams': 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass  # the benchmark prints its own summary
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.stats_lock:
+                self._json(200, dict(self.stats))
+        else:
+            self._json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.split('?')[0].endswith('/v1/messages'):
+            self._json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+        self._count('calls')
+        config = self.config
+        if config.error_rate and config.random.random() < config.error_rate:
+            self._count('errors')
+            kind = 'rate_limit_error' if config.error_status == 429 else 'overloaded_error'
+            self._json(config.error_status,
+                       {'type': 'error', 'error': {'type': kind, 'message': 'Injected by fake_anthropic'}},
+                       {'retry-after': f'{config.retry_after:g}'})
+            return
+        usage = _usage(body, self.cache)
+        text = _reply(body, config)
+        thinking = ''
+        if (body.get('thinking') or {}).get('type', 'disabled') != 'disabled':
+            thinking = _filler(config.thinking_tokens, config.random)
+        if body.get('stream'):
+            self._count('streams')
+            self._stream(body, usage, thinking, text)
+        else:
+            self._complete(body, usage, thinking, text)
+
+    def _complete(self, body, usage, thinking, text):
+        ttft, tps = self.config.pace(body.get('model', ''))
+        words = len(text.split()) + len(thinking.split())
+        time.sleep(ttft + words / tps)
+        content = []
+        if thinking:
+            content.append({'type': 'thinking', 'thinking': thinking, 'signature': 'fake'})
+        content.append({'type': 'text', 'text': text})
+        usage['output_tokens'] = words
+        self._json(200, {
+            'id': f'msg_{uuid.uuid4().hex[:24]}', 'type': 'message', 'role': 'assistant',
+            'model': body.get('model', ''), 'content': content,
+            'stop_reason': 'end_turn', 'stop_sequence': None, 'usage': usage,
+        })
+
+    def _event(self, payload):
+        data = f'event: {payload["type"]}\ndata: {json.dumps(payload)}\n\n'.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _stream(self, body, usage, thinking, text):
+        model = body.get('model', '')
+        ttft, tps = self.config.pace(model)
+        size = self.config.chunk_tokens
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('cache-control', 'no-cache')
+        self.send_header('transfer-encoding', 'chunked')
+        self.end_headers()
+        output = 0
+        try:
+            time.sleep(ttft)  # prefill: message_start arrives with the first token
+            self._event({'type': 'message_start', 'message': {
+                'id': f'msg_{uuid.uuid4().hex[:24]}', 'type': 'message', 'role': 'assistant',
+                'model': model, 'content': [], 'stop_reason': None, 'stop_sequence': None,
+                'usage': usage}})
+            index = 0
+            for kind, value in (('thinking', thinking), ('text', text)):
+                if not value:
+                    continue
+                start = {'type': kind, kind: ''}
+                if kind == 'thinking':
+                    start['signature'] = ''
+                self._event({'type': 'content_block_start', 'index': index, 'content_block': start})
+                for piece in _chunks(value, size):
+                    self._event({'type': 'content_block_delta', 'index': index,
+                                 'delta': {'type': f'{kind}_delta', kind: piece}})
+                    output += len(piece.split())
+                    time.sleep(len(piece.split()) / tps)
+                if kind == 'thinking':
+                    self._event({'type': 'content_block_delta', 'index': index,
+                                 'delta': {'type': 'signature_delta', 'signature': 'fake'}})
+                self._event({'type': 'content_block_stop', 'index': index})
+                index += 1
+            self._event({'type': 'message_delta',
+                         'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                         'usage': {'output_tokens': output}})
+            self._event({'type': 'message_stop'})
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client closed the stream (cancelled call)
+
+
+def serve(config, host='127.0.0.1', port=8765):
+    """Start the fake API in a background thread; returns the server."""
+    handler = type('ConfiguredHandler', (Handler,), {
+        'config': config, 'cache': PromptCache(),
+        'stats': {'calls': 0, 'errors': 0, 'streams': 0}, 'stats_lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """Fake API options, shared with benchmark.py."""
+    parser.add_argument('--ttft', type=float, default=0.4, help='Haiku seconds to first token')
+    parser.add_argument('--tps', type=float, default=80.0, help='Haiku tokens per second')
+    parser.add_argument('--opus-ttft', type=float, default=1.5, help='Opus seconds to first token')
+    parser.add_argument('--opus-tps', type=float, default=40.0, help='Opus tokens per second')
+    parser.add_argument('--thinking-tokens', type=int, default=200,
+                        help='thinking tokens when a call enables thinking')
+    parser.add_argument('--output-tokens', type=int, default=400,
+                        help='text tokens for verdict / deep dive / ask replies')
+    parser.add_argument('--card-tokens', type=int, default=120, help='text tokens per card')
+    parser.add_argument('--clauses', type=int, default=6, help='CLAUSE lines per scan')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of calls that fail with --error-status')
+    parser.add_argument('--error-status', type=int, default=529, choices=(429, 529))
+    parser.add_argument('--retry-after', type=float, default=1.0,
+                        help='retry-after header on injected errors (seconds)')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_args(args):
+    return FakeConfig(
+        ttft=args.ttft, tps=args.tps, opus_ttft=args.opus_ttft, opus_tps=args.opus_tps,
+        thinking_tokens=args.thinking_tokens, output_tokens=args.output_tokens,
+        card_tokens=args.card_tokens, clauses=args.clauses, error_rate=args.error_rate,
+        error_status=args.error_status, retry_after=args.retry_after, seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline fake Anthropic Messages API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(config_from_args(args), args.host, args.port)
+    print(f'Fake Anthropic API on http://{args.host}:{args.port} '
+          f'(set ANTHROPIC_BASE_URL to this) — Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -169,10 +169,11 @@ If the document has NO terms or obligations (recipe, novel, article), output ONL
 **Not Applicable**: [1-sentence reason]"""
 
 
-def build_single_card_system(doc_text):
-    """Phase 2: System prompt for per-clause card generation.
-    Includes document text so prompt caching is shared across parallel calls."""
-    return f"""You are a contract analyst generating a SINGLE complete flip card. Output ONLY the card content — no preamble, no "Here is the card", no --- separators.
+def build_single_card_system(doc_text=None):
+    """Phase 2: Instructions for per-clause card generation.
+    With doc_text the document is appended (self-contained system prompt);
+    without it the caller sends the document as the shared cached prefix."""
+    instructions = f"""You are a contract analyst generating a SINGLE complete flip card. Output ONLY the card content — no preamble, no "Here is the card", no --- separators.
 
 ## LANGUAGE RULE
 ALWAYS respond in ENGLISH regardless of the document's language. When quoting text from the document, keep quotes in the original language and add an English translation in parentheses if the quote is not in English.
@@ -257,7 +258,10 @@ Confidence: [HIGH/MEDIUM/LOW] — [one short reason]
 11. MAXIMUM ENFORCEMENT TEST — MANDATORY: Every [EXAMPLE] must answer: "If the drafter sought maximum advantage, what does this clause let them attempt?" Stay within what the clause text actually permits — don't invent powers it doesn't grant, and don't ignore its own exceptions. If the clause has a "unless/except" protection, your scenario must work AROUND it, not pretend it doesn't exist.
 12. NEVER-GREEN LIST: These clause types are ALWAYS at least YELLOW, never GREEN: (a) unilateral amendment of financial terms — one party can change interest rates, fees, or pricing after signing; (b) silence-as-consent — inaction or continued use = agreement to new terms; (c) sole discretion over financial terms. These are "Moving Target" tricks even when they include a notice period.
 13. NO GREEN OUTPUT: You are generating a single card for a clause that was flagged during pre-scan. Your output MUST be RED or YELLOW — never GREEN. If you genuinely believe the clause is fair, output YELLOW with Score: 15/100 and Trick: None. Green clauses are handled separately.
-14. OMISSION TEST — MANDATORY: Every [EXAMPLE] must end by naming one specific protection the clause does NOT contain. State it as a structural fact about the text: "This clause contains no [force majeure exception / mutual cancellation right / pro-rata refund / cap on penalties / notice-and-cure period]." This is the gap between what a reasonable signer would expect and what's written. Never state likelihood, never predict what courts would do, never write "in practice." The omission IS the finding.
+14. OMISSION TEST — MANDATORY: Every [EXAMPLE] must end by naming one specific protection the clause does NOT contain. State it as a structural fact about the text: "This clause contains no [force majeure exception / mutual cancellation right / pro-rata refund / cap on penalties / notice-and-cure period]." This is the gap between what a reasonable signer would expect and what's written. Never state likelihood, never predict what courts would do, never write "in practice." The omission IS the finding."""
+    if doc_text is None:
+        return instructions
+    return instructions + f"""
 
 ## DOCUMENT:
 
@@ -0,0 +1,29 @@
+"""Runtime services for FlipSide: document storage, caching and related infrastructure."""
+
+from .document_store import (
+    DocumentStore,
+    MemoryDocumentStore,
+    SQLiteDocumentStore,
+    create_document_store,
+    document_size,
+    start_reaper,
+)
+from .analysis_cache import (
+    AnalysisCache,
+    analysis_key,
+    prompt_version,
+)
+from .extraction_cache import ExtractionCache, extraction_key, file_digest
+from .blob_store import BlobStore
+from .scheduler import LLMScheduler
+from .rate_limiter import (
+    AdaptiveLimiter,
+    CircuitOpenError,
+    RateLimiterRegistry,
+    call_with_backoff,
+)
+from .event_log import EventLog, RunRegistry
+from .call_metrics import CallMetrics, CallTimer, input_cost, summarize_run
+from .runtime_metrics import RuntimeMetrics
+from .pdf_extract import PageSettings, PdfPagePool
+from .garbled_text import garbled_lines, has_garbled_text, line_scores, unreverse
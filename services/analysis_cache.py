@@ -0,0 +1,115 @@
+"""Content-addressed cache of finished analyses.
+
+The key is a SHA-256 over the normalized document text, the model IDs and a
+hash of the prompt texts, so any change to a prompt or model invalidates old
+entries automatically. Each entry holds everything needed to serve the
+document again without an API call: the prescan clauses, card texts, verdict,
+deep-dive texts and the recorded SSE stream for /analyze replay.
+
+Entries are one JSON file each, written atomically, so every worker process
+on the host shares the cache.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivial re-extraction differences still hit."""
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+def prompt_version(*prompt_texts):
+    """Short hash over the prompt texts that shape an analysis."""
+    h = hashlib.sha256()
+    for text in prompt_texts:
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def analysis_key(text, models, prompt_hash, has_images=False):
+    """Cache key for one document under one model/prompt configuration."""
+    h = hashlib.sha256()
+    h.update(normalize_text(text).encode('utf-8'))
+    for model in models:
+        h.update(b'\0' + model.encode('utf-8'))
+    h.update(b'\0' + prompt_hash.encode('utf-8'))
+    h.update(b'\0images' if has_images else b'\0text')
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """Directory of `<key>.json` entries, bounded to `max_entries` files."""
+
+    def __init__(self, directory, max_entries=500):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Return the cached entry dict, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Recency for eviction
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        entry = dict(entry, created=time.time())
+        tmp = self._path(key) + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        """Remove least-recently-used entries beyond max_entries."""
+        try:
+            files = [os.path.join(self.directory, n)
+                     for n in os.listdir(self.directory) if n.endswith('.json')]
+        except OSError:
+            return
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for path in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        try:
+            entries = sum(1 for n in os.listdir(self.directory) if n.endswith('.json'))
+        except OSError:
+            entries = 0
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
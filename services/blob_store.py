@@ -0,0 +1,210 @@
+"""Content-addressed files on disk.
+
+A blob is stored once under the SHA-256 hex digest of its bytes, so the same
+upload made twice (or by two worker processes) shares one file. Blobs are
+written to a temp file and renamed into place. Least recently used blobs are
+removed once the directory exceeds `max_bytes`; `path()` counts as a use.
+Writes add to a running total, so the directory is only listed at startup
+and when that total goes over budget (picking up other processes' writes).
+
+read() maps a blob instead of copying it into memory. encoded() is for
+JSON payloads that need base64: each blob is encoded once and the string is
+shared by every thread, in an LRU bounded to `encoded_max_bytes`.
+"""
+
+import os
+import mmap
+import base64
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class BlobStore:
+    """Directory of `<digest><suffix>` files, bounded to `max_bytes` on disk."""
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, suffix='',
+                 encoded_max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.encoded_max_bytes = encoded_max_bytes
+        self.encoded_hits = 0
+        self.encoded_misses = 0
+        self._lock = threading.Lock()
+        self._encoded = OrderedDict()  # digest -> base64 str, oldest first
+        self._encoded_bytes = 0
+        self._encoded_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(size for _, _, size in self._entries())
+
+    def _file(self, digest):
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def path(self, digest):
+        """Path of a stored blob, or None if it is unknown (or was evicted)."""
+        path = self._file(digest)
+        try:
+            os.utime(path)  # Recency for eviction
+        except OSError:
+            return None
+        return path
+
+    def read(self, digest):
+        """The blob as a read-only mmap (close it when done), or None."""
+        path = self.path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def encoded(self, digest):
+        """The blob base64-encoded, or None if it is gone."""
+        with self._encoded_lock:
+            encoded = self._encoded.get(digest)
+            if encoded is not None:
+                self._encoded.move_to_end(digest)
+                self.encoded_hits += 1
+                return encoded
+        data = self.read(digest)
+        if data is None:
+            return None
+        with data:
+            encoded = base64.b64encode(data).decode('ascii')
+        with self._encoded_lock:
+            self.encoded_misses += 1
+            if digest not in self._encoded:
+                self._encoded[digest] = encoded
+                self._encoded_bytes += len(encoded)
+            while self._encoded_bytes > self.encoded_max_bytes and len(self._encoded) > 1:
+                _, dropped = self._encoded.popitem(last=False)
+                self._encoded_bytes -= len(dropped)
+        return encoded
+
+    def put(self, data):
+        """Store bytes; returns their digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.path(digest) is None:
+            self._write(digest, lambda f: f.write(data))
+        return digest
+
+    def put_stream(self, stream, digest):
+        """Store a seekable binary stream whose digest the caller already
+        has (see extraction_cache.file_digest); the stream is rewound. A
+        stream backed by a file on the same filesystem is hard-linked
+        instead of copied. Returns the blob's path."""
+        path = self.path(digest)
+        if path is None:
+            if not self._link(getattr(stream, 'name', None), digest):
+                self._write(digest, lambda f: shutil.copyfileobj(stream, f, 1 << 20))
+                stream.seek(0)
+            path = self._file(digest)
+        return path
+
+    def _link(self, source, digest):
+        if not isinstance(source, str):
+            return False
+        path = self._file(digest)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(source, tmp)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        self._added(size, keep=path)
+        return True
+
+    def _write(self, digest, write):
+        path = self._file(digest)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                write(f)
+                size = f.tell()
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._added(size, keep=path)
+
+    def _added(self, size, keep):
+        """Count a blob just stored; evict if the total is now over budget."""
+        with self._lock:
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict(keep=keep)
+
+    def _entries(self):
+        """[(path, last_used, bytes)] for every stored blob."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_mtime, st.st_size))
+        return entries
+
+    def _evict(self, keep=None):
+        """Remove least-recently-used blobs until under max_bytes, never
+        the one just written (`keep`). Rescans the directory and resets the
+        running total from it."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+            self._bytes = total
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = 0
+        with self._encoded_lock:
+            self._encoded.clear()
+            self._encoded_bytes = 0
+
+    def stats(self):
+        entries = self._entries()
+        with self._encoded_lock:
+            encoded = {'entries': len(self._encoded), 'bytes': self._encoded_bytes,
+                       'max_bytes': self.encoded_max_bytes,
+                       'hits': self.encoded_hits, 'misses': self.encoded_misses}
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, _, size in entries),
+            'max_bytes': self.max_bytes,
+            'encoded': encoded,
+        }
@@ -0,0 +1,224 @@
+"""Per-call token and latency accounting for upstream LLM calls.
+
+Each Anthropic call is wrapped in a CallTimer that captures input, output,
+cache-read and cache-creation tokens, time to first token and total
+duration. Finished calls are added to the process-wide CallMetrics
+(served on /metrics) and, when the caller passes a `run` list, to that
+run's records — which become the run's `perf` SSE event.
+
+Labels like card_3 are aggregated under their thread name ('card').
+"""
+
+import re
+import time
+import threading
+from collections import deque
+
+USAGE_FIELDS = (
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
+)
+INPUT_FIELDS = ('input_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens')
+
+# Input price multipliers relative to uncached input
+CACHE_WRITE_COST = 1.25
+CACHE_READ_COST = 0.1
+
+
+def input_cost(counts):
+    """Input cost of some usage counts, in uncached-input-token equivalents."""
+    return (counts.get('input_tokens', 0)
+            + CACHE_WRITE_COST * counts.get('cache_creation_input_tokens', 0)
+            + CACHE_READ_COST * counts.get('cache_read_input_tokens', 0))
+
+
+def thread_label(label):
+    """Aggregation key for a call label: card_3 -> card."""
+    return re.sub(r'_\d+$', '', label)
+
+
+class CallTimer:
+    """Measures one upstream call. Use as a context manager, or call finish()."""
+
+    def __init__(self, metrics, label, model, run=None):
+        self.metrics = metrics
+        self.label = label
+        self.model = model
+        self.run = run
+        self.started = time.time()
+        self.first_token_at = None
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self.record = None
+        metrics.started(model)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A closed generator or cancelled task is a stop, not a failure
+        self.finish(error=exc if isinstance(exc, Exception) else None)
+        return False
+
+    def first_token(self):
+        """Mark time to first token (only the first call counts)."""
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+
+    def on_event(self, event):
+        """Feed one raw stream event: usage from message_start and
+        message_delta, time to first token from the first content delta."""
+        etype = getattr(event, 'type', '')
+        if etype == 'message_start':
+            self.set_usage(event.message.usage)
+        elif etype == 'message_delta':
+            output = getattr(getattr(event, 'usage', None), 'output_tokens', None)
+            if output:
+                self.usage['output_tokens'] = output  # cumulative
+        elif etype == 'content_block_delta':
+            self.first_token()
+
+    def set_usage(self, usage):
+        """Take counts from an SDK Usage object (final message or response)."""
+        for field in USAGE_FIELDS:
+            value = getattr(usage, field, None)
+            if value is not None:
+                self.usage[field] = value
+
+    def cache_counts(self):
+        """Input split into cache reads, cache writes and uncached tokens."""
+        return {field: self.usage[field] for field in INPUT_FIELDS}
+
+    def finish(self, error=None):
+        """Record the call once; returns its record."""
+        if self.record is not None:
+            return self.record
+        now = time.time()
+        self.record = {
+            'label': self.label,
+            'model': self.model,
+            **self.usage,
+            'ttft': round(self.first_token_at - self.started, 3) if self.first_token_at else None,
+            'seconds': round(now - self.started, 3),
+            'started': self.started,
+            'error': error is not None,
+        }
+        self.metrics.add(self.record)
+        if self.run is not None:
+            self.run.append(self.record)
+        return self.record
+
+
+class _LabelStats:
+    """Running totals for one thread label."""
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.errors = 0
+        self.tokens = dict.fromkeys(USAGE_FIELDS, 0)
+        self.seconds_total = 0.0
+        self.ttft_total = 0.0
+        self.ttft_count = 0
+        self.seconds = deque(maxlen=samples)
+        self.ttfts = deque(maxlen=samples)
+        self.models = set()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CallMetrics:
+    """Process-wide totals per thread label, with recent-latency percentiles."""
+
+    def __init__(self, samples=500, on_record=None):
+        self.samples = samples
+        self.on_record = on_record  # called with each finished call's record
+        self._labels = {}
+        self._in_flight = {}  # model -> calls started but not finished
+        self._lock = threading.Lock()
+
+    def timer(self, label, model, run=None):
+        """Start timing a call; `run` (a list) also receives its record."""
+        return CallTimer(self, label, model, run)
+
+    def started(self, model):
+        with self._lock:
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+
+    def in_flight(self):
+        """{model: upstream calls currently open}."""
+        with self._lock:
+            return dict(self._in_flight)
+
+    def add(self, record):
+        """Account for a finished call (CallTimer.finish calls this)."""
+        with self._lock:
+            if self._in_flight.get(record['model']):
+                self._in_flight[record['model']] -= 1
+            stats = self._labels.get(thread_label(record['label']))
+            if stats is None:
+                stats = self._labels[thread_label(record['label'])] = _LabelStats(self.samples)
+            stats.calls += 1
+            stats.errors += record['error']
+            stats.models.add(record['model'])
+            for field in USAGE_FIELDS:
+                stats.tokens[field] += record[field]
+            stats.seconds_total += record['seconds']
+            stats.seconds.append(record['seconds'])
+            if record['ttft'] is not None:
+                stats.ttft_total += record['ttft']
+                stats.ttft_count += 1
+                stats.ttfts.append(record['ttft'])
+        if self.on_record:
+            self.on_record(record)
+
+    def stats(self):
+        """Per-label calls, tokens, cache hit rate, input cost and latency."""
+        with self._lock:
+            out = {}
+            for label, s in self._labels.items():
+                total_input = sum(s.tokens[field] for field in INPUT_FIELDS)
+                out[label] = {
+                    'calls': s.calls,
+                    'errors': s.errors,
+                    'models': sorted(s.models),
+                    **s.tokens,
+                    'hit_rate': round(s.tokens['cache_read_input_tokens'] / total_input, 3)
+                    if total_input else 0.0,
+                    'input_cost_tokens': round(input_cost(s.tokens)),
+                    'avg_seconds': round(s.seconds_total / s.calls, 3),
+                    'p50_seconds': _percentile(s.seconds, 0.5),
+                    'p95_seconds': _percentile(s.seconds, 0.95),
+                    'avg_ttft': round(s.ttft_total / s.ttft_count, 3) if s.ttft_count else None,
+                    'p95_ttft': _percentile(s.ttfts, 0.95),
+                }
+            return out
+
+
+def summarize_run(records):
+    """The `perf` event payload for one run: each call plus totals.
+    `wall_seconds` spans the first call's start to the last call's end."""
+    calls = [{k: v for k, v in r.items() if k != 'started'} for r in records]
+    totals = dict.fromkeys(USAGE_FIELDS, 0)
+    for record in records:
+        for field in USAGE_FIELDS:
+            totals[field] += record[field]
+    wall = 0.0
+    if records:
+        start = min(r['started'] for r in records)
+        wall = max(r['started'] + r['seconds'] for r in records) - start
+    return {
+        'calls': calls,
+        'totals': {
+            **totals,
+            'calls': len(records),
+            'input_cost_tokens': round(input_cost(totals)),
+            'call_seconds': round(sum(r['seconds'] for r in records), 2),
+            'wall_seconds': round(wall, 2),
+        },
+    }
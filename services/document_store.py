@@ -0,0 +1,405 @@
+"""Document stores — where uploaded documents and their analysis results live.
+
+Two backends share one interface:
+- MemoryDocumentStore: the original process-local dict (single worker only)
+- SQLiteDocumentStore: SQLite in WAL mode, shared by every worker process on
+  the host and kept across restarts
+
+Documents are plain dicts. Only the fields in PERSISTENT_FIELDS are written
+to disk; everything else (threading events, card queues) is runtime state
+that stays with the dict object in the process that created it. Page images
+are references (digests into the app's page blob store), not image data.
+
+Both backends also enforce a resident-byte budget (see enforce_budget): the
+heaviest, least-recently-touched documents are dropped from memory. Page
+image bytes are not part of it; the page blob store has its own budget.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+# Fields that survive a restart / are visible to other worker processes
+PERSISTENT_FIELDS = (
+    'text',
+    'filename',
+    'ocr_used',
+    'page_images',
+    'pdf_digest',
+    'vision_pages',
+    '_vision_requested',
+    'analyzed',
+    '_ts',
+    '_sample_type',
+    '_doc_context',
+    '_prescan',
+    '_precards',
+    '_card_total',
+    '_verdict_text',
+    '_deep_dive_texts',
+    '_analysis_key',
+)
+
+
+def _value_bytes(value):
+    """Approximate resident size of a JSON-like value (str/bytes/list/dict)."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _value_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_bytes(v) for v in value)
+    return 8
+
+
+def document_size(doc):
+    """Per-field byte accounting for one document.
+
+    Only string-ish content is counted — events and queues are negligible.
+    Returns {field: bytes} for fields that take up space.
+    """
+    sizes = {}
+    for key, value in doc.items():
+        if isinstance(value, (str, bytes, bytearray, list, tuple, dict)):
+            n = _value_bytes(value)
+            if n:
+                sizes[key] = n
+    return sizes
+
+
+def _is_busy(doc):
+    """True while a prescan is still writing into this document's dict."""
+    ev = doc.get('_prescan_event')
+    return ev is not None and not ev.is_set()
+
+
+class DocumentStore:
+    """Interface shared by all document store backends.
+
+    Supports the dict-style access app.py already relies on:
+    `doc_id in store` and `store.get(doc_id)`.
+    """
+
+    def get(self, doc_id):
+        """Return the document dict, or None if unknown."""
+        raise NotImplementedError
+
+    def put(self, doc_id, doc):
+        """Store a new document (replaces any existing one)."""
+        raise NotImplementedError
+
+    def update(self, doc_id, **fields):
+        """Set fields on a stored document and persist the durable ones."""
+        raise NotImplementedError
+
+    def delete(self, doc_id):
+        raise NotImplementedError
+
+    def doc_ids(self):
+        """Return a list of all stored document ids."""
+        raise NotImplementedError
+
+    def evict_older_than(self, ttl):
+        """Remove documents whose `_ts` is more than `ttl` seconds old.
+        Returns the number of documents removed."""
+        raise NotImplementedError
+
+    def __contains__(self, doc_id):
+        return self.get(doc_id) is not None
+
+    def __len__(self):
+        return len(self.doc_ids())
+
+    # ── Resident-memory accounting (shared by both backends) ──
+
+    def _init_accounting(self):
+        self._atime = {}  # doc_id -> last get/put time
+        self.evictions = {'documents': 0, 'ttl': 0}
+        # Set by the app: in_use(doc_id) is True while something running
+        # (an analysis, a stream, an upload job) holds the live dict
+        self.in_use = lambda doc_id: False
+
+    def _count_evictions(self, kind, n=1):
+        with self._lock:
+            self.evictions[kind] += n
+
+    def _touch(self, doc_id):
+        self._atime[doc_id] = time.time()
+
+    def _resident(self):
+        """Return [(doc_id, doc)] currently held in this process's memory."""
+        raise NotImplementedError
+
+    def _drop_resident(self, doc_id):
+        """Release a whole document from this process's memory."""
+        raise NotImplementedError
+
+    def resident_bytes(self):
+        """Return (total_bytes, {field: bytes}) for resident documents."""
+        total = 0
+        by_field = {}
+        for _doc_id, doc in self._resident():
+            for field, n in document_size(doc).items():
+                by_field[field] = by_field.get(field, 0) + n
+                total += n
+        return total, by_field
+
+    def enforce_budget(self, max_bytes):
+        """Shrink resident documents until they fit in `max_bytes`.
+
+        Victims are ordered by size × idle time, so a heavy document nobody
+        has looked at in a while goes before a small one that is being read.
+        Returns the number of bytes released.
+        """
+        now = time.time()
+        sized = []
+        total = 0
+        for doc_id, doc in self._resident():
+            doc_bytes = sum(document_size(doc).values())
+            total += doc_bytes
+            idle = now - self._atime.get(doc_id, doc.get('_ts', now))
+            sized.append((doc_bytes * max(idle, 1.0), doc_id, doc, doc_bytes))
+        if total <= max_bytes:
+            return 0
+        sized.sort(key=lambda item: item[0], reverse=True)
+        released = 0
+        for _score, doc_id, doc, doc_bytes in sized:
+            if total - released <= max_bytes:
+                break
+            # Its runtime state (events, channels) would be lost mid-run
+            if _is_busy(doc) or self.in_use(doc_id):
+                continue
+            self._drop_resident(doc_id)
+            released += doc_bytes
+            self._count_evictions('documents')
+        return released
+
+    def _eviction_counts(self):
+        with self._lock:
+            return dict(self.evictions)
+
+    def stats(self):
+        total, by_field = self.resident_bytes()
+        return {
+            'backend': type(self).__name__,
+            'documents': len(self),
+            'resident_documents': len(self._resident()),
+            'resident_bytes': total,
+            'resident_bytes_by_field': by_field,
+            'evictions': self._eviction_counts(),
+        }
+
+
+class MemoryDocumentStore(DocumentStore):
+    """Process-local dict store. Fast, but invisible to other workers."""
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.Lock()
+        self._init_accounting()
+
+    def get(self, doc_id):
+        doc = self._docs.get(doc_id)
+        if doc is not None:
+            self._touch(doc_id)
+        return doc
+
+    def put(self, doc_id, doc):
+        with self._lock:
+            self._docs[doc_id] = doc
+            self._touch(doc_id)
+
+    def update(self, doc_id, **fields):
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            if doc is not None:
+                doc.update(fields)
+
+    def delete(self, doc_id):
+        with self._lock:
+            self._docs.pop(doc_id, None)
+            self._atime.pop(doc_id, None)
+
+    def doc_ids(self):
+        with self._lock:
+            return list(self._docs.keys())
+
+    def evict_older_than(self, ttl):
+        now = time.time()
+        with self._lock:
+            stale = [k for k, v in self._docs.items() if now - v.get('_ts', 0) > ttl]
+            for k in stale:
+                del self._docs[k]
+                self._atime.pop(k, None)
+            self.evictions['ttl'] += len(stale)
+        return len(stale)
+
+    def _resident(self):
+        with self._lock:
+            return list(self._docs.items())
+
+    def _drop_resident(self, doc_id):
+        self.delete(doc_id)
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """SQLite (WAL) store.
+
+    Each process keeps its own live dict per document so runtime fields
+    (events, queues) survive between calls; `get` refreshes the durable
+    fields from the database so writes from other workers are visible.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._live = {}  # doc_id -> dict (this process's view)
+        self._init_accounting()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            ' doc_id TEXT PRIMARY KEY,'
+            ' ts REAL NOT NULL,'
+            ' fields TEXT NOT NULL,'
+            ' page_count INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._conn.commit()
+
+    # ── Row helpers ──
+
+    @staticmethod
+    def _durable(doc):
+        return {k: doc[k] for k in PERSISTENT_FIELDS if k in doc}
+
+    def _read_row(self, doc_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT fields FROM documents WHERE doc_id = ?',
+                (doc_id,),
+            ).fetchone()
+
+    # ── DocumentStore interface ──
+
+    def get(self, doc_id):
+        row = self._read_row(doc_id)
+        if row is None:
+            with self._lock:
+                self._live.pop(doc_id, None)
+            return None
+        fields = json.loads(row[0])
+        with self._lock:
+            doc = self._live.get(doc_id)
+            if doc is None:
+                doc = self._live[doc_id] = {}
+            doc.update(fields)
+        self._touch(doc_id)
+        return doc
+
+    def put(self, doc_id, doc):
+        page_images = doc.get('page_images') or []
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents (doc_id, ts, fields, page_count) '
+                'VALUES (?, ?, ?, ?)',
+                (doc_id, doc.get('_ts', time.time()),
+                 json.dumps(self._durable(doc)), len(page_images)),
+            )
+            self._conn.commit()
+            self._live[doc_id] = doc
+        self._touch(doc_id)
+
+    def update(self, doc_id, **fields):
+        with self._lock:
+            doc = self._live.get(doc_id)
+            if doc is not None:
+                doc.update(fields)
+            durable = {k: v for k, v in fields.items() if k in PERSISTENT_FIELDS}
+            if not durable:
+                return
+            row = self._conn.execute(
+                'SELECT fields FROM documents WHERE doc_id = ?', (doc_id,)
+            ).fetchone()
+            if row is None:
+                return
+            stored = json.loads(row[0])
+            stored.update(durable)
+            self._conn.execute(
+                'UPDATE documents SET fields = ? WHERE doc_id = ?',
+                (json.dumps(stored), doc_id),
+            )
+            self._conn.commit()
+
+    def delete(self, doc_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM documents WHERE doc_id = ?', (doc_id,))
+            self._conn.commit()
+            self._live.pop(doc_id, None)
+            self._atime.pop(doc_id, None)
+
+    def doc_ids(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute('SELECT doc_id FROM documents')]
+
+    def evict_older_than(self, ttl):
+        cutoff = time.time() - ttl
+        with self._lock:
+            stale = [r[0] for r in self._conn.execute(
+                'SELECT doc_id FROM documents WHERE ts < ?', (cutoff,))]
+        for doc_id in stale:
+            self.delete(doc_id)
+        self._count_evictions('ttl', len(stale))
+        return len(stale)
+
+    def _resident(self):
+        with self._lock:
+            return list(self._live.items())
+
+    def _drop_resident(self, doc_id):
+        # Durable fields stay in SQLite; the next get() reloads them
+        with self._lock:
+            self._live.pop(doc_id, None)
+            self._atime.pop(doc_id, None)
+
+
+def start_reaper(store, ttl, max_bytes, interval=30):
+    """Background thread: TTL sweep + byte-budget enforcement every `interval` s."""
+    def _reap():
+        while True:
+            time.sleep(interval)
+            try:
+                expired = store.evict_older_than(ttl)
+                released = store.enforce_budget(max_bytes)
+                if expired or released:
+                    print(f'[reaper] {expired} expired, {released // 1024} KB released '
+                          f'({store.resident_bytes()[0] // 1024} KB resident)')
+            except Exception as e:
+                print(f'[reaper] Error: {e}')
+
+    t = threading.Thread(target=_reap, daemon=True, name='document-reaper')
+    t.start()
+    return t
+
+
+def create_document_store(backend=None, path=None):
+    """Build the store selected by FLIPSIDE_DOC_STORE ('memory' or 'sqlite')."""
+    backend = (backend or os.environ.get('FLIPSIDE_DOC_STORE', 'memory')).lower()
+    if backend == 'sqlite':
+        path = path or os.environ.get(
+            'FLIPSIDE_DOC_STORE_PATH',
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'data', 'documents.db'),
+        )
+        return SQLiteDocumentStore(path)
+    if backend != 'memory':
+        raise ValueError(f'Unknown document store backend: {backend}')
+    return MemoryDocumentStore()
@@ -0,0 +1,276 @@
+"""Per-document analysis event logs — one producer, any number of subscribers.
+
+An analysis run appends each SSE chunk it produces to an EventLog. Every
+/analyze connection for that document (a reload, a second tab, an
+EventSource auto-reconnect) subscribes to the same log: it replays what
+already happened from index 0, then tails new entries until the log closes.
+The upstream calls run once no matter how many clients are watching.
+
+Entry indexes double as SSE event ids: a client that reconnects with
+Last-Event-ID resumes from the next index instead of re-running the models.
+Finished logs stay resumable for a while (RunRegistry's retention window,
+bounded by a byte budget).
+
+Thread subscribers block in read(); asyncio subscribers register a listener
+callback (see add_listener) that wakes their event loop on every append.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class EventLog:
+    """Append-only, thread-safe list of SSE chunks from one analysis run."""
+
+    def __init__(self):
+        self._entries = []
+        self._cond = threading.Condition()
+        self._listeners = set()
+        self.closed = False
+        self.subscribers = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    def append(self, entry):
+        with self._cond:
+            if self.closed:
+                return
+            self._entries.append(entry)
+            self.nbytes += len(entry)
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def close(self):
+        """Mark the run finished; subscribers drain what is left and stop."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def entries(self):
+        """Snapshot of every entry so far (the run's recording)."""
+        with self._cond:
+            return list(self._entries)
+
+    def read(self, start, timeout=None):
+        """Return (entries[start:], closed), waiting up to `timeout` seconds
+        for something new. An empty list with closed=False means timed out."""
+        with self._cond:
+            if len(self._entries) <= start and not self.closed and timeout != 0:
+                self._cond.wait_for(
+                    lambda: len(self._entries) > start or self.closed, timeout)
+            return self._entries[start:], self.closed
+
+    def add_listener(self, callback):
+        """Call `callback()` (from the appending thread) on every append/close."""
+        with self._cond:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners.discard(callback)
+
+    def attach(self):
+        """Register a subscriber; returns the new subscriber count."""
+        with self._cond:
+            self.subscribers += 1
+            return self.subscribers
+
+    def detach(self):
+        """Unregister a subscriber; returns how many are left."""
+        with self._cond:
+            self.subscribers = max(0, self.subscribers - 1)
+            return self.subscribers
+
+
+def _label(key):
+    """Short form of a run key for logs: 'a1b2c3d4/deepdive/scenario'."""
+    doc_id, _, rest = key.partition('/')
+    return doc_id[:8] + ('/' + rest if rest else '')
+
+
+class RunRegistry:
+    """Run key -> the EventLog of its live stream.
+
+    Keys are a doc_id for /analyze, or doc_id/route[/variant] for the
+    on-demand streams. join() attaches to the key's running stream, or
+    starts one via `start(log)`, which launches the producer and returns a
+    function that cancels it. When the last subscriber leaves, the run is
+    cancelled only if nobody re-joins within `grace` seconds — long enough
+    for a reload or an EventSource reconnect to pick the same run back up.
+
+    A cancelled run stays registered until its producer calls finish(), so
+    only one producer per key is ever live. A visitor who arrives while it
+    winds down gets a successor log, started once the cancelled run is done
+    (later visitors join the successor).
+
+    Completed logs are kept for `retain` seconds (oldest dropped first once
+    they exceed `max_retained_bytes`) so a client can resume after the end.
+
+    launch() starts a background job (an upload's extraction) the same way
+    but with nobody attached; it runs to the end whoever comes and goes.
+    """
+
+    def __init__(self, grace=10.0, retain=120.0, max_retained_bytes=64 * 1024 * 1024):
+        self.grace = grace
+        self.retain = retain
+        self.max_retained_bytes = max_retained_bytes
+        self._runs = {}  # key -> (log, cancel)
+        self._cancelled = set()  # keys whose live run was cancelled, not yet finished
+        self._next = {}  # key -> (log, start) to run once the cancelled run finishes
+        self._finished = OrderedDict()  # key -> (log, finished_at), oldest first
+        self._jobs = set()  # keys started by launch(): never cancelled
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+        self.resumed = 0
+        self.abandoned = 0
+
+    def join(self, key, start, resume=False):
+        """Attach to the key's stream, starting it if needed.
+
+        With resume=True a recently finished log is also acceptable.
+        Returns (log, started) — started is True for a brand-new run, whose
+        ids begin at 0 whatever the client last saw.
+        """
+        with self._lock:
+            successor = self._next.get(key)
+            if successor is not None:
+                successor[0].attach()
+                self.joined += 1
+                return successor[0], False
+            run = self._runs.get(key)
+            if run is not None and key not in self._cancelled:
+                run[0].attach()
+                self.joined += 1
+                return run[0], False
+            if resume and run is None:
+                self._prune()
+                done = self._finished.get(key)
+                if done is not None:
+                    done[0].attach()
+                    self.resumed += 1
+                    return done[0], False
+            log = EventLog()
+            log.attach()
+            self.started += 1
+            if run is not None:
+                # The cancelled run is still winding down: start after it
+                self._next[key] = (log, start)
+                return log, True
+            self._runs[key] = (log, None)
+        self._start(key, log, start)
+        return log, True
+
+    def _start(self, key, log, start):
+        cancel = start(log)
+        with self._lock:
+            if self._runs.get(key, (None,))[0] is log:
+                self._runs[key] = (log, cancel)
+
+    def launch(self, key, start):
+        """Start a job's log with no subscribers; `start(log)` launches its
+        producer, which calls finish() when done. Returns the log."""
+        log = EventLog()
+        with self._lock:
+            self._runs[key] = (log, None)
+            self._jobs.add(key)
+            self.started += 1
+        start(log)
+        return log
+
+    def leave(self, key, log):
+        """Detach a subscriber; schedule cancellation if it was the last one."""
+        if log.detach() or log.closed:
+            return
+        timer = threading.Timer(self.grace, self._cancel_if_abandoned, (key, log))
+        timer.daemon = True
+        timer.start()
+
+    def _cancel_if_abandoned(self, key, log):
+        with self._lock:
+            successor = self._next.get(key)
+            if successor is not None and successor[0] is log:
+                # Left before it could start: it never will
+                if log.subscribers:
+                    return
+                del self._next[key]
+                self.abandoned += 1
+                run = None
+            else:
+                run = self._runs.get(key)
+                if (run is None or run[0] is not log or log.subscribers or log.closed
+                        or key in self._jobs or key in self._cancelled):
+                    return
+                # Stays registered until finish(): a late visitor waits for it
+                self._cancelled.add(key)
+                self.abandoned += 1
+        print(f'[runs] {_label(key)}: no subscribers for {self.grace:g}s, cancelling')
+        if run is None:
+            log.close()
+        elif run[1]:
+            run[1]()
+
+    def finish(self, key, log):
+        """Producer is done: unregister the run, keep it resumable, close its log.
+        An abandoned (cancelled) run is incomplete and is not retained."""
+        successor = None
+        with self._lock:
+            if self._runs.get(key, (None,))[0] is log:
+                del self._runs[key]
+                self._jobs.discard(key)
+                if key in self._cancelled:
+                    self._cancelled.discard(key)
+                    successor = self._next.pop(key, None)
+                    if successor is not None:
+                        self._runs[key] = (successor[0], None)
+                elif self.retain > 0:
+                    self._finished.pop(key, None)
+                    self._finished[key] = (log, time.time())
+                    self._prune()
+        log.close()
+        if successor is not None:
+            self._start(key, *successor)
+
+    def live_keys(self):
+        """Keys with a run registered (or waiting to start after one)."""
+        with self._lock:
+            return set(self._runs) | set(self._next)
+
+    def _prune(self):
+        """Drop expired finished logs, then the oldest until under budget."""
+        cutoff = time.time() - self.retain
+        while self._finished:
+            key, (log, finished_at) = next(iter(self._finished.items()))
+            if finished_at >= cutoff and self._retained_bytes() <= self.max_retained_bytes:
+                break
+            del self._finished[key]
+
+    def _retained_bytes(self):
+        return sum(log.nbytes for log, _ in self._finished.values())
+
+    def stats(self):
+        with self._lock:
+            self._prune()
+            live = {_label(key): {'events': len(log), 'subscribers': log.subscribers,
+                                  'cancelled': key in self._cancelled}
+                    for key, (log, _) in self._runs.items()}
+            return {
+                'live': live,
+                'retained': len(self._finished),
+                'retained_bytes': self._retained_bytes(),
+                'started': self.started,
+                'joined': self.joined,
+                'resumed': self.resumed,
+                'abandoned': self.abandoned,
+                'grace_seconds': self.grace,
+                'retain_seconds': self.retain,
+            }
@@ -0,0 +1,146 @@
+"""Extraction results cached by the hash of the uploaded file.
+
+A re-upload of the same file (after a reload, or once the document's TTL
+expired) skips page rendering, OCR and the Haiku cleanup. The key is a
+SHA-256 over the file's bytes and an extraction version string (file type,
+render settings, cleanup model), so a settings change never serves stale
+text.
+
+Each entry is a directory holding meta.json: text, ocr_used, thumbnail and
+the page image references (digests in the app's page blob store, which owns
+the JPEGs). Entries are written to a temp directory and renamed into place,
+so every worker process on the host shares the cache. Least recently used
+entries are dropped once the directory exceeds `max_bytes`.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+def file_digest(stream, chunk_size=1 << 20):
+    """SHA-256 hex digest of a seekable binary stream, read in chunks and
+    rewound, so hashing never holds a second copy of the upload."""
+    h = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+
+def extraction_key(digest, version):
+    """Cache key for one file under one extraction configuration."""
+    return hashlib.sha256(f'{digest}\0{version}'.encode('utf-8')).hexdigest()
+
+
+def _dir_bytes(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+class ExtractionCache:
+    """Directory of `<key>/` entries, bounded to `max_bytes` on disk."""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return {'text', 'page_images', 'ocr_used', 'thumbnail'} or None.
+        page_images are the references put() was given, None placeholders
+        kept."""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            meta['page_images']
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(os.path.join(path, 'meta.json'))  # Recency for eviction
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return meta
+
+    def put(self, key, text, page_images, ocr_used=False, thumbnail=None):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({
+                    'text': text,
+                    'ocr_used': ocr_used,
+                    'thumbnail': thumbnail,
+                    'page_images': list(page_images),
+                    'created': time.time(),
+                }, f)
+            os.rename(tmp, path)
+        except OSError:
+            # Another worker stored the same file first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._evict()
+
+    def _entries(self):
+        """[(path, last_used, bytes)] for every complete entry."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                continue
+            try:
+                entries.append((path, os.path.getmtime(os.path.join(path, 'meta.json')),
+                                _dir_bytes(path)))
+            except OSError:
+                pass
+        return entries
+
+    def _evict(self):
+        """Remove least-recently-used entries until under max_bytes."""
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, _, size in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,96 @@
+"""Detect reversed lines in extracted PDF text.
+
+Some PDFs (right-to-left runs, odd layouts) come out of the text layer with
+lines reversed character by character. A line is flagged when it contains
+more common function words read backwards than forwards.
+
+The scan is one pass over the text. Non-ASCII characters are dropped, then
+one bytes.translate() lowercases the text and deletes every character that
+is neither a letter nor whitespace. That leaves exactly the letters-only
+form of each word. A reversed line's words are the originals reversed, so a
+second frozen lexicon of reversed function words scores the backwards
+reading without reversing anything.
+"""
+
+import re
+
+# Function words in the languages we see most
+COMMON_WORDS = frozenset({
+    'de', 'het', 'van', 'en', 'een', 'voor', 'in', 'te', 'op', 'aan',
+    'met', 'bij', 'uit', 'naar', 'dat', 'die', 'niet', 'ook', 'maar',
+    'per', 'door', 'tot', 'je', 'zijn', 'kan', 'was',
+    'the', 'and', 'for', 'of', 'to', 'is', 'with', 'on', 'at', 'by',
+    'not', 'but', 'or', 'this', 'that', 'you', 'your', 'all', 'can',
+    'le', 'la', 'les', 'des', 'du', 'un', 'une', 'et', 'est', 'dans',
+    'pour', 'par', 'sur', 'avec', 'que', 'qui', 'ce',
+    'der', 'die', 'das', 'und', 'ist', 'ein', 'von', 'auf', 'mit',
+})
+MIN_WORDS = 4  # shorter lines are never flagged
+
+_FORWARD = frozenset(w.encode('ascii') for w in COMMON_WORDS)
+_BACKWARD = frozenset(w[::-1] for w in _FORWARD)
+
+# str.split() whitespace outside ASCII; it must keep separating words once
+# the non-ASCII characters are dropped
+_UNICODE_SPACE = re.compile('[\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]')
+_NON_LETTER = re.compile(r'[^a-zA-Z]')
+
+_ASCII_SPACE = b' \t\n\r\x0b\x0c'
+_SEPARATORS = bytes(range(0x1c, 0x20))  # whitespace to str.split(), not bytes.split()
+_TABLE = bytes(c + 32 if 65 <= c <= 90 else 32 if c in _SEPARATORS else c for c in range(256))
+_DELETE = bytes(c for c in range(256)
+                if not (65 <= c <= 90 or 97 <= c <= 122 or c in _ASCII_SPACE or c in _SEPARATORS))
+
+
+def _letter_lines(text):
+    """Lines of `text` as bytes, each word reduced to its lowercase letters."""
+    if not text.isascii():
+        text = _UNICODE_SPACE.sub(' ', text)
+    return text.encode('ascii', 'ignore').translate(_TABLE, _DELETE).split(b'\n')
+
+
+def line_scores(text):
+    """Per line of `text.split('\\n')`: (forward hits, backward hits) of
+    function words."""
+    forward, backward = _FORWARD.__contains__, _BACKWARD.__contains__
+    scores = []
+    for line in _letter_lines(text):
+        words = line.split()
+        scores.append((sum(map(forward, words)), sum(map(backward, words))))
+    return scores
+
+
+def garbled_lines(text):
+    """Indexes of the lines (of `text.split('\\n')`) that read better reversed."""
+    forward, backward = _FORWARD.__contains__, _BACKWARD.__contains__
+    candidates = []
+    for i, line in enumerate(_letter_lines(text)):
+        words = line.split()
+        back = sum(map(backward, words))
+        # Only a line with two backward hits can win; most have none
+        if back >= 2 and back > sum(map(forward, words)) + 1:
+            candidates.append(i)
+    if not candidates:
+        return []
+    # Words made only of digits or punctuation still count towards MIN_WORDS
+    lines = text.split('\n')
+    return [i for i in candidates if len(lines[i].split()) >= MIN_WORDS]
+
+
+def has_garbled_text(text):
+    """Fast local check: does this text likely contain reversed segments?"""
+    return bool(text) and bool(garbled_lines(text))
+
+
+def common_word_hits(words):
+    """Function words among `words` (str tokens)."""
+    return sum(1 for w in words if _NON_LETTER.sub('', w).lower() in COMMON_WORDS)
+
+
+def unreverse(line):
+    """The line read backwards, when it is plainly reversed as a whole (no
+    function words forwards); None when only part of it is."""
+    if common_word_hits(line.split()):
+        return None
+    indent = line[:len(line) - len(line.lstrip())]
+    return indent + line.strip()[::-1]
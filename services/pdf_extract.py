@@ -0,0 +1,386 @@
+"""Per-page PDF extraction spread across a process pool.
+
+Each page needs its embedded text and possibly OCR and a JPEG rendering
+(first `max_vision_pages` pages only, for Opus vision). That is CPU-bound work — a
+40-page scan took tens of seconds on the request thread — so pages are
+processed in worker processes, in contiguous chunks so each worker opens the
+PDF once per chunk, and reassembled in page order.
+
+OCR is decided per page: a page whose embedded text scores below
+`ocr_below` on text_quality() is rendered and OCR'd, and the better of the
+two texts wins — so a typed cover page over scanned pages gets the right
+mode on every page. The bitmap rendered for OCR is reused for the page's
+vision image. With the optional tesserocr package installed, each worker
+keeps one tesseract engine loaded; otherwise pytesseract starts a tesseract
+process per page. Each OCR'd page reports which engine ran (`ocr_engine`).
+
+Rendering is lazy. A page within the first `max_vision_pages` only gets an
+image when Opus needs to see it: its text layer is poor, or its layout looks
+visual (ruled tables, figures, columns; see visual_layout()). Clean text
+pages are never drawn. Callers keep the PDF and call render_pages() later
+when a route asks for vision anyway. `eager` restores drawing every vision
+page.
+
+Page text (and any OCR) comes first; pages that still need an image are
+rendered in a second pass, so callers can start on the text (see `on_text`)
+while the images are drawing.
+
+Workers only get a file path and page indexes, never pdfplumber objects.
+On Linux they are forked, so they don't re-import the server's main module
+the way spawned workers would; they never print (a lock held by another
+server thread at fork time would hang them) and hand their log lines back
+with the results instead. Small PDFs (or a pool of one) run inline.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+
+class PageSettings:
+    """Rendering limits, picklable so workers don't import app.py."""
+
+    def __init__(self, dpi=150, max_vision_pages=10, max_dimension=4000,
+                 max_image_bytes=4 * 1024 * 1024, ocr_below=0.6, ocr_margin=0.05,
+                 eager=False, table_rulings=6, figure_area=0.25):
+        self.dpi = dpi
+        self.max_vision_pages = max_vision_pages
+        self.max_dimension = max_dimension
+        self.max_image_bytes = max_image_bytes
+        self.ocr_below = ocr_below  # OCR pages whose embedded text scores lower
+        self.ocr_margin = ocr_margin  # OCR text must score this much better to win
+        self.eager = eager  # render every vision page, not only the visual ones
+        self.table_rulings = table_rulings  # ruled lines/boxes that make a table
+        self.figure_area = figure_area  # fraction of the page covered by images
+
+
+def text_quality(t):
+    """Score text: fraction of tokens that look like real words."""
+    words = t.split()
+    if not words:
+        return 0
+    good = sum(1 for w in words if 2 <= len(w) <= 20 and sum(c.isalpha() for c in w) / max(len(w), 1) > 0.7)
+    return good / len(words)
+
+
+def _has_columns(chars, width, min_lines=6):
+    """True when most text lines are split by a wide gap near the middle of
+    the page (two columns, or a table without rulings)."""
+    lines = {}
+    for c in chars:
+        if c['text'].strip():
+            lines.setdefault(round(c['top']), []).append((c['x0'], c['x1']))
+    if len(lines) < min_lines:
+        return False
+    gutter = width * 0.04
+    split = 0
+    for spans in lines.values():
+        spans.sort()
+        right = spans[0][1]
+        for x0, x1 in spans[1:]:
+            if x0 - right > gutter and 0.3 * width < (x0 + right) / 2 < 0.7 * width:
+                split += 1
+                break
+            right = max(right, x1)
+    return split * 2 >= len(lines)
+
+
+def visual_layout(page, settings):
+    """Why a page's layout needs to be seen rather than read: 'tables',
+    'figures' or 'columns', or None for plain running text."""
+    if len(page.rects) + len(page.lines) >= settings.table_rulings:
+        return 'tables'
+    area = page.width * page.height
+    covered = sum(abs((img['x1'] - img['x0']) * (img['bottom'] - img['top']))
+                  for img in page.images)
+    if area and covered > settings.figure_area * area:
+        return 'figures'
+    if _has_columns(page.chars, page.width):
+        return 'columns'
+    return None
+
+
+def _encode_jpeg(pil_img, settings):
+    """JPEG bytes under the API's size limits."""
+    from PIL import Image
+    # Constrain dimensions to stay under API limit
+    if max(pil_img.size) > settings.max_dimension:
+        pil_img.thumbnail((settings.max_dimension, settings.max_dimension), Image.LANCZOS)
+    rgb = pil_img.convert('RGB')
+    buf = BytesIO()
+    rgb.save(buf, format='JPEG', quality=80)
+    # If still too large, reduce quality
+    if buf.tell() > settings.max_image_bytes:
+        buf = BytesIO()
+        rgb.save(buf, format='JPEG', quality=50)
+    return buf.getvalue()
+
+
+# pdfium (behind page.to_image) is not thread-safe: inline extractions on
+# concurrent request threads take turns. Forked workers get a fresh lock in
+# case another thread held it at fork time, and their own OCR engines.
+_render_lock = threading.Lock()
+_ocr_local = threading.local()
+
+
+def _after_fork():
+    global _render_lock, _ocr_local
+    _render_lock = threading.Lock()
+    _ocr_local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _bitmap(page, settings):
+    with _render_lock:
+        return page.to_image(resolution=settings.dpi).original
+
+
+def _render(page, settings):
+    """(PIL image, JPEG bytes) of one page."""
+    pil_img = _bitmap(page, settings)
+    return pil_img, _encode_jpeg(pil_img, settings)
+
+
+def _ocr_engine():
+    """This thread's (engine name, OCR function), or (None, None) without an
+    OCR library.
+
+    A tesserocr API (optional, the fast path) keeps tesseract and its
+    language data loaded between pages; pytesseract starts a tesseract
+    process for each one.
+    """
+    engine = getattr(_ocr_local, 'engine', None)
+    if engine is None:
+        try:
+            import tesserocr
+            api = tesserocr.PyTessBaseAPI()
+
+            def ocr(pil_img):
+                api.SetImage(pil_img)
+                return api.GetUTF8Text()
+            engine = ('tesserocr', ocr)
+        except Exception:
+            try:
+                import pytesseract
+                engine = ('pytesseract', pytesseract.image_to_string)
+            except ImportError:
+                engine = (None, None)
+        _ocr_local.engine = engine
+    return engine
+
+
+def _process_page(page, index, settings, render=True):
+    """Text, OCR (when the embedded text is poor) and image for one page.
+
+    `vision` says why the page needs an image ('poor text' or a
+    visual_layout() reason) and `rendered` whether it gets one: it needs one
+    (or settings.eager) and is within max_vision_pages. With render=False
+    such a page's image is left to render_pages() unless OCR drew it.
+    Returns a picklable dict.
+    """
+    result = {'index': index, 'text': '', 'rendered': False, 'vision': None,
+              'image': None, 'ocr': False, 'ocr_engine': None, 'log': []}
+    log = result['log']
+    timings = {}
+    t0 = time.time()
+    page_text = page.extract_text() or ''
+    timings['text'] = time.time() - t0
+    orig_score = text_quality(page_text)
+    if index < settings.max_vision_pages:
+        result['vision'] = 'poor text' if orig_score < settings.ocr_below else visual_layout(page, settings)
+        result['rendered'] = settings.eager or result['vision'] is not None
+
+    pil_img = None
+    if orig_score < settings.ocr_below:
+        engine, ocr = _ocr_engine()
+        if ocr is None:
+            log.append(f'[extract_pdf] Page {index + 1}: poor text layer ({orig_score:.2f}) '
+                       f'and no OCR engine installed')
+        else:
+            result['ocr_engine'] = engine
+            t = time.time()
+            try:
+                pil_img = _bitmap(page, settings)
+                timings['render'] = time.time() - t
+                t = time.time()
+                ocr_text = ocr(pil_img) or ''
+                ocr_score = text_quality(ocr_text)
+                result['ocr'] = ocr_score > orig_score + settings.ocr_margin
+                log.append(f'[extract_pdf] Page {index + 1} quality: embedded={orig_score:.2f}, '
+                           f'OCR={ocr_score:.2f} → {"OCR" if result["ocr"] else "embedded"}')
+                if result['ocr']:
+                    page_text = ocr_text
+            except Exception as e:
+                log.append(f'[extract_pdf] OCR failed for page {index + 1}: {e}')
+            timings['ocr'] = time.time() - t
+
+    if result['rendered'] and (render or pil_img):
+        t = time.time()
+        try:
+            # Reuse the OCR bitmap rather than drawing the page twice
+            if pil_img is None:
+                pil_img = _bitmap(page, settings)
+            result['image'] = _encode_jpeg(pil_img, settings)
+        except Exception as e:
+            log.append(f'[extract_pdf] Page image rendering failed: {e}')
+        timings['render'] = timings.get('render', 0) + time.time() - t
+
+    result['text'] = page_text
+    timings['total'] = time.time() - t0
+    result['timings'] = {k: round(v, 3) for k, v in timings.items()}
+    return result
+
+
+def _open(source):
+    import pdfplumber
+    return pdfplumber.open(BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def page_count(source):
+    with _open(source) as pdf:
+        return len(pdf.pages)
+
+
+def process_pages(source, indexes, settings, render=True):
+    """Worker entry point: open the PDF at `source` (a path or bytes) once
+    and process the given pages in order."""
+    with _open(source) as pdf:
+        return [_process_page(pdf.pages[i], i, settings, render) for i in indexes]
+
+
+def render_pages(source, indexes, settings):
+    """Worker entry point for the image pass after a text-only pass, and
+    for rendering on demand. Pages past the end of the PDF are skipped."""
+    out = []
+    with _open(source) as pdf:
+        for i in indexes:
+            if i >= len(pdf.pages):
+                continue
+            result = {'index': i, 'image': None, 'log': []}
+            t = time.time()
+            try:
+                _, result['image'] = _render(pdf.pages[i], settings)
+            except Exception as e:
+                result['log'].append(f'[extract_pdf] Page image rendering failed: {e}')
+            result['seconds'] = time.time() - t
+            out.append(result)
+    return out
+
+
+def _chunks(indexes, parts):
+    """Split indexes into about `parts` contiguous runs."""
+    size = max(1, -(-len(indexes) // parts))
+    return [indexes[i:i + size] for i in range(0, len(indexes), size)]
+
+
+class _Inline:
+    """Executor stand-in that runs each call as it is submitted."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class PdfPagePool:
+    """Process pool for page work, created on first use."""
+
+    def __init__(self, workers=None, inline_below=3):
+        self.workers = workers or os.cpu_count() or 1
+        self.inline_below = inline_below  # fewer pages than this: no pool
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def extract(self, source, settings, on_page=None, on_text=None):
+        """Process every page of the PDF at `source` (a path or bytes);
+        returns the page results in page order.
+
+        on_page(page, done, total) is called as each page's text comes in,
+        on_text(pages) once every page has its text — pages may still lack
+        their image then, so it should hand off and return quickly. Both run
+        on the calling thread.
+        """
+        n = page_count(source)
+        if self.workers <= 1 or n < self.inline_below:
+            return self._extract(_Inline(), source, n, 1, settings, on_page, on_text)
+        if isinstance(source, str):
+            return self._extract(self._executor(), source, n, self.workers * 2,
+                                 settings, on_page, on_text)
+        # Workers open the PDF by path instead of each getting a copy of it
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+            tmp.write(source)
+            tmp.flush()
+            return self._extract(self._executor(), tmp.name, n, self.workers * 2,
+                                 settings, on_page, on_text)
+
+    def render(self, path, indexes, settings):
+        """Images of the given pages of the PDF at `path`, as {index: image},
+        for a page that wasn't rendered at extraction time."""
+        if self.workers <= 1 or len(indexes) < self.inline_below:
+            pool, parts = _Inline(), 1
+        else:
+            pool, parts = self._executor(), self.workers
+        images = {}
+        futures = [pool.submit(render_pages, path, chunk, settings)
+                   for chunk in _chunks(list(indexes), parts)]
+        for future in futures:
+            for rendered in future.result():
+                for line in rendered['log']:
+                    print(line)
+                images[rendered['index']] = rendered['image']
+        return images
+
+    def _extract(self, pool, source, n, parts, settings, on_page, on_text):
+        results = {}
+
+        def collect(pages):
+            for page in pages:
+                for line in page.pop('log'):
+                    print(line)
+                results[page['index']] = page
+                if on_page:
+                    on_page(page, len(results), n)
+
+        futures = [pool.submit(process_pages, source, chunk, settings, False)
+                   for chunk in _chunks(list(range(n)), parts)]
+        for future in as_completed(futures):
+            collect(future.result())
+        pages = [results[index] for index in range(n)]
+        if on_text:
+            on_text(pages)
+        unrendered = [page['index'] for page in pages if page['rendered'] and not page['image']]
+        futures = [pool.submit(render_pages, source, chunk, settings)
+                   for chunk in _chunks(unrendered, parts)] if unrendered else []
+        for future in futures:
+            for rendered in future.result():
+                for line in rendered['log']:
+                    print(line)
+                page = pages[rendered['index']]
+                page['image'] = rendered['image']
+                page['timings']['render'] = round(rendered['seconds'], 3)
+                page['timings']['total'] = round(page['timings']['total'] + rendered['seconds'], 3)
+        return pages
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
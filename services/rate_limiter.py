@@ -0,0 +1,270 @@
+"""Process-wide adaptive rate limiting and circuit breaking per model.
+
+One AdaptiveLimiter per model replaces the per-thread `(attempt + 1) * 5`
+sleeps. Every caller shares it:
+- a token bucket paces new requests; its refill rate follows AIMD
+  (additive increase on success, multiplicative decrease on overload)
+- a server `retry-after` pauses the whole model, not just the caller
+- retries use exponential backoff with jitter so threads don't retry in lockstep
+- when the recent error rate spikes the circuit opens and calls fail fast
+  until a cooldown passes and a single probe request succeeds
+"""
+
+import time
+import random
+import threading
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """Raised by AdaptiveLimiter.acquire() while the model's circuit is open."""
+
+
+def classify_error(exc):
+    """Return 'overload' (429/529), 'server' (5xx / connection) or 'client'."""
+    if isinstance(exc, CircuitOpenError):
+        return 'client'
+    status = getattr(exc, 'status_code', None)
+    if status in (429, 529) or 'overload' in str(exc).lower():
+        return 'overload'
+    if (status is not None and status >= 500) or type(exc).__name__ in (
+            'APIConnectionError', 'APITimeoutError'):
+        return 'server'
+    return 'client'
+
+
+def retry_after_seconds(exc):
+    """Read the `retry-after` / `retry-after-ms` header from an API error."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get('retry-after-ms')
+        if ms is not None:
+            return float(ms) / 1000
+        secs = headers.get('retry-after')
+        if secs is not None:
+            return float(secs)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class AdaptiveLimiter:
+    """Token bucket + AIMD rate + circuit breaker for one model."""
+
+    def __init__(self, model, rate=5.0, min_rate=0.2, max_rate=50.0,
+                 increase=0.25, decrease=0.5, burst=10,
+                 window=60.0, error_threshold=0.5, min_requests=8, cooldown=30.0,
+                 backoff_base=4.0, backoff_cap=60.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.model = model
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.window = window
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last_refill = clock()
+        self._paused_until = 0.0
+        self._outcomes = deque()  # (time, ok)
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_holder = None
+        self.successes = 0
+        self.overloads = 0
+        self.server_errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+
+    # ── Admission ──
+
+    def reserve(self, holder=None):
+        """Non-blocking admission: 0.0 if the request may go now, otherwise
+        the seconds to wait before asking again. Raises CircuitOpenError.
+        `holder` identifies the caller for release_probe()."""
+        with self._lock:
+            now = self._clock()
+            if self.state == 'open':
+                if now - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        f'{self.model}: circuit open after repeated overloads')
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'{self.model}: circuit half-open, probe in flight')
+                self._probe_in_flight = True
+                self._probe_holder = holder
+                return 0.0
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, holder=None):
+        """Block until a request may be sent. Raises CircuitOpenError."""
+        while True:
+            wait = self.reserve(holder)
+            if not wait:
+                return
+            self._sleep(min(wait, 1.0))
+
+    def release_probe(self, holder):
+        """The call `holder` was admitted for ended with no outcome (it was
+        cancelled): if it was the half-open probe, let another one through."""
+        with self._lock:
+            self._release_probe(holder)
+
+    def _release_probe(self, holder):
+        if (self.state == 'half_open' and self._probe_in_flight
+                and holder is not None and self._probe_holder is holder):
+            self._probe_in_flight = False
+            self._probe_holder = None
+
+    # ── Outcomes ──
+
+    def _record(self, now, ok):
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _error_rate(self):
+        if len(self._outcomes) < self.min_requests:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _open(self, now):
+        self.state = 'open'
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._probe_holder = None
+        self.circuit_opens += 1
+        print(f'[ratelimit] {self.model}: circuit OPEN for {self.cooldown:.0f}s')
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._record(self._clock(), True)
+            if self.state == 'half_open':
+                self.state = 'closed'
+                self._probe_in_flight = False
+                self._probe_holder = None
+                self._outcomes.clear()
+                print(f'[ratelimit] {self.model}: circuit closed')
+
+    def backoff(self, attempt):
+        """Exponential backoff with equal jitter: [d/2, d] for d = base·2^attempt."""
+        d = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+        return d / 2 + random.uniform(0, d / 2)
+
+    def record_error(self, exc, attempt=0, holder=None):
+        """Account for a failed call. Returns (retryable, seconds_to_wait).
+        `holder` is the one passed to acquire(): a client error only frees
+        the half-open probe if this call was it."""
+        if isinstance(exc, CircuitOpenError):
+            # Turned away, never sent: the probe in flight is somebody else's
+            return False, 0.0
+        kind = classify_error(exc)
+        with self._lock:
+            now = self._clock()
+            if kind == 'client':
+                self._release_probe(holder)
+                return False, 0.0
+            if kind == 'overload':
+                self.overloads += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            else:
+                self.server_errors += 1
+            self._record(now, False)
+            wait = self.backoff(attempt)
+            retry_after = retry_after_seconds(exc)
+            if retry_after:
+                wait = max(wait, retry_after)
+                # The server asked everyone to hold off — pause the whole model
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if self.state == 'half_open' or self._error_rate() >= self.error_threshold:
+                self._open(now)
+            return True, wait
+
+    def record_retry(self):
+        """Count a failed call the caller is about to send again."""
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'rate_per_sec': round(self.rate, 2),
+                'tokens': round(self._tokens, 2),
+                'paused_for': round(max(0.0, self._paused_until - self._clock()), 1),
+                'error_rate': round(self._error_rate(), 2),
+                'successes': self.successes,
+                'overloads': self.overloads,
+                'server_errors': self.server_errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'circuit_opens': self.circuit_opens,
+            }
+
+
+class RateLimiterRegistry:
+    """Lazily creates one AdaptiveLimiter per model with shared defaults."""
+
+    def __init__(self, **defaults):
+        self._defaults = defaults
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limiter = self._limiters[model] = AdaptiveLimiter(model, **self._defaults)
+            return limiter
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {model: limiter.stats() for model, limiter in limiters.items()}
+
+
+def call_with_backoff(limiter, fn, max_retries=3):
+    """Call fn() under `limiter`, retrying overloads/5xx with backoff."""
+    for attempt in range(max_retries):
+        admission = object()
+        limiter.acquire(admission)
+        try:
+            result = fn()
+        except Exception as e:
+            retry, wait = limiter.record_error(e, attempt, admission)
+            if retry and attempt < max_retries - 1:
+                limiter.record_retry()
+                print(f'[ratelimit] {limiter.model}: {classify_error(e)}, '
+                      f'retry {attempt + 1} in {wait:.1f}s')
+                time.sleep(wait)
+                continue
+            raise
+        limiter.record_success()
+        return result
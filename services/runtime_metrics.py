@@ -0,0 +1,194 @@
+"""Live load metrics in the Prometheus text exposition format.
+
+Request paths record counters (sample-cache hits, retries), histograms
+(time to first card, time to verdict, extraction time) and open-connection
+gauges directly. Point-in-time values that other services already track —
+documents and their bytes, streams in flight per model, limiter counts — are
+read by collector callbacks at scrape time, so the hot paths pay nothing for
+them. Queues are watched through weak references and measured on scrape.
+
+No client library is needed: render() writes the text format by hand.
+"""
+
+import re
+import math
+import threading
+import weakref
+from contextlib import contextmanager
+
+# Seconds — wide enough for a 1s card and a 5-minute Opus verdict
+DEFAULT_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    """Cumulative bucket counts, sum and count for one label set."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class RuntimeMetrics:
+    """Registry of counters, gauges and histograms, rendered for scraping.
+
+    Every metric is declared once with describe(). Collectors registered via
+    add_collector() are called on each render() and return
+    [(name, labels_dict, value)] for gauges or counters described beforehand.
+    """
+
+    def __init__(self, prefix='flipside'):
+        self.prefix = prefix
+        self._meta = {}  # name -> (kind, help, buckets)
+        self._values = {}  # name -> {label_key: float | _Histogram}
+        self._collectors = []
+        self._queues = {}  # kind -> WeakSet of live queues
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """Declare a metric: kind is 'counter', 'gauge' or 'histogram'."""
+        if not re.match(r'^[a-z_][a-z0-9_]*$', name):
+            raise ValueError(f'invalid metric name: {name}')
+        with self._lock:
+            self._meta[name] = (kind, help_text,
+                                tuple(buckets or DEFAULT_BUCKETS) if kind == 'histogram' else None)
+            self._values.setdefault(name, {})
+
+    def _series(self, name, kind):
+        meta = self._meta.get(name)
+        if meta is None or meta[0] != kind:
+            raise KeyError(f'{name} is not a declared {kind}')
+        return self._values[name]
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter (or move a gauge)."""
+        with self._lock:
+            kind = self._meta.get(name, ('counter',))[0]
+            series = self._series(name, 'gauge' if kind == 'gauge' else 'counter')
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation."""
+        with self._lock:
+            series = self._series(name, 'histogram')
+            key = _label_key(labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self._meta[name][2])
+            hist.observe(value)
+
+    @contextmanager
+    def track(self, name, **labels):
+        """Hold a gauge up by one while the block runs (open connections)."""
+        self.inc(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(name, -1, **labels)
+
+    def watch_queue(self, kind, q):
+        """Measure `q.qsize()` on every scrape for as long as `q` is alive."""
+        with self._lock:
+            self._queues.setdefault(kind, weakref.WeakSet()).add(q)
+        return q
+
+    def queue_depths(self):
+        """{kind: (live queues, total depth, deepest)} over watched queues."""
+        with self._lock:
+            watched = {kind: list(queues) for kind, queues in self._queues.items()}
+        out = {}
+        for kind, queues in watched.items():
+            depths = [q.qsize() for q in queues]
+            out[kind] = (len(depths), sum(depths), max(depths, default=0))
+        return out
+
+    def add_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def snapshot(self):
+        """{name: {label_key: value}} for counters and gauges, collectors
+        included — histograms as (count, sum). Mostly for tests."""
+        series = self._collect()
+        return {name: {key: (v.count, v.total) if isinstance(v, _Histogram) else v
+                       for key, v in values.items()}
+                for name, values in series.items()}
+
+    def _collect(self):
+        with self._lock:
+            series = {}
+            for name, values in self._values.items():
+                series[name] = {key: (v if not isinstance(v, _Histogram) else _copy(v))
+                                for key, v in values.items()}
+            collectors = list(self._collectors)
+        for fn in collectors:
+            try:
+                samples = fn()
+            except Exception as e:
+                print(f'[metrics] collector {getattr(fn, "__name__", fn)} failed: {e}')
+                continue
+            for name, labels, value in samples:
+                if name in series:
+                    series[name][_label_key(labels)] = value
+        return series
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        series = self._collect()
+        lines = []
+        for name, values in series.items():
+            kind, help_text, _buckets = self._meta[name]
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {help_text}')
+            lines.append(f'# TYPE {full} {kind}')
+            for key, value in sorted(values.items()):
+                if isinstance(value, _Histogram):
+                    for bound, count in zip(value.buckets, value.counts):
+                        labels = _format_labels(key + (('le', _format_value(float(bound))),))
+                        lines.append(f'{full}_bucket{labels} {count}')
+                    labels = _format_labels(key + (('le', '+Inf'),))
+                    lines.append(f'{full}_bucket{labels} {value.count}')
+                    lines.append(f'{full}_sum{_format_labels(key)} {_format_value(round(value.total, 6))}')
+                    lines.append(f'{full}_count{_format_labels(key)} {value.count}')
+                else:
+                    lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _copy(hist):
+    copy = _Histogram(hist.buckets)
+    copy.counts = list(hist.counts)
+    copy.total = hist.total
+    copy.count = hist.count
+    return copy
@@ -0,0 +1,182 @@
+"""Shared scheduler for upstream LLM calls.
+
+Every Anthropic call goes through one process-wide LLMScheduler:
+- background calls (card workers, Opus threads, doc context) are submitted
+  to a bounded thread pool instead of spawning a thread each
+- calls made inline on a request thread (/deepdive, /ask, /timeline,
+  /counter-draft) hold a model slot for the duration of the stream
+- the asyncio engine claims a slot (a Future it awaits) and releases it
+  when its stream ends
+
+All paths share one semaphore per model, so the number of concurrent
+upstream streams per model is capped no matter how many users are active
+or which engine serves them.
+Submitted work waits for its model slot in a per-model queue and only then
+goes to the pool: a burst for one model never fills the pool with threads
+blocked on that model's semaphore while other models' work waits.
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class _ModelGate:
+    """Per-model concurrency limit plus wait-time accounting."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.sem = threading.BoundedSemaphore(limit)
+        self.pending = deque()  # (future, fn, args, kwargs, enqueued_at) awaiting a slot; fn None for a claim
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class LLMScheduler:
+    """Bounded pool + per-model semaphores for all upstream LLM work."""
+
+    def __init__(self, max_workers=64, limits=None, default_limit=16):
+        self.max_workers = max_workers
+        self.default_limit = default_limit
+        self._limits = dict(limits or {})
+        self._gates = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='llm')
+        self._pool_active = 0
+        self._pool_queued = 0
+        self.submitted = 0
+
+    def _gate(self, model):
+        with self._lock:
+            gate = self._gates.get(model)
+            if gate is None:
+                gate = self._gates[model] = _ModelGate(
+                    self._limits.get(model, self.default_limit))
+            return gate
+
+    def limit(self, model):
+        """Concurrency cap configured for `model`."""
+        return self._limits.get(model, self.default_limit)
+
+    @contextmanager
+    def slot(self, model, enqueued_at=None):
+        """Hold one concurrency slot for `model` while the block runs."""
+        gate = self._gate(model)
+        t0 = enqueued_at if enqueued_at is not None else time.time()
+        with self._lock:
+            gate.waiting += 1
+        gate.sem.acquire()
+        with self._lock:
+            waited = self._admitted(gate, t0)
+        try:
+            yield waited
+        finally:
+            self._release(gate)
+
+    def _admitted(self, gate, enqueued_at):
+        """Account for a slot just taken (under self._lock); returns the wait."""
+        waited = time.time() - enqueued_at
+        gate.waiting -= 1
+        gate.in_flight += 1
+        gate.acquired += 1
+        gate.wait_total += waited
+        gate.wait_max = max(gate.wait_max, waited)
+        return waited
+
+    def _release(self, gate):
+        with self._lock:
+            gate.in_flight -= 1
+        gate.sem.release()
+        self._dispatch(gate)
+
+    def submit(self, model, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool once a `model` slot is free.
+        Returns a concurrent.futures.Future."""
+        gate = self._gate(model)
+        future = Future()
+        with self._lock:
+            gate.pending.append((future, fn, args, kwargs, time.time()))
+            gate.waiting += 1
+            self._pool_queued += 1
+            self.submitted += 1
+        self._dispatch(gate)
+        return future
+
+    def claim(self, model):
+        """A Future that resolves once a `model` slot is held for the caller,
+        who hands it back with release(). Waits in the same queue as
+        submit(); cancelling the Future before it resolves gives up the claim."""
+        gate = self._gate(model)
+        future = Future()
+        with self._lock:
+            gate.pending.append((future, None, (), {}, time.time()))
+            gate.waiting += 1
+        self._dispatch(gate)
+        return future
+
+    def release(self, model):
+        """Hand back a slot taken with claim()."""
+        self._release(self._gate(model))
+
+    def _dispatch(self, gate):
+        """Hand queued work to the pool while the model has free slots."""
+        while True:
+            with self._lock:
+                if not gate.pending or not gate.sem.acquire(blocking=False):
+                    return
+                future, fn, args, kwargs, enqueued_at = gate.pending.popleft()
+                self._admitted(gate, enqueued_at)
+            if fn is None:
+                # A claim: the slot is the caller's until release()
+                if future.set_running_or_notify_cancel():
+                    future.set_result(None)
+                else:
+                    with self._lock:
+                        gate.in_flight -= 1
+                    gate.sem.release()
+                continue
+            self._pool.submit(self._run, gate, future, fn, args, kwargs)
+
+    def _run(self, gate, future, fn, args, kwargs):
+        with self._lock:
+            self._pool_queued -= 1
+            self._pool_active += 1
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self._pool_active -= 1
+            self._release(gate)
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for model, gate in self._gates.items():
+                models[model] = {
+                    'limit': gate.limit,
+                    'in_flight': gate.in_flight,
+                    'waiting': gate.waiting,
+                    'acquired': gate.acquired,
+                    'avg_wait_ms': round(1000 * gate.wait_total / gate.acquired, 1)
+                                   if gate.acquired else 0.0,
+                    'max_wait_ms': round(1000 * gate.wait_max, 1),
+                }
+            return {
+                'pool_size': self.max_workers,
+                'pool_active': self._pool_active,
+                'pool_queued': self._pool_queued,
+                'submitted': self.submitted,
+                'models': models,
+            }
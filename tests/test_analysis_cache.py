@@ -0,0 +1,69 @@
+"""Unit tests for the content-addressed analysis cache in services/analysis_cache.py."""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.analysis_cache import AnalysisCache, analysis_key, prompt_version, normalize_text
+
+
+MODELS = ('claude-opus-4-6', 'claude-haiku-4-5-20251001')
+
+
+class TestAnalysisKey:
+    """Tests for analysis_key: what does and does not change the cache key."""
+
+    def test_whitespace_differences_share_a_key(self):
+        pv = prompt_version('prompt')
+        a = analysis_key('Late fee  of $75\n\nper day.', MODELS, pv)
+        b = analysis_key('Late fee of $75 per day. ', MODELS, pv)
+        assert a == b
+
+    def test_text_change_changes_key(self):
+        pv = prompt_version('prompt')
+        assert analysis_key('fee $75', MODELS, pv) != analysis_key('fee $76', MODELS, pv)
+
+    def test_model_change_changes_key(self):
+        pv = prompt_version('prompt')
+        assert analysis_key('x', MODELS, pv) != analysis_key('x', ('other', MODELS[1]), pv)
+
+    def test_prompt_change_changes_key(self):
+        assert (analysis_key('x', MODELS, prompt_version('v1'))
+                != analysis_key('x', MODELS, prompt_version('v2')))
+
+    def test_images_change_key(self):
+        pv = prompt_version('prompt')
+        assert analysis_key('x', MODELS, pv) != analysis_key('x', MODELS, pv, has_images=True)
+
+    def test_normalize_text(self):
+        assert normalize_text('  a\n\tb  ') == 'a b'
+        assert normalize_text(None) == ''
+
+
+class TestAnalysisCache:
+
+    def test_miss_then_hit(self, tmp_path):
+        cache = AnalysisCache(str(tmp_path))
+        assert cache.get('k') is None
+        cache.put('k', {'verdict_text': 'Tier 3', 'events': ['data: {}\n\n']})
+        entry = cache.get('k')
+        assert entry['verdict_text'] == 'Tier 3'
+        assert entry['events'] == ['data: {}\n\n']
+        assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+    def test_shared_between_instances(self, tmp_path):
+        AnalysisCache(str(tmp_path)).put('k', {'verdict_text': 'v'})
+        assert AnalysisCache(str(tmp_path)).get('k')['verdict_text'] == 'v'
+
+    def test_bounded_entries(self, tmp_path):
+        cache = AnalysisCache(str(tmp_path), max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, {})
+        assert cache.stats()['entries'] == 2
+
+    def test_clear(self, tmp_path):
+        cache = AnalysisCache(str(tmp_path))
+        cache.put('k', {})
+        cache.clear()
+        assert cache.get('k') is None
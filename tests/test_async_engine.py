@@ -0,0 +1,402 @@
+"""Tests for the asyncio analysis engine in async_engine.py, using a fake AsyncAnthropic."""
+
+import sys
+import os
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_engine
+from app import documents
+from services import BlobStore
+
+SCAN_TEXT = (
+    ' Late Fees (§1) | RISK: RED | TRICK: Penalty Disguise\n'
+    'CLAUSE: Arbitration (§8) | RISK: YELLOW | TRICK: Forum Lock\n'
+    '## Document Profile\n- **Document Type**: Lease\n'
+)
+
+
+def _delta(kind, text):
+    field = 'thinking' if kind == 'thinking_delta' else 'text'
+    return SimpleNamespace(type='content_block_delta',
+                           delta=SimpleNamespace(type=kind, **{field: text}))
+
+
+def _message_start(read, written):
+    usage = SimpleNamespace(input_tokens=40, cache_read_input_tokens=read,
+                            cache_creation_input_tokens=written)
+    return SimpleNamespace(type='message_start', message=SimpleNamespace(usage=usage))
+
+
+class FakeStream:
+    def __init__(self, events):
+        self._events = events
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for event in self._events:
+            await asyncio.sleep(0)
+            yield event
+
+    async def close(self):
+        pass
+
+
+class _LoggedStream:
+    def __init__(self, events):
+        self._events = events
+
+    def __aiter__(self):
+        return self._events()
+
+    async def close(self):
+        pass
+
+
+class FakeScanStream:
+    def __init__(self, text):
+        self.text = text
+
+    async def __aenter__(self):
+        async def gen():
+            for piece in self.text.split('\n'):
+                yield piece + '\n'
+        self.text_stream = gen()
+        return self
+
+    async def get_final_message(self):
+        return SimpleNamespace(usage=_message_start(0, 900).message.usage)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeMessages:
+    def __init__(self, scan_text):
+        self.scan_text = scan_text
+        self.calls = []
+
+    async def create(self, stream=False, **kwargs):
+        self.calls.append(kwargs)
+        if not stream:
+            return SimpleNamespace(content=[SimpleNamespace(text='TYPE: Lease\nDRAFTER: Unknown')],
+                                   usage=_message_start(0, 0).message.usage)
+        # The first call per model writes the document prefix; later ones read it
+        first = not any(c['model'] == kwargs['model'] for c in self.calls[:-1])
+        start = _message_start(0 if first else 900, 900 if first else 0)
+        if kwargs['model'] == async_engine.MODEL:
+            return FakeStream([start, _delta('thinking_delta', 'hmm'), _delta('text_delta', 'verdict')])
+        title = kwargs['messages'][0]['content'][-1]['text'].split('Title: ')[1].split('\n')[0]
+        return FakeStream([start, _delta('text_delta', f'### {title}\n[RED] · Score: 80/100 · Trick: X')])
+
+    def stream(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeScanStream(self.scan_text)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(scan_text=SCAN_TEXT):
+        client = SimpleNamespace(messages=FakeMessages(scan_text))
+        monkeypatch.setattr(async_engine, '_client', client)
+        return client
+    return install
+
+
+def _new_doc(doc_id):
+    doc = {'text': 'Late fees apply. Disputes go to arbitration.', 'filename': 't.txt',
+           '_prescan_event': threading.Event(), '_precards_event': threading.Event()}
+    documents.put(doc_id, doc)
+    return doc
+
+
+def _run(doc_id, doc):
+    events = []
+
+    def emit(event_type, content=''):
+        events.append((event_type, content))
+
+    asyncio.run(async_engine.run_analysis(doc_id, doc, emit))
+    return events
+
+
+class TestAsyncEngine:
+
+    def test_full_analysis_event_protocol(self, fake_client):
+        fake_client()
+        doc = _new_doc('async-full')
+        events = _run('async-full', doc)
+        types = [t for t, _ in events]
+        assert types[0] == 'phase'
+        assert types[-1] == 'done'
+        previews = [json.loads(c) for t, c in events if t == 'clause_preview']
+        assert [p['title'] for p in previews] == ['Late Fees', 'Arbitration']
+        cards = [c for t, c in events if t == 'text' and c.startswith('###')]
+        assert cards[0].startswith('### Late Fees')  # emitted in clause order
+        assert cards[1].startswith('### Arbitration')
+        handoff = json.loads(next(c for t, c in events if t == 'handoff'))
+        assert handoff['clause_count'] == 2
+        for label in async_engine.OPUS_SOURCES:
+            assert f'{label}_done' in types
+        assert doc['_verdict_text'] == 'verdict'
+        assert doc['_precards']['cards'][0].startswith('### Late Fees')
+        assert doc['_prescan_event'].is_set()
+        assert types[-2] == 'perf'
+        perf = json.loads(events[-2][1])
+        labels = {call['label'] for call in perf['calls']}
+        assert {'scan', 'card_0', 'card_1', 'doc_context'} | set(async_engine.OPUS_SOURCES) <= labels
+        assert perf['totals']['calls'] == len(perf['calls'])
+
+    def test_not_applicable_cancels_opus(self, fake_client):
+        fake_client(' \n## Document Profile\n**Not Applicable**: recipe\n')
+        doc = _new_doc('async-na')
+        events = _run('async-na', doc)
+        handoff = json.loads(next(c for t, c in events if t == 'handoff'))
+        assert handoff['not_applicable'] is True
+        assert events[-1][0] == 'done'
+
+    def test_precards_fast_path(self, fake_client):
+        client = fake_client()
+        doc = _new_doc('async-fast')
+        doc['_prescan'] = {'scan_text': 'CLAUSE: A', 'profile_text': '## Document Profile',
+                           'clauses': [{'title': 'A'}]}
+        doc['_precards'] = {'cards': ['### A\n[RED] · Score: 90/100 · Trick: T']}
+        events = _run('async-fast', doc)
+        assert ('text', '### A\n[RED] · Score: 90/100 · Trick: T\n\n---\n\n') in events
+        # No scan / card calls — only Opus + doc context
+        assert all(c['model'] == async_engine.MODEL or c.get('max_tokens') == 300
+                   for c in client.messages.calls)
+
+    def test_threads_share_a_cached_document_prefix(self, fake_client, monkeypatch, tmp_path):
+        client = fake_client()
+        blobs = BlobStore(str(tmp_path))
+        monkeypatch.setattr(async_engine.flipside, '_page_blobs', blobs)
+        doc = _new_doc('async-prefix')
+        doc['page_images'] = [blobs.put(b'img')]
+        events = _run('async-prefix', doc)
+        opus_calls = [c for c in client.messages.calls if c['model'] == async_engine.MODEL]
+        card_calls = [c for c in client.messages.calls
+                      if c['model'] == async_engine.FAST_MODEL and c.get('max_tokens') == 3000]
+        prefixes = [c['messages'][0]['content'][:3] for c in opus_calls]
+        assert all(p == prefixes[0] for p in prefixes)
+        # The page goes out base64-encoded, encoded once for every thread
+        assert prefixes[0][2]['source']['data'] == 'aW1n'
+        assert blobs.stats()['encoded']['misses'] == 1
+        assert prefixes[0][0]['cache_control'] and prefixes[0][-1]['cache_control']
+        assert all('system' not in c for c in opus_calls + card_calls)
+        # Cards also cache the shared card instructions after the document
+        assert len({c['messages'][0]['content'][1]['text'] for c in card_calls}) == 1
+        assert card_calls[0]['messages'][0]['content'][1]['cache_control']
+        # The verdict writes the prefix before any deep dive is sent
+        assert opus_calls[0]['messages'][0]['content'][3]['text'].startswith('You are')
+        scenario = json.loads(next(c for t, c in events if t == 'scenario_done'))
+        assert scenario['cache']['cache_read_input_tokens'] == 900
+        summary = async_engine.flipside._prompt_cache_summary()
+        assert summary['card']['calls'] >= 2 and summary['scan']['calls'] >= 1
+
+    def test_cards_wait_for_the_first_card_to_prime(self, fake_client):
+        client = fake_client()
+        log = []
+        create = client.messages.create
+
+        async def logging_create(stream=False, **kwargs):
+            result = await create(stream=stream, **kwargs)
+            if kwargs.get('max_tokens') != 3000:
+                return result
+            title = kwargs['messages'][0]['content'][-1]['text'].split('Title: ')[1].split('\n')[0]
+            log.append(('sent', title))
+
+            async def events():
+                async for event in result:
+                    if event.type == 'content_block_delta':
+                        log.append(('token', title))
+                    yield event
+            return _LoggedStream(events)
+
+        client.messages.create = logging_create
+        _run('async-prime', _new_doc('async-prime'))
+        assert log.index(('token', 'Late Fees')) < log.index(('sent', 'Arbitration'))
+        assert async_engine.flipside._card_priming_summary()['batches'] >= 1
+
+    def test_closing_stream_cancels_upstream(self, fake_client):
+        client = fake_client()
+        endless = [_delta('text_delta', 'word ')] * 100000
+        create = client.messages.create
+
+        async def slow_create(stream=False, **kwargs):
+            if stream and kwargs['model'] == async_engine.MODEL:
+                return FakeStream(endless)
+            return await create(stream=stream, **kwargs)
+
+        client.messages.create = slow_create
+        _new_doc('async-disconnect')
+        before = dict(async_engine.flipside._cancel_stats)
+        registry = async_engine.stream_runs
+        abandoned = registry.abandoned
+
+        async def read_then_disconnect():
+            stream = async_engine.analyze_stream('async-disconnect')
+            for _ in range(20):
+                await stream.__anext__()
+            await stream.aclose()  # what the ASGI layer does on http.disconnect
+            for _ in range(100):  # grace timer fires, then the run task is cancelled
+                if not any(not t.done() for t in async_engine._background):
+                    break
+                await asyncio.sleep(0.01)
+
+        grace = registry.grace
+        registry.grace = 0
+        try:
+            asyncio.run(read_then_disconnect())
+        finally:
+            registry.grace = grace
+        stats = async_engine.flipside._cancel_stats
+        assert registry.abandoned == abandoned + 1
+        # Every Opus stream that had started was closed (others were still pacing)
+        assert stats['streams_cancelled'] > before['streams_cancelled']
+        assert stats['output_tokens_saved_max'] > before['output_tokens_saved_max']
+
+    def test_subscribers_share_one_run(self, fake_client):
+        client = fake_client()
+        _new_doc('async-fanout')
+
+        async def two_tabs():
+            async def collect():
+                return [chunk async for chunk in async_engine.analyze_stream('async-fanout')]
+            return await asyncio.gather(collect(), collect())
+
+        first, second = asyncio.run(two_tabs())
+        assert first == second
+        assert first[0].startswith('id: 0\ndata: ')
+        assert json.loads(first[-1].split('data: ', 1)[1])['type'] == 'done'
+        opus_calls = [c for c in client.messages.calls if c['model'] == async_engine.MODEL]
+        assert len(opus_calls) == len(async_engine.OPUS_SOURCES)
+
+    def test_resume_from_last_event_id(self, fake_client):
+        fake_client()
+        _new_doc('async-resume')
+
+        async def drop_then_resume():
+            full = [chunk async for chunk in async_engine.analyze_stream('async-resume')]
+            resumed = [chunk async for chunk in async_engine.analyze_stream('async-resume', 5)]
+            return full, resumed
+
+        full, resumed = asyncio.run(drop_then_resume())
+        assert resumed == full[5:]  # replayed from the retained log, no new run
+        assert resumed[0].startswith('id: 5\n')
+
+
+class TestStreamCallCircuit:
+    """Upstream calls keep the half-open probe accounting straight."""
+
+    @pytest.fixture
+    def half_open(self, monkeypatch):
+        from services.rate_limiter import AdaptiveLimiter
+        limiter = AdaptiveLimiter('m', min_requests=1, cooldown=0)
+        limiter.record_error(SimpleNamespace(status_code=529))
+        assert limiter.state == 'open'
+        monkeypatch.setattr(async_engine, 'rate_limiters', SimpleNamespace(get=lambda model: limiter))
+        return limiter
+
+    def test_cancelled_probe_is_released(self, fake_client, half_open):
+        client = fake_client()
+        started = asyncio.Event()
+
+        async def endless(stream=False, **kwargs):
+            async def events():
+                started.set()
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield _delta('text_delta', 'word ')
+            return _LoggedStream(events)
+
+        client.messages.create = endless
+
+        async def probe_then_cancel():
+            task = asyncio.create_task(async_engine._stream_call(
+                'm', {'model': 'm', 'max_tokens': 10}, lambda event: None, 'probe'))
+            await started.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(probe_then_cancel())
+        assert half_open.state == 'half_open'
+        assert half_open.reserve() == 0.0  # the next probe is let through
+
+    def test_rejected_caller_leaves_the_probe_in_flight(self, fake_client, half_open):
+        from services.rate_limiter import CircuitOpenError
+        fake_client()
+        assert half_open.reserve() == 0.0  # somebody else's probe
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(async_engine._stream_call(
+                'm', {'model': 'm', 'max_tokens': 10}, lambda event: None, 'rejected'))
+        with pytest.raises(CircuitOpenError):
+            half_open.reserve()
+
+    def test_doc_context_records_its_outcome(self, fake_client, half_open):
+        fake_client()
+        events = []
+        doc = {'text': 'Late fees apply.'}
+        asyncio.run(async_engine._doc_context_task(doc, lambda *e: events.append(e), []))
+        assert events[0][0] == 'doc_context'
+        assert half_open.state == 'closed'
+
+    def test_cancelled_doc_context_releases_the_probe(self, fake_client, half_open):
+        client = fake_client()
+        started = asyncio.Event()
+
+        async def hang(stream=False, **kwargs):
+            started.set()
+            await asyncio.sleep(60)
+
+        client.messages.create = hang
+
+        async def probe_then_cancel():
+            task = asyncio.create_task(async_engine._doc_context_task(
+                {'text': 'Late fees apply.'}, lambda *e: None, []))
+            await started.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(probe_then_cancel())
+        assert half_open.reserve() == 0.0  # the next probe is let through
+
+
+class Overloaded(Exception):
+    status_code = 529
+
+
+class TestScanRetry:
+    """The async scan is retried through the rate limiter."""
+
+    @pytest.fixture
+    def limiter(self, monkeypatch):
+        from services.rate_limiter import AdaptiveLimiter
+        limiter = AdaptiveLimiter('m', backoff_base=0.01, min_requests=100)
+        monkeypatch.setattr(async_engine, 'rate_limiters', SimpleNamespace(get=lambda model: limiter))
+        return limiter
+
+    def test_overloaded_scan_is_retried(self, fake_client, limiter):
+        client = fake_client()
+        stream = client.messages.stream
+        failures = [Overloaded('overloaded')]
+
+        def flaky_stream(**kwargs):
+            if failures:
+                raise failures.pop()
+            return stream(**kwargs)
+
+        client.messages.stream = flaky_stream
+        doc = _new_doc('async-scan-retry')
+        events = _run('async-scan-retry', doc)
+        assert [json.loads(c)['title'] for t, c in events if t == 'clause_preview'] == \
+            ['Late Fees', 'Arbitration']
+        assert 'error' not in [t for t, _ in events]
+        assert limiter.stats()['retries'] == 1
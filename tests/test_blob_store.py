@@ -0,0 +1,93 @@
+"""Tests for the content-addressed BlobStore in services/blob_store.py."""
+
+import sys
+import os
+import time
+import hashlib
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.blob_store import BlobStore
+
+
+class TestBlobStore:
+    """Content addressing, streaming puts and LRU eviction."""
+
+    def test_put_is_content_addressed(self, tmp_path):
+        store = BlobStore(str(tmp_path), suffix='.pdf')
+        digest = store.put(b'%PDF-1.4 hello')
+        assert digest == hashlib.sha256(b'%PDF-1.4 hello').hexdigest()
+        assert store.put(b'%PDF-1.4 hello') == digest
+        assert store.stats()['entries'] == 1
+        with open(store.path(digest), 'rb') as f:
+            assert f.read() == b'%PDF-1.4 hello'
+        assert store.path('0' * 64) is None
+
+    def test_put_stream_copies_and_rewinds(self, tmp_path):
+        store = BlobStore(str(tmp_path))
+        stream = BytesIO(b'x' * 3_000_000)
+        path = store.put_stream(stream, 'abc')
+        assert os.path.getsize(path) == 3_000_000
+        assert stream.tell() == 0
+        assert store.put_stream(stream, 'abc') == path
+
+    def test_least_recently_used_blob_is_evicted(self, tmp_path):
+        store = BlobStore(str(tmp_path), max_bytes=250)
+        first = store.put(b'a' * 100)
+        second = store.put(b'b' * 100)
+        old = time.time() - 60
+        os.utime(os.path.join(str(tmp_path), second), (old, old))
+        third = store.put(b'c' * 100)
+        assert store.path(second) is None
+        assert store.path(first) and store.path(third)
+
+    def test_a_blob_larger_than_the_budget_is_kept(self, tmp_path):
+        store = BlobStore(str(tmp_path), max_bytes=10)
+        digest = store.put(b'z' * 100)
+        assert store.path(digest)
+
+    def test_puts_under_budget_do_not_scan(self, tmp_path, monkeypatch):
+        (tmp_path / 'existing').write_bytes(b'e' * 100)
+        store = BlobStore(str(tmp_path), max_bytes=350)
+        scans = []
+        entries = store._entries
+        monkeypatch.setattr(store, '_entries', lambda: scans.append(1) or entries())
+        store.put(b'a' * 100)
+        store.put(b'b' * 100)
+        assert scans == []
+        store.put(b'c' * 100)  # counts the blob found at startup: over budget
+        assert scans == [1]
+        assert store.path('existing') is None
+        assert store.stats()['bytes'] == store._bytes == 300
+
+    def test_read_maps_the_blob(self, tmp_path):
+        store = BlobStore(str(tmp_path), suffix='.jpg')
+        digest = store.put(b'\xff\xd8jpeg\xff\xd9')
+        with store.read(digest) as data:
+            assert data[:] == b'\xff\xd8jpeg\xff\xd9'
+        assert store.read('0' * 64) is None
+
+
+class TestEncodedCache:
+    """Base64 at the edge: encoded once, shared, bounded."""
+
+    def test_encoded_once_and_reused(self, tmp_path):
+        store = BlobStore(str(tmp_path))
+        digest = store.put(b'img')
+        first = store.encoded(digest)
+        assert first == 'aW1n'
+        assert store.encoded(digest) is first
+        encoded = store.stats()['encoded']
+        assert (encoded['hits'], encoded['misses'], encoded['entries']) == (1, 1, 1)
+        assert store.encoded('0' * 64) is None
+
+    def test_oldest_encoding_is_dropped_over_budget(self, tmp_path):
+        store = BlobStore(str(tmp_path), encoded_max_bytes=10)
+        first, second = store.put(b'a' * 6), store.put(b'b' * 6)
+        store.encoded(first)
+        store.encoded(second)
+        encoded = store.stats()['encoded']
+        assert encoded['entries'] == 1 and encoded['bytes'] == 8
+        # Dropped encodings are rebuilt from the file
+        assert store.encoded(first) == 'YWFhYWFh'
@@ -0,0 +1,101 @@
+"""Unit tests for per-call token and latency accounting in services/call_metrics.py."""
+
+import sys
+import os
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.call_metrics import CallMetrics, input_cost, summarize_run
+
+
+def _usage(**counts):
+    return SimpleNamespace(**counts)
+
+
+class TestCallTimer:
+    """One call: usage from stream events or a final message, TTFT, duration."""
+
+    def test_stream_events_fill_usage_and_ttft(self):
+        metrics = CallMetrics()
+        run = []
+        with metrics.timer('overall', 'opus', run) as timer:
+            timer.on_event(SimpleNamespace(type='message_start', message=SimpleNamespace(
+                usage=_usage(input_tokens=10, output_tokens=1,
+                             cache_read_input_tokens=900, cache_creation_input_tokens=0))))
+            timer.on_event(SimpleNamespace(type='content_block_delta', delta=None))
+            timer.on_event(SimpleNamespace(type='message_delta', usage=_usage(output_tokens=250)))
+        record = run[0]
+        assert record['input_tokens'] == 10
+        assert record['cache_read_input_tokens'] == 900
+        assert record['output_tokens'] == 250
+        assert record['ttft'] is not None and record['ttft'] <= record['seconds']
+        assert record['error'] is False
+
+    def test_exception_marks_error_and_finish_is_idempotent(self):
+        metrics = CallMetrics()
+        with pytest.raises(ValueError):
+            with metrics.timer('scan', 'haiku') as timer:
+                raise ValueError('boom')
+        assert timer.record['error'] is True
+        timer.finish()
+        assert metrics.stats()['scan']['calls'] == 1
+
+    def test_closed_generator_is_not_an_error(self):
+        metrics = CallMetrics()
+
+        def stream():
+            with metrics.timer('timeline', 'opus'):
+                yield 'chunk'
+
+        gen = stream()
+        next(gen)
+        gen.close()
+        assert metrics.stats()['timeline']['errors'] == 0
+
+
+class TestCallMetrics:
+    """Per-thread aggregates and the per-run perf summary."""
+
+    def test_numbered_labels_aggregate_by_thread(self):
+        metrics = CallMetrics()
+        for i in range(3):
+            with metrics.timer(f'card_{i}', 'haiku') as timer:
+                timer.set_usage(_usage(input_tokens=100, output_tokens=50,
+                                       cache_read_input_tokens=900 if i else 0,
+                                       cache_creation_input_tokens=0 if i else 900))
+        card = metrics.stats()['card']
+        assert card['calls'] == 3
+        assert card['output_tokens'] == 150
+        assert card['hit_rate'] == round(1800 / 3000, 3)
+        assert card['input_cost_tokens'] == round(input_cost(card))
+
+    def test_in_flight_counts_open_calls_per_model(self):
+        metrics = CallMetrics()
+        first = metrics.timer('overall', 'opus')
+        with metrics.timer('scenario', 'opus'):
+            assert metrics.in_flight() == {'opus': 2}
+        first.finish()
+        first.finish()
+        assert metrics.in_flight() == {'opus': 0}
+
+    def test_on_record_callback(self):
+        seen = []
+        metrics = CallMetrics(on_record=seen.append)
+        metrics.timer('ask_0', 'opus').finish()
+        assert seen[0]['label'] == 'ask_0'
+
+    def test_summarize_run_totals(self):
+        metrics = CallMetrics()
+        run = []
+        for label in ('overall', 'scenario'):
+            with metrics.timer(label, 'opus', run) as timer:
+                timer.set_usage(_usage(input_tokens=5, output_tokens=20))
+        perf = summarize_run(run)
+        assert [c['label'] for c in perf['calls']] == ['overall', 'scenario']
+        assert 'started' not in perf['calls'][0]
+        assert perf['totals']['calls'] == 2
+        assert perf['totals']['output_tokens'] == 40
+        assert perf['totals']['wall_seconds'] >= 0
@@ -0,0 +1,131 @@
+"""Tests for the thread engine's card pipeline in app.py, driven by a fake
+prescan channel against the offline fake_anthropic API."""
+
+import sys
+import os
+import json
+import time
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flipside
+import fake_anthropic
+
+CLAUSES = [{'title': 'Late Fees', 'section': '1'}, {'title': 'Arbitration', 'section': '8'}]
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    config = fake_anthropic.FakeConfig(ttft=0, tps=10000, opus_ttft=0, opus_tps=10000,
+                                       thinking_tokens=5, output_tokens=20, seed=1)
+    server = fake_anthropic.serve(config, port=0)
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'fake-key')
+    monkeypatch.setattr(flipside, '_client', None)
+    yield server
+    server.shutdown()
+
+
+def _doc(doc_id):
+    """A document whose prescan is this test's to play."""
+    doc = {
+        'text': 'Late fees apply. Disputes go to arbitration.',
+        'filename': 't.txt',
+        '_prescan_event': threading.Event(),
+        '_precards_event': threading.Event(),
+        '_prescan_channel': flipside._PrescanChannel(),
+    }
+    flipside.documents.put(doc_id, doc)
+    return doc
+
+
+def _prescan(doc, finish_cards=True):
+    """Publish what _prescan_document would: previews, card chunks, the
+    stored scan result and prescan_done. Returns the events published."""
+    channel = doc['_prescan_channel']
+    for i, clause in enumerate(CLAUSES):
+        channel.put(('preview', {'index': i, **clause}))
+    for i, clause in enumerate(CLAUSES):
+        channel.put(('chunk', i, f'### {clause["title"]}\n'))
+        channel.put(('chunk', i, '[RED] Score: 80/100 Trick: X'))
+    doc['_card_total'] = len(CLAUSES)
+    doc['_prescan'] = {'scan_text': 'CLAUSE: ...', 'profile_text': '## Document Profile',
+                       'clauses': CLAUSES, 'green_text': '', 'seconds': 0.5}
+    doc['_prescan_event'].set()
+    channel.put(('prescan_done',))
+    for i in range(len(CLAUSES) if finish_cards else 1):
+        channel.put(('done', i))
+    return len(channel)
+
+
+def _analyze(client, doc_id):
+    body = client.get(f'/analyze/{doc_id}').get_data(as_text=True)
+    events = [json.loads(line[6:]) for line in body.splitlines() if line.startswith('data: ')]
+    return [e['type'] for e in events], body
+
+
+def _counter(name):
+    return sum(flipside.runtime_metrics.snapshot().get(name, {}).values())
+
+
+def _counted(name, expected, timeout=2.0):
+    """The counter once it reaches `expected` (the pipeline thread counts in
+    its finally, which can trail the stream's end)."""
+    deadline = time.time() + timeout
+    while _counter(name) < expected and time.time() < deadline:
+        time.sleep(0.01)
+    return _counter(name)
+
+
+class TestCardPipeline:
+    """One wakeup per batch of prescan events; the channel replays."""
+
+    def test_a_finished_prescan_is_read_in_one_wakeup(self, fake_api):
+        doc = _doc('pipeline-one-wakeup')
+        published = _prescan(doc)
+        wakeups, events = _counter('card_pipeline_wakeups_total'), _counter('card_pipeline_events_total')
+        names, body = _analyze(flipside.app.test_client(), 'pipeline-one-wakeup')
+        assert names[-1] == 'done' and 'error' not in names
+        assert '### Late Fees' in body and '### Arbitration' in body
+        assert _counted('card_pipeline_events_total', events + published) == events + published
+        assert _counter('card_pipeline_wakeups_total') - wakeups == 1
+
+    def test_a_second_pipeline_replays_the_channel(self, fake_api):
+        doc = _doc('pipeline-replay')
+        published = _prescan(doc)
+        client = flipside.app.test_client()
+        events = _counter('card_pipeline_events_total')
+        _analyze(client, 'pipeline-replay')
+        events = _counted('card_pipeline_events_total', events + published)
+        names, body = _analyze(client, 'pipeline-replay')
+        assert names[-1] == 'done' and 'error' not in names
+        assert '### Arbitration' in body
+        assert _counted('card_pipeline_events_total', events + published) == events + published
+
+    def test_a_stalled_card_ends_the_cards(self, fake_api, monkeypatch):
+        monkeypatch.setattr(flipside, 'CARD_STALL_SECONDS', 0.2)
+        doc = _doc('pipeline-stall')
+        _prescan(doc, finish_cards=False)  # card 1 never reports 'done'
+        names, body = _analyze(flipside.app.test_client(), 'pipeline-stall')
+        assert names[-1] == 'done'
+        assert '### Late Fees' in body
+
+    def test_an_abandoned_run_ends_without_waiting_for_cards(self, fake_api, monkeypatch):
+        # Opus slow enough that the run is still going when the viewer leaves
+        fake_api.RequestHandlerClass.config = fake_anthropic.FakeConfig(
+            ttft=0, tps=10000, opus_ttft=0, opus_tps=50, thinking_tokens=5, output_tokens=400)
+        registry = flipside.stream_runs
+        monkeypatch.setattr(registry, 'grace', 0)
+        doc = _doc('abandoned-pipeline')
+        doc['_prescan_channel'].put(('preview', {'index': 0, **CLAUSES[0]}))  # scan never ends
+        response = flipside.app.test_client().get('/analyze/abandoned-pipeline', buffered=False)
+        chunks = iter(response.response)
+        next(chunks)
+        response.close()  # the viewer leaves
+        deadline = time.time() + 10
+        while 'abandone' in registry.stats()['live'] and time.time() < deadline:
+            time.sleep(0.05)
+        assert 'abandone' not in registry.stats()['live']
+        assert not flipside.documents.get('abandoned-pipeline').get('_verdict_text')
@@ -0,0 +1,169 @@
+"""Unit tests for the document store backends in services/document_store.py."""
+
+import sys
+import os
+import time
+import hashlib
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.document_store import (
+    MemoryDocumentStore,
+    SQLiteDocumentStore,
+    create_document_store,
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryDocumentStore()
+    return SQLiteDocumentStore(str(tmp_path / 'docs.db'))
+
+
+IMG_REF = hashlib.sha256(b'\xff\xd8fake-jpeg\xff\xd9').hexdigest()
+
+
+class TestDocumentStoreInterface:
+    """Behaviour both backends must share."""
+
+    def test_put_and_get(self, store):
+        store.put('a', {'text': 'hello', 'filename': 'a.txt', '_ts': time.time()})
+        doc = store.get('a')
+        assert doc['text'] == 'hello'
+        assert 'a' in store
+        assert 'missing' not in store
+        assert store.get('missing') is None
+
+    def test_update_sets_fields(self, store):
+        store.put('a', {'text': 'hello', '_ts': time.time()})
+        store.update('a', _verdict_text='verdict', analyzed=True)
+        doc = store.get('a')
+        assert doc['_verdict_text'] == 'verdict'
+        assert doc['analyzed'] is True
+
+    def test_runtime_fields_stay_on_live_dict(self, store):
+        ev = threading.Event()
+        store.put('a', {'text': 'hello', '_ts': time.time(), '_prescan_event': ev})
+        assert store.get('a')['_prescan_event'] is ev
+
+    def test_delete(self, store):
+        store.put('a', {'text': 'hello', '_ts': time.time()})
+        store.delete('a')
+        assert 'a' not in store
+        assert store.doc_ids() == []
+
+    def test_evict_older_than(self, store):
+        store.put('old', {'text': 'x', '_ts': time.time() - 3600})
+        store.put('new', {'text': 'y', '_ts': time.time()})
+        assert store.evict_older_than(1800) == 1
+        assert store.doc_ids() == ['new']
+
+    def test_page_images_keep_index_alignment(self, store):
+        store.put('a', {'text': 'x', '_ts': time.time(), 'page_images': [IMG_REF, None, IMG_REF]})
+        assert store.get('a')['page_images'] == [IMG_REF, None, IMG_REF]
+
+
+class TestSQLiteDocumentStore:
+    """Persistence across store instances (other workers / restarts)."""
+
+    def test_fields_visible_to_second_instance(self, tmp_path):
+        path = str(tmp_path / 'docs.db')
+        first = SQLiteDocumentStore(path)
+        second = SQLiteDocumentStore(path)
+        first.put('a', {'text': 'hello', '_ts': time.time(), 'page_images': [IMG_REF]})
+        first.update('a', _prescan={'clauses': [{'title': 'Late Fees'}]})
+        doc = second.get('a')
+        assert doc['text'] == 'hello'
+        assert doc['_prescan']['clauses'][0]['title'] == 'Late Fees'
+        assert doc['page_images'] == [IMG_REF]
+
+    def test_runtime_fields_are_not_persisted(self, tmp_path):
+        path = str(tmp_path / 'docs.db')
+        SQLiteDocumentStore(path).put('a', {'text': 'x', '_ts': time.time(),
+                                            '_card_queue': object()})
+        assert '_card_queue' not in SQLiteDocumentStore(path).get('a')
+
+    def test_page_image_references_live_in_the_row(self, tmp_path):
+        store = SQLiteDocumentStore(str(tmp_path / 'docs.db'))
+        store.put('a', {'text': 'x', '_ts': time.time(), 'page_images': [IMG_REF, None]})
+        assert all(name.startswith('docs.db') for name in os.listdir(tmp_path))
+        store.enforce_budget(0)
+        assert store.get('a')['page_images'] == [IMG_REF, None]
+
+
+class TestCreateDocumentStore:
+
+    def test_default_is_memory(self, monkeypatch):
+        monkeypatch.delenv('FLIPSIDE_DOC_STORE', raising=False)
+        assert isinstance(create_document_store(), MemoryDocumentStore)
+
+    def test_sqlite_backend(self, tmp_path):
+        store = create_document_store('sqlite', str(tmp_path / 'docs.db'))
+        assert isinstance(store, SQLiteDocumentStore)
+
+    def test_unknown_backend_raises(self):
+        with pytest.raises(ValueError):
+            create_document_store('redis')
+
+
+class TestEnforceBudget:
+    """Byte-budgeted eviction of heavy idle documents."""
+
+    def _doc(self, text_len, images=0, age=0):
+        return {
+            'text': 'x' * text_len,
+            '_ts': time.time() - age,
+            'page_images': ['i' * 1000] * images,
+        }
+
+    def test_under_budget_is_noop(self, store):
+        store.put('a', self._doc(100, images=1))
+        assert store.enforce_budget(10_000) == 0
+        assert store.stats()['evictions']['documents'] == 0
+
+    def test_heaviest_idle_document_evicted_first(self, store):
+        store.put('small', self._doc(100))
+        store.put('heavy', self._doc(5000))
+        store._atime['heavy'] -= 600
+        store._atime['small'] -= 600
+        store.enforce_budget(1000)
+        resident = [doc_id for doc_id, _ in store._resident()]
+        assert resident == ['small']
+        assert store.stats()['evictions']['documents'] == 1
+
+    def test_busy_document_is_not_evicted(self, store):
+        doc = self._doc(5000)
+        doc['_prescan_event'] = threading.Event()  # prescan still running
+        store.put('busy', doc)
+        store.enforce_budget(100)
+        assert 'busy' in [doc_id for doc_id, _ in store._resident()]
+
+    def test_in_use_document_is_not_evicted(self, store):
+        store.put('streaming', self._doc(5000))
+        store.put('idle', self._doc(5000))
+        store.in_use = lambda doc_id: doc_id == 'streaming'
+        store.enforce_budget(100)
+        assert [doc_id for doc_id, _ in store._resident()] == ['streaming']
+        assert store.stats()['evictions']['documents'] == 1
+
+    def test_stats_report_bytes_by_field(self, store):
+        store.put('a', self._doc(100, images=2))
+        stats = store.stats()
+        assert stats['resident_bytes_by_field']['text'] == 100
+        assert stats['resident_bytes_by_field']['page_images'] == 2000
+        assert stats['resident_bytes'] >= 2100
+
+
+class TestSQLiteBudget:
+
+    def test_dropped_document_reloads_from_disk(self, tmp_path):
+        store = SQLiteDocumentStore(str(tmp_path / 'docs.db'))
+        store.put('a', {'text': 'x' * 5000, '_ts': time.time(), 'page_images': [IMG_REF]})
+        store.enforce_budget(0)
+        assert store._resident() == []
+        doc = store.get('a')
+        assert doc['text'] == 'x' * 5000
+        assert doc['page_images'] == [IMG_REF]
@@ -0,0 +1,172 @@
+"""Unit tests for per-document event logs and the run registry in services/event_log.py."""
+
+import sys
+import os
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.event_log import EventLog, RunRegistry
+
+
+class TestEventLog:
+    """Replay-then-tail reads for any number of subscribers."""
+
+    def test_read_replays_from_any_offset(self):
+        log = EventLog()
+        for chunk in ('a', 'b', 'c'):
+            log.append(chunk)
+        assert log.read(0, timeout=0) == (['a', 'b', 'c'], False)
+        assert log.read(2, timeout=0) == (['c'], False)
+
+    def test_read_times_out_with_nothing_new(self):
+        log = EventLog()
+        log.append('a')
+        t0 = time.time()
+        assert log.read(1, timeout=0.05) == ([], False)
+        assert time.time() - t0 >= 0.04
+
+    def test_read_wakes_on_append(self):
+        log = EventLog()
+        threading.Timer(0.05, log.append, ('late',)).start()
+        assert log.read(0, timeout=5) == (['late'], False)
+
+    def test_close_wakes_readers_and_stops_appends(self):
+        log = EventLog()
+        threading.Timer(0.05, log.close).start()
+        assert log.read(0, timeout=5) == ([], True)
+        log.append('ignored')
+        assert len(log) == 0
+
+    def test_listeners_called_on_append_and_close(self):
+        log = EventLog()
+        calls = []
+        log.add_listener(lambda: calls.append(1))
+        log.append('a')
+        log.close()
+        assert len(calls) == 2
+
+
+class TestRunRegistry:
+    """One producer per document; abandoned runs cancelled after the grace period."""
+
+    def test_second_join_shares_the_run(self):
+        registry = RunRegistry(grace=10)
+        starts = []
+        first, started = registry.join('doc', lambda log: starts.append(log))
+        second, joined_started = registry.join('doc', lambda log: starts.append(log))
+        assert started and not joined_started
+        assert first is second
+        assert len(starts) == 1
+        assert first.subscribers == 2
+        assert registry.stats()['joined'] == 1
+
+    def test_finish_unregisters_and_closes(self):
+        registry = RunRegistry()
+        log, _ = registry.join('doc', lambda log: None)
+        registry.finish('doc', log)
+        assert log.closed
+        assert registry.join('doc', lambda log: None)[0] is not log
+
+    def test_live_keys_cover_runs_and_jobs(self):
+        registry = RunRegistry()
+        log, _ = registry.join('doc', lambda log: None)
+        job = registry.launch('other/upload', lambda log: None)
+        assert registry.live_keys() == {'doc', 'other/upload'}
+        registry.finish('doc', log)
+        registry.finish('other/upload', job)
+        assert registry.live_keys() == set()
+
+    def test_last_leave_cancels_after_grace(self):
+        registry = RunRegistry(grace=0.05)
+        cancelled = threading.Event()
+        log, _ = registry.join('doc', lambda log: cancelled.set)
+        registry.leave('doc', log)
+        assert cancelled.wait(timeout=5)
+        assert registry.stats()['abandoned'] == 1
+        # A late visitor starts fresh instead of joining the cancelled run
+        registry.finish('doc', log)
+        fresh, started = registry.join('doc', lambda log: None, resume=True)
+        assert started and fresh is not log
+
+    def test_visitor_waits_for_a_cancelled_run_to_finish(self):
+        registry = RunRegistry(grace=0.05)
+        cancelled = threading.Event()
+        starts = []
+        log, _ = registry.join('doc', lambda log: cancelled.set)
+        registry.leave('doc', log)
+        assert cancelled.wait(timeout=5)
+        # The cancelled producer is still winding down: nothing new starts yet
+        successor, started = registry.join('doc', lambda log: starts.append(log))
+        assert started and successor is not log
+        assert registry.join('doc', lambda log: starts.append(log)) == (successor, False)
+        assert starts == []
+        assert registry.stats()['live']['doc']['cancelled']
+        registry.finish('doc', log)
+        assert starts == [successor]
+        # The cancelled run is not resumable; the successor is the live run
+        assert registry.join('doc', lambda log: None, resume=True) == (successor, False)
+
+    def test_successor_left_before_starting_never_starts(self):
+        registry = RunRegistry(grace=0.05)
+        cancelled = threading.Event()
+        starts = []
+        log, _ = registry.join('doc', lambda log: cancelled.set)
+        registry.leave('doc', log)
+        assert cancelled.wait(timeout=5)
+        successor, _ = registry.join('doc', lambda log: starts.append(log))
+        registry.leave('doc', successor)
+        time.sleep(0.15)
+        assert successor.closed
+        registry.finish('doc', log)
+        assert starts == []
+        assert registry.stats()['abandoned'] == 2
+
+    def test_rejoin_within_grace_keeps_the_run(self):
+        registry = RunRegistry(grace=0.1)
+        cancelled = threading.Event()
+        log, _ = registry.join('doc', lambda log: cancelled.set)
+        registry.leave('doc', log)
+        assert registry.join('doc', lambda log: cancelled.set)[0] is log  # reconnect
+        assert not cancelled.wait(timeout=0.3)
+        assert registry.stats()['abandoned'] == 0
+
+    def test_finished_log_is_resumable_only_on_request(self):
+        registry = RunRegistry(retain=60)
+        log, _ = registry.join('doc/timeline', lambda log: None)
+        log.append('data: a\n\n')
+        registry.finish('doc/timeline', log)
+        assert registry.join('doc/timeline', lambda log: None, resume=True) == (log, False)
+        assert registry.stats()['resumed'] == 1
+        # Without Last-Event-ID a finished stream is simply run again
+        assert registry.join('doc/timeline', lambda log: None)[0] is not log
+
+    def test_retained_logs_are_bounded(self):
+        registry = RunRegistry(retain=60, max_retained_bytes=10)
+        for key in ('a', 'b', 'c'):
+            log, _ = registry.join(key, lambda log: None)
+            log.append('x' * 6)
+            registry.finish(key, log)
+        stats = registry.stats()
+        assert stats['retained'] == 1
+        assert stats['retained_bytes'] == 6
+        assert registry.join('a', lambda log: None, resume=True)[1] is True  # evicted
+
+    def test_retention_expires(self):
+        registry = RunRegistry(retain=0.05)
+        log, _ = registry.join('doc', lambda log: None)
+        registry.finish('doc', log)
+        time.sleep(0.1)
+        assert registry.stats()['retained'] == 0
+
+    def test_launched_job_outlives_its_viewers(self):
+        registry = RunRegistry(grace=0.05, retain=60)
+        launched = registry.launch('doc/upload', lambda log: log.append('data: a\n\n'))
+        log, started = registry.join('doc/upload', lambda log: None)
+        assert log is launched and not started
+        registry.leave('doc/upload', log)
+        time.sleep(0.15)
+        assert registry.stats()['abandoned'] == 0
+        registry.finish('doc/upload', log)
+        assert registry.join('doc/upload', lambda log: None, resume=True) == (log, False)
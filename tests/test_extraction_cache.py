@@ -0,0 +1,63 @@
+"""Unit tests for the uploaded-file extraction cache in services/extraction_cache.py."""
+
+import sys
+import os
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.extraction_cache import ExtractionCache, extraction_key, file_digest
+
+
+class TestExtractionKey:
+    """The key follows the file bytes and the extraction version."""
+
+    def test_digest_rewinds_the_stream(self):
+        stream = BytesIO(b'%PDF-1.4 contract')
+        digest = file_digest(stream, chunk_size=4)
+        assert stream.read() == b'%PDF-1.4 contract'
+        assert digest == file_digest(BytesIO(b'%PDF-1.4 contract'))
+
+    def test_version_changes_key(self):
+        digest = file_digest(BytesIO(b'x'))
+        assert extraction_key(digest, 'pdf:v1') != extraction_key(digest, 'pdf:v2')
+        assert extraction_key(digest, 'pdf:v1') == extraction_key(digest, 'pdf:v1')
+
+
+class TestExtractionCache:
+    """Round trip, placeholders and size-bounded eviction."""
+
+    def test_round_trip_keeps_page_slots(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path))
+        images = ['a1' * 32, None, 'c3' * 32]
+        cache.put('k', 'Lease text', images, ocr_used=True, thumbnail='thumb')
+        entry = cache.get('k')
+        assert entry['text'] == 'Lease text'
+        assert entry['page_images'] == images
+        assert entry['ocr_used'] is True
+        assert entry['thumbnail'] == 'thumb'
+        # Only references: the JPEGs live in the page blob store
+        assert os.listdir(tmp_path / 'k') == ['meta.json']
+        assert cache.stats()['hits'] == 1
+
+    def test_miss(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path))
+        assert cache.get('absent') is None
+        assert cache.stats()['misses'] == 1
+
+    def test_least_recently_used_evicted_over_budget(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), max_bytes=2500)
+        for key in ('a', 'b'):
+            cache.put(key, 'x' * 1000, [])
+        os.utime(tmp_path / 'a' / 'meta.json', (1, 1))
+        cache.get('b')
+        cache.put('c', 'x' * 1000, [])
+        assert cache.get('a') is None
+        assert cache.get('b') is not None and cache.get('c') is not None
+        assert cache.stats()['bytes'] <= 2500
+
+    def test_clear(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path))
+        cache.put('k', 'text', [])
+        cache.clear()
+        assert cache.stats()['entries'] == 0
@@ -0,0 +1,56 @@
+"""Unit tests for the reversed-text detector in services/garbled_text.py."""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.garbled_text import garbled_lines, has_garbled_text, line_scores, unreverse
+
+REVERSED = '.sdrow hsilgnE nommoc htiw ecnetnes lamron a si sihT'
+
+
+class TestLineScores:
+    """Forward and backward function-word hits per line, in one pass."""
+
+    def test_scores_per_line(self):
+        text = 'This is the lease for the tenant.\n' + REVERSED + '\n'
+        assert line_scores(text) == [(5, 0), (0, 3), (0, 0)]
+
+    def test_punctuation_and_case_ignored(self):
+        assert line_scores('(THE) "and," of;') == [(3, 0)]
+
+    def test_unicode_whitespace_still_separates_words(self):
+        # NBSP and an em space between words, as PDF extraction produces
+        assert line_scores('of\xa0the\u2003and') == [(3, 0)]
+
+    def test_non_ascii_letters_are_dropped_like_punctuation(self):
+        assert line_scores('für thé') == line_scores('fr th')
+
+
+class TestGarbledLines:
+    """Which lines read better reversed."""
+
+    def test_flags_only_the_reversed_line(self):
+        text = 'This is a normal sentence.\n' + REVERSED + '\nAnother normal line of text.'
+        assert garbled_lines(text) == [1]
+        assert has_garbled_text(text) is True
+
+    def test_digit_words_count_towards_the_minimum(self):
+        # Three letter words plus a number: four words, as str.split() sees it
+        assert garbled_lines('eht dna fo 2024') == [0]
+        assert garbled_lines('eht dna fo') == []
+
+    def test_empty(self):
+        assert garbled_lines('') == []
+        assert has_garbled_text('') is False
+
+
+class TestUnreverse:
+    """Local fix for lines reversed as a whole."""
+
+    def test_whole_line_reversed(self):
+        assert unreverse('  ' + REVERSED) == '  This is a normal sentence with common English words.'
+
+    def test_partly_reversed_line_left_alone(self):
+        assert unreverse('The fee is due tnuoma eht rof') is None
@@ -8,6 +8,7 @@ import pytest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import the functions under test — these are pure parsers, no Flask needed
+import app
 from app import _parse_clause_line, _has_garbled_text, parse_identification_output, _build_claims_summary
 
 
@@ -101,6 +102,59 @@ class TestHasGarbledText:
         assert _has_garbled_text(text) is True
 
 
+# ── clean_extracted_text ──────────────────────────────────────────
+
+class _FakeMessages:
+    def __init__(self, reply):
+        self.reply = reply
+        self.inputs = []
+
+    def create(self, **kwargs):
+        self.inputs.append(kwargs['messages'][0]['content'])
+        content = [type('Block', (), {'text': self.reply(kwargs['messages'][0]['content'])})()]
+        return type('Message', (), {'content': content, 'usage': None})()
+
+
+class TestCleanExtractedText:
+    """Tests for clean_extracted_text: local reversal first, then per-excerpt repair."""
+
+    CLEAN = [f'Clause {i}: the tenant pays rent on the first day of the month.' for i in range(12)]
+
+    def _client(self, monkeypatch, reply):
+        messages = _FakeMessages(reply)
+        monkeypatch.setattr(app, 'get_client', lambda: type('Client', (), {'messages': messages})())
+        return messages
+
+    def test_fully_reversed_line_fixed_without_api_call(self, monkeypatch):
+        messages = self._client(monkeypatch, lambda text: pytest.fail('no API call expected'))
+        lines = list(self.CLEAN)
+        lines[5] = lines[5][::-1]
+        assert app.clean_extracted_text('\n'.join(lines)) == '\n'.join(self.CLEAN)
+        assert messages.inputs == []
+
+    def test_only_garbled_excerpts_are_sent(self, monkeypatch):
+        messages = self._client(monkeypatch, lambda text: text.replace('tnuoma eht rof', 'for the amount'))
+        mixed = 'The fee is due tnuoma eht rof eht ot fo dna eht'
+        lines = list(self.CLEAN)
+        lines[8] = mixed
+        cleaned = app.clean_extracted_text('\n'.join(lines)).split('\n')
+        assert len(messages.inputs) == 1
+        excerpt = messages.inputs[0].split('\n')
+        # The garbled line plus two lines of context either side
+        assert excerpt == lines[6:11]
+        assert cleaned[:8] == self.CLEAN[:8]
+        assert 'for the amount' in cleaned[8]
+
+    def test_clean_text_passes_through(self, monkeypatch):
+        self._client(monkeypatch, lambda text: pytest.fail('no API call expected'))
+        text = '\n'.join(self.CLEAN)
+        assert app.clean_extracted_text(text) is text
+
+    def test_far_apart_lines_become_separate_excerpts(self):
+        spans = app._repair_spans([1, 20], ['line'] * 30)
+        assert spans == [(0, 4), (18, 23)]
+
+
 # ── parse_identification_output ───────────────────────────────────
 
 class TestParseIdentificationOutput:
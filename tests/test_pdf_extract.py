@@ -0,0 +1,162 @@
+"""Tests for per-page PDF extraction in services/pdf_extract.py."""
+
+import sys
+import os
+from io import BytesIO
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('pdfplumber')
+from PIL import Image
+
+import services.pdf_extract as pdf_extract
+from services.pdf_extract import PageSettings, PdfPagePool, _chunks
+
+
+def _image_pdf(pages):
+    """An image-only PDF (like a scan) with `pages` pages."""
+    images = [Image.new('RGB', (300, 400), (255, 255 - i, 255)) for i in range(pages)]
+    buf = BytesIO()
+    images[0].save(buf, 'PDF', save_all=True, append_images=images[1:])
+    return buf.getvalue()
+
+
+_LINE = b'(This lease agreement is between the landlord and tenant) Tj'
+_HALF = b'(The tenant pays rent on the first day) Tj'
+_PAGE_STREAMS = {
+    'text': b'BT /F1 12 Tf 72 700 Td ' + _LINE + b' ET',
+    'scan': b'',
+    # Eight lines in two columns
+    'columns': b'BT /F1 10 Tf 14 TL 72 700 Td ' + b' '.join(
+        [_HALF + b' T*'] * 8) + b' ET BT /F1 10 Tf 14 TL 340 700 Td ' + b' '.join(
+        [_HALF + b' T*'] * 8) + b' ET',
+    # A ruled three-by-three grid under the text
+    'table': b'BT /F1 12 Tf 72 700 Td ' + _LINE + b' ET ' + b' '.join(
+        f'{72 + 150 * col} {600 - 20 * row} 150 20 re S'.encode()
+        for row in range(3) for col in range(3)),
+}
+
+
+def _mixed_pdf(pages):
+    """A PDF whose pages are 'text' (a real text layer), 'scan' (none),
+    'columns' (two text columns) or 'table' (text over a ruled grid)."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for kind in pages:
+        stream = _PAGE_STREAMS[kind]
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n'.encode() + stream + b'\nendstream')
+        kids.append(len(objects) + 1)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{k} 0 R" for k in kids)}] /Count {len(kids)} >>'
+    out = BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        body = body if isinstance(body, bytes) else body.encode()
+        out.write(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode())
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n'
+              f'startxref\n{xref}\n%%EOF\n'.encode())
+    return out.getvalue()
+
+
+class TestPdfPagePool:
+    """Ordered reassembly and vision-page alignment, inline and pooled."""
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_pages_come_back_in_order(self, workers):
+        pool = PdfPagePool(workers=workers, inline_below=1)
+        try:
+            pages = pool.extract(_image_pdf(5), PageSettings(dpi=30, max_vision_pages=3))
+        finally:
+            pool.shutdown()
+        assert [p['index'] for p in pages] == [0, 1, 2, 3, 4]
+        assert [p['rendered'] for p in pages] == [True, True, True, False, False]
+        assert all(p['image'] for p in pages[:3])
+        assert all('total' in p['timings'] for p in pages)
+        assert not any('log' in p for p in pages)
+
+    def test_chunks_are_contiguous_and_complete(self):
+        chunks = _chunks(list(range(10)), 4)
+        assert [i for chunk in chunks for i in chunk] == list(range(10))
+        assert len(chunks) == 4
+
+    def test_text_is_handed_over_before_images_render(self):
+        pool = PdfPagePool(workers=1)
+        progress, at_text = [], []
+        pages = pool.extract(
+            _image_pdf(3), PageSettings(dpi=30, max_vision_pages=3),
+            on_page=lambda page, done, total: progress.append((done, total)),
+            on_text=lambda pages: at_text.extend(bool(p['image']) for p in pages))
+        assert progress == [(1, 3), (2, 3), (3, 3)]
+        # No OCR engine here: nothing is rendered until the image pass
+        assert at_text == [False, False, False]
+        assert all(p['image'] for p in pages)
+        assert all('render' in p['timings'] for p in pages)
+
+
+class TestPerPageOcr:
+    """OCR only where the text layer is poor, reusing the OCR bitmap."""
+
+    def test_scanned_pages_are_ocrd_and_typed_pages_are_not(self, monkeypatch):
+        bitmaps = []
+
+        def fake_ocr(pil_img):
+            bitmaps.append(pil_img)
+            return 'Scanned clause text recovered by optical character recognition'
+
+        monkeypatch.setattr(pdf_extract, '_ocr_engine', lambda: ('fake', fake_ocr))
+        pool = PdfPagePool(workers=1)
+        pages = pool.extract(_mixed_pdf(['text', 'scan', 'scan', 'text']),
+                             PageSettings(dpi=30, max_vision_pages=2))
+        assert [p['ocr'] for p in pages] == [False, True, True, False]
+        assert 'landlord' in pages[0]['text']
+        assert pages[1]['text'].startswith('Scanned clause')
+        # Only the two scanned pages were rendered for OCR; page 2's bitmap
+        # became its vision image, page 1's clean text needs none
+        assert len(bitmaps) == 2
+        assert pages[0]['image'] is None and pages[1]['image']
+        assert [p['rendered'] for p in pages] == [False, True, False, False]
+        assert [p['vision'] for p in pages] == [None, 'poor text', None, None]
+        assert [p['ocr_engine'] for p in pages] == [None, 'fake', 'fake', None]
+
+    def test_ocr_loses_to_a_better_text_layer(self, monkeypatch):
+        monkeypatch.setattr(pdf_extract, '_ocr_engine', lambda: ('fake', lambda img: '~~ ## ~~'))
+        pages = PdfPagePool(workers=1).extract(
+            _mixed_pdf(['scan']), PageSettings(dpi=30, max_vision_pages=0))
+        assert pages[0]['ocr'] is False
+        assert 'ocr' in pages[0]['timings']
+
+
+class TestLazyRendering:
+    """Only pages with poor text or a visual layout are drawn."""
+
+    def test_clean_text_pages_are_not_rendered(self):
+        pages = PdfPagePool(workers=1).extract(
+            _mixed_pdf(['text', 'columns', 'table', 'scan']), PageSettings(dpi=30))
+        assert [p['vision'] for p in pages] == [None, 'columns', 'tables', 'poor text']
+        assert [bool(p['image']) for p in pages] == [False, True, True, True]
+
+    def test_eager_renders_every_vision_page(self):
+        pages = PdfPagePool(workers=1).extract(
+            _mixed_pdf(['text', 'text', 'text']), PageSettings(dpi=30, max_vision_pages=2, eager=True))
+        assert [bool(p['image']) for p in pages] == [True, True, False]
+        assert pages[0]['vision'] is None
+
+    def test_pages_render_later_from_a_path(self, tmp_path):
+        path = tmp_path / 'doc.pdf'
+        path.write_bytes(_mixed_pdf(['text', 'text']))
+        pool = PdfPagePool(workers=1)
+        pages = pool.extract(str(path), PageSettings(dpi=30))
+        assert not any(p['image'] for p in pages)
+        # Pages past the end are skipped
+        images = pool.render(str(path), [0, 1, 5], PageSettings(dpi=30))
+        assert sorted(images) == [0, 1]
+        assert all(images.values())
@@ -55,6 +55,12 @@ class TestCardPrompts:
         assert '---BEGIN DOCUMENT---' in result
         assert '---END DOCUMENT---' in result
 
+    def test_single_card_system_without_document(self):
+        """Without doc_text the document travels as the shared cached prefix."""
+        result = build_single_card_system()
+        assert '---BEGIN DOCUMENT---' not in result
+        assert build_single_card_system('test').startswith(result)
+
     def test_single_card_system_has_trick_categories(self):
         result = build_single_card_system('test')
         assert 'Silent Waiver' in result
@@ -0,0 +1,195 @@
+"""Unit tests for the adaptive rate limiter in services/rate_limiter.py."""
+
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.rate_limiter import (
+    AdaptiveLimiter,
+    CircuitOpenError,
+    RateLimiterRegistry,
+    call_with_backoff,
+    classify_error,
+    retry_after_seconds,
+)
+
+
+class FakeClock:
+    """Manual clock; sleep() advances time instead of blocking."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f'Error code: {status_code}')
+        self.status_code = status_code
+        self.response = FakeResponse(headers or {})
+
+
+def make_limiter(clock, **kwargs):
+    return AdaptiveLimiter('haiku', clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestClassifyError:
+
+    def test_overload_codes(self):
+        assert classify_error(FakeAPIError(429)) == 'overload'
+        assert classify_error(FakeAPIError(529)) == 'overload'
+        assert classify_error(Exception('Overloaded')) == 'overload'
+
+    def test_server_and_client(self):
+        assert classify_error(FakeAPIError(500)) == 'server'
+        assert classify_error(FakeAPIError(400)) == 'client'
+        assert classify_error(ValueError('bad')) == 'client'
+
+    def test_retry_after_headers(self):
+        assert retry_after_seconds(FakeAPIError(429, {'retry-after': '7'})) == 7.0
+        assert retry_after_seconds(FakeAPIError(429, {'retry-after-ms': '1500'})) == 1.5
+        assert retry_after_seconds(ValueError('x')) is None
+
+
+class TestAdaptiveLimiter:
+
+    def test_token_bucket_paces_after_burst(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, rate=2.0, burst=2)
+        limiter.acquire()
+        limiter.acquire()
+        assert clock.slept == []
+        limiter.acquire()  # bucket empty: must wait ~0.5s at 2/s
+        assert sum(clock.slept) == pytest.approx(0.5)
+
+    def test_aimd_rate(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, rate=4.0, increase=1.0, decrease=0.5, min_requests=100)
+        limiter.record_error(FakeAPIError(529))
+        assert limiter.rate == 2.0
+        limiter.record_success()
+        assert limiter.rate == 3.0
+
+    def test_retry_after_pauses_whole_model(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, min_requests=100)
+        retry, wait = limiter.record_error(FakeAPIError(429, {'retry-after': '10'}))
+        assert retry is True
+        assert wait >= 10
+        limiter.acquire()
+        assert sum(clock.slept) == pytest.approx(10, abs=0.01)
+
+    def test_backoff_is_exponential_with_jitter(self):
+        limiter = make_limiter(FakeClock(), backoff_base=4.0, backoff_cap=60.0)
+        for attempt, (lo, hi) in enumerate([(2, 4), (4, 8), (8, 16)]):
+            waits = {limiter.backoff(attempt) for _ in range(20)}
+            assert all(lo <= w <= hi for w in waits)
+            assert len(waits) > 1  # jittered, not lockstep
+
+    def test_client_errors_are_not_retried(self):
+        limiter = make_limiter(FakeClock())
+        assert limiter.record_error(FakeAPIError(400)) == (False, 0.0)
+        assert limiter.stats()['overloads'] == 0
+
+    def test_circuit_opens_then_recovers_via_probe(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, min_requests=4, error_threshold=0.5, cooldown=30)
+        for _ in range(4):
+            limiter.record_error(FakeAPIError(529))
+        assert limiter.state == 'open'
+        with pytest.raises(CircuitOpenError):
+            limiter.acquire()
+        clock.now += 31
+        limiter.acquire()  # the single half-open probe
+        assert limiter.state == 'half_open'
+        with pytest.raises(CircuitOpenError):
+            limiter.acquire()
+        limiter.record_success()
+        assert limiter.state == 'closed'
+        limiter.acquire()
+
+    def test_rejected_caller_does_not_release_the_probe(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, min_requests=2, cooldown=5)
+        limiter.record_error(FakeAPIError(529))
+        limiter.record_error(FakeAPIError(529))
+        clock.now += 6
+        limiter.acquire()  # the probe, still in flight
+        with pytest.raises(CircuitOpenError) as rejected:
+            limiter.acquire()
+        assert limiter.record_error(rejected.value) == (False, 0.0)
+        with pytest.raises(CircuitOpenError):
+            limiter.reserve()
+        assert limiter.state == 'half_open'
+
+    def test_client_error_frees_only_its_own_probe(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, min_requests=2, cooldown=5)
+        limiter.record_error(FakeAPIError(529))
+        limiter.record_error(FakeAPIError(529))
+        clock.now += 6
+        probe = object()
+        limiter.acquire(probe)
+        assert limiter.record_error(FakeAPIError(400), holder=object()) == (False, 0.0)
+        with pytest.raises(CircuitOpenError):
+            limiter.reserve()
+        limiter.record_error(FakeAPIError(400), holder=probe)
+        assert limiter.reserve() == 0.0  # the next probe is let through
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, min_requests=2, cooldown=5)
+        limiter.record_error(FakeAPIError(529))
+        limiter.record_error(FakeAPIError(529))
+        clock.now += 6
+        limiter.acquire()
+        limiter.record_error(FakeAPIError(529))
+        assert limiter.state == 'open'
+        assert limiter.stats()['circuit_opens'] == 2
+
+
+class TestCallWithBackoff:
+
+    def test_retries_overload_then_succeeds(self, monkeypatch):
+        monkeypatch.setattr('services.rate_limiter.time.sleep', lambda s: None)
+        limiter = make_limiter(FakeClock(), min_requests=100)
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) < 3:
+                raise FakeAPIError(529)
+            return 'ok'
+
+        assert call_with_backoff(limiter, fn) == 'ok'
+        assert len(calls) == 3
+        assert limiter.stats()['overloads'] == 2
+        assert limiter.stats()['retries'] == 2
+
+    def test_client_error_raises_immediately(self):
+        limiter = make_limiter(FakeClock())
+        with pytest.raises(FakeAPIError):
+            call_with_backoff(limiter, lambda: (_ for _ in ()).throw(FakeAPIError(400)))
+
+
+class TestRateLimiterRegistry:
+
+    def test_one_limiter_per_model(self):
+        reg = RateLimiterRegistry(rate=3.0)
+        assert reg.get('a') is reg.get('a')
+        assert reg.get('a') is not reg.get('b')
+        assert reg.stats()['a']['rate_per_sec'] == 3.0
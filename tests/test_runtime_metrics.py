@@ -0,0 +1,79 @@
+"""Unit tests for the Prometheus-format exporter in services/runtime_metrics.py."""
+
+import sys
+import os
+import queue
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.runtime_metrics import RuntimeMetrics
+
+
+class TestRuntimeMetrics:
+    """Counters, gauges, histograms, collectors and watched queues."""
+
+    def test_counters_render_with_labels(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('sample_cache_requests_total', 'counter', 'Sample analyses')
+        metrics.inc('sample_cache_requests_total', result='hit')
+        metrics.inc('sample_cache_requests_total', result='hit')
+        text = metrics.render()
+        assert '# TYPE flipside_sample_cache_requests_total counter' in text
+        assert 'flipside_sample_cache_requests_total{result="hit"} 2' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('extraction_seconds', 'histogram', 'Extraction', buckets=(1, 5))
+        for value in (0.5, 2, 7):
+            metrics.observe('extraction_seconds', value, type='pdf')
+        lines = metrics.render().splitlines()
+        assert 'flipside_extraction_seconds_bucket{type="pdf",le="1"} 1' in lines
+        assert 'flipside_extraction_seconds_bucket{type="pdf",le="5"} 2' in lines
+        assert 'flipside_extraction_seconds_bucket{type="pdf",le="+Inf"} 3' in lines
+        assert 'flipside_extraction_seconds_sum{type="pdf"} 9.5' in lines
+        assert 'flipside_extraction_seconds_count{type="pdf"} 3' in lines
+
+    def test_track_holds_a_gauge_while_open(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('sse_connections', 'gauge', 'Open SSE connections')
+        key = (('route', 'analyze'),)
+        with metrics.track('sse_connections', route='analyze'):
+            assert metrics.snapshot()['sse_connections'][key] == 1
+        assert metrics.snapshot()['sse_connections'][key] == 0
+
+    def test_collectors_are_read_on_scrape(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('documents', 'gauge', 'Documents')
+        store = {'n': 1}
+        metrics.add_collector(lambda: [('documents', {}, store['n'])])
+        assert 'flipside_documents 1' in metrics.render()
+        store['n'] = 4
+        assert 'flipside_documents 4' in metrics.render()
+
+    def test_failing_collector_does_not_break_render(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('documents', 'gauge', 'Documents')
+        metrics.add_collector(lambda: 1 / 0)
+        assert '# TYPE flipside_documents gauge' in metrics.render()
+
+    def test_watched_queues_are_measured_until_collected(self):
+        metrics = RuntimeMetrics()
+        a = metrics.watch_queue('analysis', queue.Queue())
+        b = metrics.watch_queue('analysis', queue.Queue())
+        for item in range(3):
+            a.put(item)
+        b.put('x')
+        assert metrics.queue_depths() == {'analysis': (2, 4, 3)}
+        del a
+        assert metrics.queue_depths() == {'analysis': (1, 1, 1)}
+
+    def test_undeclared_or_mistyped_metrics_raise(self):
+        metrics = RuntimeMetrics()
+        metrics.describe('extraction_seconds', 'histogram', 'Extraction')
+        with pytest.raises(KeyError):
+            metrics.inc('nope')
+        with pytest.raises(KeyError):
+            metrics.inc('extraction_seconds')
+        with pytest.raises(ValueError):
+            metrics.describe('bad-name', 'gauge', 'Bad')
@@ -0,0 +1,106 @@
+"""Unit tests for the shared LLM scheduler in services/scheduler.py."""
+
+import sys
+import os
+import time
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.scheduler import LLMScheduler
+
+
+class TestLLMScheduler:
+    """Per-model concurrency caps and occupancy reporting."""
+
+    def test_submit_returns_result(self):
+        sched = LLMScheduler(max_workers=2, limits={'haiku': 1})
+        assert sched.submit('haiku', lambda x: x * 2, 21).result(timeout=5) == 42
+
+    def test_per_model_limit_is_enforced(self):
+        sched = LLMScheduler(max_workers=8, limits={'opus': 2})
+        peak = [0]
+        running = [0]
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        futures = [sched.submit('opus', call) for _ in range(6)]
+        for f in futures:
+            f.result(timeout=5)
+        assert peak[0] == 2
+
+    def test_models_do_not_share_slots(self):
+        sched = LLMScheduler(max_workers=4, limits={'opus': 1, 'haiku': 1})
+        gate = threading.Event()
+        blocker = sched.submit('opus', gate.wait, 5)
+        # Haiku must still run while the only Opus slot is held
+        assert sched.submit('haiku', lambda: 'ok').result(timeout=2) == 'ok'
+        gate.set()
+        blocker.result(timeout=5)
+
+    def test_flooded_model_does_not_starve_the_pool(self):
+        sched = LLMScheduler(max_workers=4, limits={'opus': 2, 'haiku': 2})
+        gate = threading.Event()
+        # Far more Opus work than pool threads, all of it stuck upstream
+        opus = [sched.submit('opus', gate.wait, 5) for _ in range(20)]
+        time.sleep(0.05)
+        stats = sched.stats()
+        assert stats['pool_active'] == 2
+        assert stats['models']['opus']['waiting'] == 18
+        haiku = [sched.submit('haiku', lambda i=i: i) for i in range(10)]
+        assert [f.result(timeout=2) for f in haiku] == list(range(10))
+        gate.set()
+        for f in opus:
+            f.result(timeout=5)
+        assert sched.stats()['models']['opus']['in_flight'] == 0
+
+    def test_exceptions_reach_the_future(self):
+        sched = LLMScheduler(max_workers=1, limits={'haiku': 1})
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            sched.submit('haiku', fail).result(timeout=2)
+        assert sched.submit('haiku', lambda: 'next').result(timeout=2) == 'next'
+
+    def test_inline_slot_shares_semaphore_with_pool(self):
+        sched = LLMScheduler(max_workers=2, limits={'opus': 1})
+        with sched.slot('opus'):
+            future = sched.submit('opus', lambda: 'ran')
+            time.sleep(0.05)
+            assert not future.done()
+            assert sched.stats()['models']['opus']['waiting'] == 1
+        assert future.result(timeout=2) == 'ran'
+        assert sched.stats()['models']['opus']['max_wait_ms'] >= 40
+
+    def test_claimed_slot_is_shared_with_pool(self):
+        sched = LLMScheduler(max_workers=2, limits={'opus': 1})
+        sched.claim('opus').result(timeout=2)
+        future = sched.submit('opus', lambda: 'ran')
+        waiting = sched.claim('opus')
+        time.sleep(0.05)
+        assert not future.done() and not waiting.done()
+        assert waiting.cancel()  # gave up before its turn: takes no slot
+        sched.release('opus')
+        assert future.result(timeout=2) == 'ran'
+        sched.claim('opus').result(timeout=2)
+        assert sched.stats()['models']['opus']['in_flight'] == 1
+
+    def test_stats_shape(self):
+        sched = LLMScheduler(max_workers=3, limits={'opus': 2}, default_limit=5)
+        sched.submit('unknown-model', lambda: None).result(timeout=2)
+        stats = sched.stats()
+        assert stats['pool_size'] == 3
+        assert stats['submitted'] == 1
+        assert stats['pool_active'] == 0
+        assert stats['models']['unknown-model']['limit'] == 5
+        assert stats['models']['unknown-model']['acquired'] == 1
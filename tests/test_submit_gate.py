@@ -0,0 +1,81 @@
+"""Tests for _SubmitGate and _CardBatch in app.py: work held back before it takes a model slot."""
+
+import sys
+import os
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flipside
+from services.scheduler import LLMScheduler
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    sched = LLMScheduler(max_workers=2, limits={'opus': 1})
+    monkeypatch.setattr(flipside, 'llm_scheduler', sched)
+    return sched
+
+
+class TestSubmitGate:
+    """Held submissions take neither a slot nor a pool thread."""
+
+    def test_held_until_open(self, scheduler):
+        gate = flipside._SubmitGate(30)
+        ran = []
+        done = threading.Event()
+        gate.submit('opus', lambda: (ran.append('held'), done.set()))
+        assert scheduler.stats()['submitted'] == 0 and not ran
+        # The slot is free for other work while the submission is held
+        assert scheduler.submit('opus', lambda: 'ok').result(timeout=2) == 'ok'
+        assert gate.open() == 1
+        assert done.wait(timeout=2) and ran == ['held']
+        # Once open, submissions go straight through
+        gate.submit('opus', ran.append, 'late')
+        assert scheduler.submit('opus', lambda: None).result(timeout=2) is None
+        assert ran == ['held', 'late']
+
+    def test_timeout_releases_and_reports(self, scheduler):
+        timed_out = []
+        gate = flipside._SubmitGate(0.05, timed_out.append)
+        done = threading.Event()
+        gate.submit('opus', lambda: None)
+        gate.submit('opus', done.set)
+        assert done.wait(timeout=2)
+        assert timed_out == [2]
+        assert gate.open() == 0
+
+    def test_zero_timeout_never_holds(self, scheduler):
+        gate = flipside._SubmitGate(0)
+        done = threading.Event()
+        gate.submit('opus', done.set)
+        assert done.wait(timeout=2)
+
+
+class TestCardBatch:
+    """Cards after the first wait for it outside the scheduler."""
+
+    def test_cards_are_held_until_card_0_primes(self, scheduler, monkeypatch):
+        monkeypatch.setattr(flipside, 'CARD_PRIME_SECONDS', 30)
+        batch = flipside._CardBatch()
+        ran = []
+        first = threading.Event()
+        batch.submit(0, 'haiku', lambda: (ran.append(0), first.set()))
+        assert first.wait(timeout=2)
+        batch.submit(1, 'haiku', ran.append, 1)
+        batch.submit(2, 'haiku', ran.append, 2)
+        assert scheduler.stats()['submitted'] == 1
+        batch.prime()
+        assert scheduler.submit('haiku', lambda: None).result(timeout=2) is None
+        assert sorted(ran) == [0, 1, 2]
+        assert batch.prime_timeouts == 0
+
+    def test_prime_timeout_is_counted_per_card(self, scheduler, monkeypatch):
+        monkeypatch.setattr(flipside, 'CARD_PRIME_SECONDS', 0.05)
+        batch = flipside._CardBatch()
+        done = threading.Event()
+        batch.submit(1, 'haiku', lambda: None)
+        batch.submit(2, 'haiku', done.set)
+        assert done.wait(timeout=2)
+        assert batch.prime_timeouts == 2
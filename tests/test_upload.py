@@ -0,0 +1,211 @@
+"""Tests for upload spooling, the size ceiling, multi-photo uploads and
+vision pages in app.py."""
+
+import sys
+import os
+import json
+from io import BytesIO
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flipside
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(flipside, 'UPLOAD_SPOOL_DIR', str(tmp_path))
+    # No prescan: these tests never reach the API
+    monkeypatch.setattr(flipside, 'prescan_launcher', lambda doc_id: None)
+    return flipside.app.test_client()
+
+
+TEXT = b'This lease agreement is between the landlord and the tenant.\n' * 20
+
+
+class TestUploadSpooling:
+    """Uploads land in named files on disk and are read from there."""
+
+    def test_files_are_spooled_to_named_files(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(flipside, 'UPLOAD_SPOOL_DIR', str(tmp_path))
+        with flipside.app.test_request_context(
+                '/upload', method='POST', data={'file': (BytesIO(TEXT), 'lease.txt')}):
+            stream = flipside.request.files['file'].stream
+            assert os.path.dirname(stream.name) == str(tmp_path)
+            assert flipside._stream_path(stream) == stream.name
+            assert stream.read() == TEXT
+
+    def test_sync_upload_reads_the_spool(self, client):
+        resp = client.post('/upload', data={'file': (BytesIO(TEXT), 'lease.txt')})
+        assert resp.status_code == 200
+        assert resp.get_json()['text_length'] == len(TEXT)
+
+    def test_async_job_owns_its_file_and_removes_it(self, client, tmp_path):
+        resp = client.post('/upload', data={'file': (BytesIO(TEXT), 'lease.txt'), 'async': '1'})
+        assert resp.status_code == 202
+        body = client.get(resp.get_json()['progress_url']).get_data(as_text=True)
+        events = [json.loads(line[6:])['type'] for line in body.splitlines()
+                  if line.startswith('data: ')]
+        assert events[-1] == 'ready' and 'text' in events
+        assert flipside.documents.get(resp.get_json()['doc_id'])['text'] == TEXT.decode()
+        # Neither the request's spool file nor the job's link is left behind
+        assert os.listdir(tmp_path) == []
+
+
+class TestUploadCeiling:
+    """Oversized uploads are refused without being buffered."""
+
+    def test_declared_length_over_the_ceiling(self, client, monkeypatch):
+        monkeypatch.setitem(flipside.app.config, 'MAX_CONTENT_LENGTH', 1000)
+        resp = client.post('/upload', data={'file': (BytesIO(TEXT * 2), 'big.txt')})
+        assert resp.status_code == 413
+        assert 'too large' in resp.get_json()['error']
+
+    def test_chunked_body_is_cut_off_while_streaming(self, client, monkeypatch):
+        monkeypatch.setitem(flipside.app.config, 'MAX_CONTENT_LENGTH', 1000)
+        boundary = 'xyz'
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+                f'filename="big.txt"\r\n\r\n').encode() + TEXT * 2 + f'\r\n--{boundary}--\r\n'.encode()
+        resp = client.post('/upload', input_stream=BytesIO(body),
+                           content_type=f'multipart/form-data; boundary={boundary}',
+                           environ_overrides={'wsgi.input_terminated': True})
+        assert resp.status_code == 413
+
+
+def _photo(width):
+    from PIL import Image
+    buf = BytesIO()
+    Image.new('RGB', (width, 40), 'white').save(buf, format='PNG')
+    buf.seek(0)
+    return buf
+
+
+@pytest.fixture
+def photos(monkeypatch, tmp_path_factory):
+    """Page blobs and the extraction cache in a temp dir; each photo
+    'transcribes' to its width, the narrower ones finishing last."""
+    from PIL import Image
+    from services import BlobStore, ExtractionCache
+    import time
+
+    store = tmp_path_factory.mktemp('photos')
+    blobs = BlobStore(str(store / 'blobs'))
+    monkeypatch.setattr(flipside, '_page_blobs', blobs)
+    monkeypatch.setattr(flipside, '_extraction_cache', ExtractionCache(str(store / 'cache')))
+
+    def transcribe(digest):
+        with Image.open(blobs.path(digest)) as img:
+            width = img.size[0]
+        time.sleep(0.05 / width)
+        return f'width {width}'
+
+    monkeypatch.setattr(flipside, '_transcribe_image', transcribe)
+    return blobs
+
+
+class TestMultiImageUpload:
+    """Several photos make one document, one page per photo."""
+
+    def test_pages_are_stitched_in_upload_order(self, client, photos):
+        resp = client.post('/upload', data={'file': [
+            (_photo(10), 'p1.png'), (_photo(20), 'p2.png'), (_photo(30), 'p3.png')]})
+        assert resp.status_code == 200
+        text = resp.get_json()['full_text']
+        assert text == ('\u2014 Page 1 \u2014\n\nwidth 10\n\n'
+                        '\u2014 Page 2 \u2014\n\nwidth 20\n\n'
+                        '\u2014 Page 3 \u2014\n\nwidth 30')
+        doc = flipside.documents.get(resp.get_json()['doc_id'])
+        assert len(doc['page_images']) == 3
+        assert doc['vision_pages'] == [0, 1, 2]
+        assert all(photos.path(ref) for ref in doc['page_images'])
+
+    def test_async_job_reports_pages_and_removes_its_files(self, client, photos, tmp_path):
+        resp = client.post('/upload', data={'async': '1', 'file': [
+            (_photo(10), 'p1.png'), (_photo(20), 'p2.png')]})
+        assert resp.status_code == 202
+        body = client.get(resp.get_json()['progress_url']).get_data(as_text=True)
+        events = [json.loads(line[6:]) for line in body.splitlines() if line.startswith('data: ')]
+        pages = [e['content'] for e in events if e['type'] == 'pages']
+        assert pages[-1] == {'done': 2, 'total': 2}
+        assert events[-1]['type'] == 'ready'
+        doc = flipside.documents.get(resp.get_json()['doc_id'])
+        assert 'width 20' in doc['text'] and len(doc['page_images']) == 2
+        assert os.listdir(tmp_path) == []
+
+    def test_an_unreadable_page_fails_the_upload(self, client, photos, monkeypatch):
+        transcribe = flipside._transcribe_image
+
+        def fail_wide(digest):
+            text = transcribe(digest)
+            return None if text == 'width 20' else text
+
+        monkeypatch.setattr(flipside, '_transcribe_image', fail_wide)
+        resp = client.post('/upload', data={'file': [
+            (_photo(10), 'p1.png'), (_photo(20), 'p2.png'), (_photo(30), 'p3.png')]})
+        assert resp.status_code == 400
+        assert 'page 2 of 3' in resp.get_json()['error']
+
+    def test_a_single_photo_has_no_page_markers(self, client, photos):
+        resp = client.post('/upload', data={'file': (_photo(10), 'p1.png')})
+        assert resp.get_json()['full_text'] == 'width 10'
+
+    def test_several_files_must_all_be_photos(self, client, photos):
+        resp = client.post('/upload', data={'file': [
+            (_photo(10), 'p1.png'), (BytesIO(TEXT), 'lease.txt')]})
+        assert resp.status_code == 400
+        assert 'photos' in resp.get_json()['error']
+
+    def test_photo_count_is_capped(self, client, photos, monkeypatch):
+        monkeypatch.setattr(flipside, 'MAX_UPLOAD_IMAGES', 2)
+        resp = client.post('/upload', data={'file': [
+            (_photo(10), f'p{i}.png') for i in range(3)]})
+        assert resp.status_code == 400
+
+
+@pytest.fixture
+def sqlite_docs(monkeypatch, tmp_path):
+    """A SQLite document store, a retained PDF and a renderer that never
+    opens it (every requested page renders to b'page N')."""
+    from services import BlobStore
+    from services.document_store import SQLiteDocumentStore
+    store = SQLiteDocumentStore(str(tmp_path / 'docs.db'))
+    monkeypatch.setattr(flipside, 'documents', store)
+    monkeypatch.setattr(flipside, '_page_blobs', BlobStore(str(tmp_path / 'pages')))
+    sources = BlobStore(str(tmp_path / 'pdfs'), suffix='.pdf')
+    monkeypatch.setattr(flipside, '_pdf_sources', sources)
+    monkeypatch.setattr(flipside.pdf_page_pool, 'render',
+                        lambda path, pages, settings: {i: f'page {i}'.encode() for i in pages})
+    pdf_digest = sources.put(b'%PDF-1.4')
+    store.put('vision-doc', {'text': 'Lease.', 'filename': 'lease.pdf',
+                             'pdf_digest': pdf_digest, 'vision_pages': [1]})
+    return store
+
+
+class TestVisionPages:
+    """Vision state goes through the document store, not the live dict."""
+
+    def test_vision_request_survives_the_next_get(self, sqlite_docs):
+        doc = sqlite_docs.get('vision-doc')
+        text_key = flipside._document_analysis_key(doc)
+        flipside._request_vision('vision-doc', doc)
+        doc = sqlite_docs.get('vision-doc')
+        assert doc['_vision_requested']
+        assert doc['_analysis_key'] != text_key
+
+    def test_rendered_pages_are_stored(self, sqlite_docs):
+        images = flipside._vision_pages('vision-doc', sqlite_docs.get('vision-doc'))
+        assert images[0] is None and images[1]
+        assert sqlite_docs.get('vision-doc')['page_images'] == images
+        with flipside._page_blobs.read(images[1]) as data:
+            assert data[:] == b'page 1'
+
+    def test_evicted_photo_pages_are_reported(self, sqlite_docs):
+        blobs = flipside._page_blobs
+        pages = [blobs.put(b'photo 1'), blobs.put(b'photo 2')]
+        sqlite_docs.put('photo-doc', {'text': 'Lease.', 'filename': 'p1.png',
+                                      'page_images': pages, 'vision_pages': [0, 1]})
+        os.remove(blobs.path(pages[1]))
+        lost = sum(flipside.runtime_metrics.snapshot().get('page_images_lost_total', {}).values())
+        images = flipside._vision_pages('photo-doc', sqlite_docs.get('photo-doc'))
+        assert images == [pages[0], None]
+        assert sum(flipside.runtime_metrics.snapshot()['page_images_lost_total'].values()) == lost + 1